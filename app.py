@@ -19,6 +19,7 @@ from recording_manager import RecordingManager
 from test_manager import TestManager
 from emotibit_streamer_2 import EmotiBitStreamer
 from vernier_manager import VernierManager
+from event_manager import EventManager
 from ser_manager3 import SERManager
 from audio_file_manager import AudioFileManager
 from form_manager import FormManager
@@ -31,6 +32,9 @@ emotibit_thread = None
 
 PORT_NUMBER = 8000
 EMOTIBIT_PORT_NUMBER = 9005
+RECORDING_START_TIMEOUT = 10 # seconds
+VERNIER_BACKEND = 'godirect'  # 'ble' streams the belt with the asyncio BLE backend (vernier_ble.py)
+VERNIER_DEVICES = None  # Names of the Vernier devices to stream, e.g. ["GDX-RB 0K1000A1"]; None takes the nearest device
 
 # Class instances stored in global scope 
 # NOTE: These could be moved to Flask g instance to further reduce global access
@@ -42,8 +46,13 @@ audio_file_manager = AudioFileManager('tmp/recording.wav', 'tmp') # tmp folder i
 ser_manager = SERManager()
 form_manager = FormManager()
 timestamp_manager = TimestampManager()
-vernier_manager = VernierManager()
+vernier_manager = VernierManager(backend=VERNIER_BACKEND, device_names=VERNIER_DEVICES)
 transcription_manager = TranscriptionManager()
+event_manager = EventManager()
+
+# The sensors follow the session's event marker and condition
+event_manager.subscribe(emotibit_streamer.set_event)
+event_manager.subscribe(vernier_manager.set_event)
 
 update_message = None
 update_event = threading.Event()
@@ -64,6 +73,9 @@ def process_audio_files() -> Response:
    
     data_rows = []
 
+    # Recordings may still be on their way to the audio folder
+    audio_file_manager.flush()
+
     # TODO: CHECK TO SEE IF THE METADATA IS NEEDED FOR THIS CSV
     subject_id = subject_manager.subject_id
     audio_folder = audio_file_manager.audio_folder
@@ -159,12 +171,11 @@ def get_subject_id():
 
 @app.route('/set_condition', methods=['POST'])
 def set_condition() -> Response:
-    global emotibit_streamer, vernier_manager
+    global event_manager, emotibit_streamer
     data = request.get_json()
     condition = data.get('condition')
     try:
-        emotibit_streamer.condition = condition
-        vernier_manager.condition = condition
+        event_manager.condition = condition
 
         print("Condition set to: ", emotibit_streamer.condition)
 
@@ -175,12 +186,11 @@ def set_condition() -> Response:
     
 @app.route('/set_event_marker', methods=['POST'])
 def set_event_marker():
-    global emotibit_streamer, vernier_manager
+    global event_manager
     data = request.get_json()
     event_marker = data.get('event_marker')
     try:
-        emotibit_streamer.event_marker = event_marker
-        vernier_manager.event_marker = event_marker
+        event_manager.event_marker = event_marker
 
         # DEBUG
         print("Event marker set to: ", event_marker)
@@ -336,7 +346,7 @@ def get_first_question() -> Response:
         if questions is None:
             return jsonify({"message": "No questions found."})
         else:
-            recording_manager.start_recording()
+            recording_manager.start_recording(keep_audio=True)
             question = questions[test_manager.current_question_index]
             
             return jsonify({'message': 'Question found.', 'question': question['question'], "test_index": test_manager.current_test_index})
@@ -372,7 +382,7 @@ def confirm_transcription() -> Response:
         else:
             print("Recording stopped. Transcribing....")
             
-            test_manager.current_answer = transcribe_audio(audio_file_manager.recording_file)
+            test_manager.current_answer = transcribe_audio(recorded_audio())
 
             
 
@@ -425,8 +435,7 @@ def process_answer() -> Response:
         if test_ended:
             recording_manager.stop_recording()
             print("Recording stopped. Transcribing....")
-            time.sleep(0.1)
-            transcription = transcribe_audio(audio_file_manager.recording_file)
+            transcription = transcribe_audio(recorded_audio())
 
             if test_manager.current_test_index != 0:
                 ts = recording_manager.timestamp
@@ -476,7 +485,7 @@ def process_answer() -> Response:
             
             print(f"Result: {result}")
             print("Starting the recording...")
-            recording_manager.start_recording()
+            recording_manager.start_recording(keep_audio=True)
 
             return jsonify({'status': 'Answer successfuly processed', 'message': 'Recording started...', 'result': result})
 
@@ -708,7 +717,7 @@ def submit() -> Response:
         - On success: Returns a JSON object with a success message and URLs for the PSS10, exit, and demographics surveys, with a 200 status code.
         - On failure: Returns a JSON object with an error message, with a 400 status code.
     """
-    global subject_manager, form_manager, audio_file_manager, emotibit_streamer, vernier_manager
+    global subject_manager, form_manager, audio_file_manager, emotibit_streamer, vernier_manager, event_manager
 
     experiment_name = subject_manager.experiment_name
     trial_name = subject_manager.trial_name
@@ -742,6 +751,10 @@ def submit() -> Response:
             vernier_manager.set_data_folder(subject_manager.subject_folder) 
             vernier_manager.set_filenames(subject_id)
 
+            event_manager.set_data_folder(subject_manager.subject_folder)
+            event_manager.set_filenames(subject_id)
+            event_manager.initialize_hdf5_file()
+
             pss10 = form_manager.get_custom_url("pss10", subject_manager.subject_id)
             exit_survey = form_manager.get_custom_url("exit", subject_manager.subject_id)
             demographics = form_manager.get_custom_url("demographics", subject_manager.subject_id)
@@ -827,7 +840,7 @@ def test_audio() -> Response:
     global recording_manager
     try:
         recording_manager.stop_recording()
-        transcription = transcribe_audio(recording_manager.recording_file)    
+        transcription = transcribe_audio(recorded_audio())    
       
         return jsonify({'result': transcription})
 
@@ -871,7 +884,7 @@ def record_task_audio():
         - If action is 'stop':  {"message": "Recording stopped."}, 200
         - If action is invalid: {"message": "Invalid action."}, 400
     """
-    global recording_manager, timestamp_manager, subject_manager, vernier_manager
+    global recording_manager, timestamp_manager, subject_manager, event_manager
     data = request.get_json()
     action = data.get('action')
     question = data.get('question')
@@ -882,14 +895,10 @@ def record_task_audio():
     try:
         if action == 'start':
             recording_manager.start_recording()
-            emotibit_streamer.event_marker = event_marker
-            vernier_manager.event_marker = event_marker
+            event_manager.event_marker = event_marker
 
-            start_time = 10 # seconds
-            while not recording_manager.stream_is_active:
-                if time.time() - start_time > 10:
-                    return jsonify({'message': 'Error starting recording.'}), 400
-                time.sleep(0.5)
+            if not recording_manager.wait_until_recording(timeout=RECORDING_START_TIMEOUT):
+                return jsonify({'message': 'Error starting recording.'}), 400
 
             return jsonify({'message': 'Recording started...'}), 200
         
@@ -931,7 +940,7 @@ def record_task() -> Response:
                    with a 400 HTTP status code.
     """
     global recording_manager, subject_manager, audio_file_manager
-    global timestamp_manager, emotibit_streamer, vernier_manager
+    global timestamp_manager, emotibit_streamer, vernier_manager, event_manager
 
     try:
         data = request.get_json()
@@ -941,10 +950,7 @@ def record_task() -> Response:
         
         if action == 'start':
             recording_manager.start_recording()
-            emotibit_streamer.event_marker = event_marker
-            emotibit_streamer.condition = condition
-            vernier_manager.event_marker = event_marker
-            vernier_manager.condition = condition
+            event_manager.set(event_marker, condition)
 
              # DEBUG
             print(f"EmbotiBit Event Marker: {emotibit_streamer.event_marker}")
@@ -956,10 +962,7 @@ def record_task() -> Response:
         
         elif action == 'stop':
             recording_manager.stop_recording()
-            emotibit_streamer.event_marker = 'subject_idle'
-            emotibit_streamer.condition = 'None'
-            vernier_manager.event_marker = 'subject_idle'
-            vernier_manager.condition = 'None'
+            event_manager.set('subject_idle', 'None')
             
             # DEBUG
             print(f"EmbotiBit Event Marker: {emotibit_streamer.event_marker}")
@@ -1010,14 +1013,10 @@ def record_task() -> Response:
 def start_recording() -> Response:
     global recording_manager
     try:
-        recording_manager.start_recording()
-        start_time = time.time()
+        recording_manager.start_recording(keep_audio=True)
 
-        timeout = 10 # seconds
-        while not recording_manager.stream_is_active:
-            if time.time() - start_time > timeout:
-                return jsonify({'status': 'Error starting recording.'}), 400
-            time.sleep(0.5)
+        if not recording_manager.wait_until_recording(timeout=RECORDING_START_TIMEOUT):
+            return jsonify({'status': 'Error starting recording.'}), 400
 
         return jsonify({'status': 'Recording started.'}), 200
     except Exception as e:
@@ -1272,7 +1271,8 @@ def stop_vernier() -> None:
         print("Stopping Vernier stream from app...")
         stop_result = vernier_manager.stop()
         print(stop_result)
-        return jsonify({'message': stop_result}), 200
+        export_job = vernier_manager.export_job
+        return jsonify({'message': stop_result, 'export': export_job.to_dict() if export_job else None}), 200
         
     except Exception as e:
         print(f"An error occurred while trying to stop Vernier stream: {str(e)}")
@@ -1304,9 +1304,9 @@ def stop_emotibit() -> None:
     global emotibit_streamer
     try:
         if emotibit_streamer.is_streaming:
-            emotibit_streamer.stop()
+            export_job = emotibit_streamer.stop()
             print("OSC server stopped.")
-            return jsonify({'message': 'EmotiBit stream stopped.'}), 200
+            return jsonify({'message': 'EmotiBit stream stopped.', 'export': export_job.to_dict() if export_job else None}), 200
         else:
             return jsonify({'message': 'EmotiBit stream is not active.'}), 400
         
@@ -1314,6 +1314,50 @@ def stop_emotibit() -> None:
         print(f"An error occurred while trying to stop OSC stream: {str(e)}")
         return jsonify({'error': 'Error stopping EmotiBit stream.'}), 400
 
+@app.route('/get_emotibit_stats', methods=['GET'])
+def get_emotibit_stats() -> Response:
+    global emotibit_streamer
+    return jsonify(emotibit_streamer.get_queue_stats()), 200
+
+@app.route('/get_audio_level', methods=['GET'])
+def get_audio_level() -> Response:
+    global recording_manager
+    return jsonify(recording_manager.get_audio_level()), 200
+
+@app.route('/get_recording_stats', methods=['GET'])
+def get_recording_stats() -> Response:
+    global recording_manager
+    return jsonify(recording_manager.get_capture_stats()), 200
+
+@app.route('/get_archive_status', methods=['GET'])
+def get_archive_status() -> Response:
+    global audio_file_manager
+    return jsonify(audio_file_manager.get_archive_status()), 200
+
+@app.route('/get_vernier_stats', methods=['GET'])
+def get_vernier_stats() -> Response:
+    global vernier_manager
+    return jsonify(vernier_manager.get_stats()), 200
+
+@app.route('/get_emotibit_metrics', methods=['GET'])
+def get_emotibit_metrics() -> Response:
+    global emotibit_streamer
+    return jsonify(emotibit_streamer.get_derived_metrics()), 200
+
+@app.route('/get_events', methods=['GET'])
+def get_events() -> Response:
+    """The session's event marker/condition intervals, optionally filtered by ?event_marker= and ?condition=."""
+    global event_manager
+    intervals = event_manager.intervals(request.args.get('event_marker'), request.args.get('condition'))
+    return jsonify({'events': intervals}), 200
+
+@app.route('/get_export_status', methods=['GET'])
+def get_export_status() -> Response:
+    """Status of the most recent background HDF5-to-CSV exports."""
+    global emotibit_streamer, vernier_manager
+    jobs = {'emotibit': emotibit_streamer.export_job, 'vernier': vernier_manager.export_job}
+    return jsonify({name: job.to_dict() if job else None for name, job in jobs.items()}), 200
+
 @app.route('/submit_pwd', methods=['POST'])
 def submit_pwd() -> Response:
     password = "ucsdxrlab"
@@ -1367,8 +1411,9 @@ def check_answer(transcription, correct_answers) -> bool:
     return any(word in correct_answers for word in transcription.split())
 
 def shutdown_server() -> None:
-    global emotibit_streamer, recording_manager, vernier_manager
+    global emotibit_streamer, recording_manager, vernier_manager, event_manager, audio_file_manager
 
+    recording_manager.close_input_stream()
     if recording_manager.audio is not None:
         recording_manager.audio.terminate()
         
@@ -1378,6 +1423,9 @@ def shutdown_server() -> None:
     if vernier_manager.device_started and vernier_manager.running:
         vernier_manager.stop()
 
+    audio_file_manager.flush()
+    event_manager.close_h5_file()
+
     time.sleep(1)
     pid = os.getpid()
     os.kill(pid, signal.SIGINT)
@@ -1422,8 +1470,30 @@ def generate_timestamps(start_time_dt, segment_duration=20, output_folder="tmp/"
 ##################################################################
 ## Speech Recognition 
 ##################################################################
+def recorded_audio():
+    """
+    The last recording as float32 16 kHz samples if it was kept in memory by the recording
+    manager, otherwise the path of the recording file. If the file was not saved in time,
+    the path of what was written so far; None if the file was already moved away by
+    save_audio_file().
+    """
+    global recording_manager
+    if recording_manager.wait_until_saved():
+        audio = recording_manager.get_resampled_audio()
+        if audio is not None:
+            return audio
+    else:
+        print("Recording file was not saved in time; using what was written.")
+
+    if not os.path.exists(recording_manager.recording_file):
+        print(f"Recording file '{recording_manager.recording_file}' is no longer available.")
+        return None
+    return recording_manager.recording_file
+
 def transcribe_audio(file, timeout_seconds=15) -> str:
     global transcription_manager
+    if file is None:
+        return "Sorry, I could not understand the response."
     
     with ThreadPoolExecutor(max_workers=1) as executor:
         try:
@@ -1433,7 +1503,8 @@ def transcribe_audio(file, timeout_seconds=15) -> str:
             return result if result is not None else "Sorry, I could not understand the response."
             
         except FutureTimeoutError:
-            print(f"Transcription timed out after {timeout_seconds} seconds for file: {file}")
+            source = file if isinstance(file, str) else "in-memory recording"
+            print(f"Transcription timed out after {timeout_seconds} seconds for file: {source}")
             executor.shutdown(wait=False, cancel_futures=True)  # Force cleanup
             return "Sorry, I could not understand the response."
             
@@ -1,15 +1,43 @@
 import os
+import itertools
+import threading
+import time
+from collections import deque
 import numpy as np 
 import wave
 import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
 
 class AudioFileManager:
     """
     The audio processor class is responsible for handling audio processing functions.
+
+    Audio files are archived to the audio folder by a background queue, so request
+    handlers never wait on disk I/O. save_audio_file() only renames the recording
+    aside (a '.saving' snapshot next to it); a pool of ARCHIVE_WORKERS threads then
+    moves each file to its destination, with a rename if both are on the same
+    filesystem and a copy otherwise. Archived files (and their folders) are fsynced
+    in batches of FSYNC_BATCH files, or FSYNC_INTERVAL seconds after the first
+    unsynced file. get_archive_status() reports the progress; flush() waits for it.
     """
+    SNAPSHOT_SUFFIX = '.saving'
+    ARCHIVE_WORKERS = 4
+    FSYNC_BATCH = 8
+    FSYNC_INTERVAL = 2.0
+    ARCHIVE_HISTORY = 100
+
     def __init__(self, recording_file, audio_save_folder) -> None:
         self._recording_file = recording_file
         self._audio_folder = audio_save_folder
+        self._executor = ThreadPoolExecutor(max_workers=self.ARCHIVE_WORKERS, thread_name_prefix="audio_archive")
+        self._archive_lock = threading.Lock()
+        self._snapshot_ids = itertools.count()
+        self._futures = []
+        self._in_flight = set()
+        self._jobs = deque(maxlen=self.ARCHIVE_HISTORY)
+        self._counts = {"queued": 0, "archived": 0, "synced": 0, "failed": 0}
+        self._unsynced = []
+        self._sync_timer = None
 
         print("Audio File Manager initialized...")
         print("Audio folder will be set to 'subject_data/<experiment_name>/<trial_name>/<subject_folder>/audio_files' when the subject is created.")
@@ -43,9 +71,9 @@ class AudioFileManager:
         try:
             os.makedirs(self.audio_folder, exist_ok=True)
             new_filename = os.path.join(self.audio_folder, new_filename)
-            shutil.copy(self.recording_file, new_filename)
-
-            print(f"File '{self.recording_file}' saved as {new_filename} in {self.audio_folder}.")
+            snapshot = f"{self.recording_file}.{next(self._snapshot_ids)}{self.SNAPSHOT_SUFFIX}"
+            os.replace(self.recording_file, snapshot)
+            self.archive(snapshot, new_filename)
         except PermissionError:
             print(f"Permission denied: Unable to save file '{self.recording_file}'. Check file permissions.")
         except FileNotFoundError:
@@ -53,6 +81,121 @@ class AudioFileManager:
         except Exception as e:
             print(f"An error occurred while trying to save the file '{self.recording_file}': {str(e)}")
 
+    ##################################################################
+    ## ARCHIVAL QUEUE
+    ##################################################################
+    def archive(self, source, destination) -> dict:
+        """
+        Queue moving 'source' to 'destination' and return immediately.
+        Returns:
+            dict: The job ('source', 'destination', 'status', 'error'), updated as it runs.
+                  None if 'source' is already queued.
+        """
+        job = {"source": source, "destination": destination, "status": "queued", "error": None,
+               "queued": time.time(), "finished": None}
+        with self._archive_lock:
+            if source in self._in_flight:
+                return None
+            self._in_flight.add(source)
+            self._jobs.append(job)
+            self._counts["queued"] += 1
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(self._executor.submit(self._archive_job, job))
+        return job
+
+    def _archive_job(self, job) -> None:
+        source, destination = job["source"], job["destination"]
+        try:
+            job["status"] = "running"
+            destination_folder = os.path.dirname(os.path.abspath(destination))
+            if os.stat(source).st_dev == os.stat(destination_folder).st_dev:
+                os.replace(source, destination)
+            else:
+                shutil.copy2(source, destination)
+                os.remove(source)
+
+            job["status"] = "archived"
+            print(f"File '{source}' saved as {destination} in {destination_folder}.")
+            with self._archive_lock:
+                self._counts["archived"] += 1
+                self._unsynced.append(job)
+                due = len(self._unsynced) >= self.FSYNC_BATCH
+                if not due and self._sync_timer is None:
+                    self._sync_timer = threading.Timer(self.FSYNC_INTERVAL, self._sync_archived)
+                    self._sync_timer.daemon = True
+                    self._sync_timer.start()
+            if due:
+                self._sync_archived()
+
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            print(f"An error occurred while trying to save the file '{destination}': {str(e)}")
+            with self._archive_lock:
+                self._counts["failed"] += 1
+        finally:
+            job["finished"] = time.time()
+            with self._archive_lock:
+                self._counts["queued"] -= 1
+                self._in_flight.discard(source)
+
+    def _sync_archived(self) -> None:
+        """fsync the archived files of the current batch and the folders holding them."""
+        with self._archive_lock:
+            batch, self._unsynced = self._unsynced, []
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+
+        folders = set()
+        for job in batch:
+            try:
+                self._fsync(job["destination"])
+                folders.add(os.path.dirname(os.path.abspath(job["destination"])))
+                job["status"] = "synced"
+            except OSError as e:
+                print(f"Error syncing '{job['destination']}': {e}")
+
+        # The renames are only durable once the folder entries are
+        for folder in folders:
+            try:
+                self._fsync(folder)
+            except OSError:
+                pass  # Folders cannot be opened for fsync on Windows
+
+        with self._archive_lock:
+            self._counts["synced"] += sum(1 for job in batch if job["status"] == "synced")
+
+    @staticmethod
+    def _fsync(path) -> None:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Wait for the queued archives and sync them to disk.
+        Returns:
+            bool: True if all of them finished within 'timeout' seconds.
+        """
+        with self._archive_lock:
+            pending = list(self._futures)
+        _, not_done = wait(pending, timeout=timeout)
+        self._sync_archived()
+        return not not_done
+
+    def get_archive_status(self) -> dict:
+        """Returns the number of queued, archived, synced and failed files and the most recent jobs."""
+        with self._archive_lock:
+            counts = dict(self._counts)
+            jobs = [dict(job) for job in self._jobs]
+        counts["unsynced"] = counts["archived"] - counts["synced"]
+        counts["failures"] = [job for job in jobs if job["status"] == "failed"]
+        counts["recent"] = jobs[-10:]
+        return counts
+
     def delete_recording_file(self, file_path) -> None:
         try:
             if os.path.exists(file_path):
@@ -73,25 +216,17 @@ class AudioFileManager:
         return filename
 
     def backup_tmp_audio_files(self) -> None:
+        """Queue the files left in tmp/ (e.g. task audio segments) for archival to the audio folder."""
         tmp_folder = "tmp/"
-        
-        for file_name in os.listdir(tmp_folder):
-            if file_name == os.path.basename(self.recording_file):
-                continue
+        os.makedirs(self.audio_folder, exist_ok=True)
 
-            full_path = os.path.join(tmp_folder, file_name)
-            
-            if os.path.isfile(full_path):
-                shutil.copy(full_path, self.audio_folder)
-        
-        for file_name in os.listdir(tmp_folder):
-            if file_name == os.path.basename(self.recording_file):
-                continue
+        with os.scandir(tmp_folder) as entries:
+            for entry in entries:
+                if entry.name == os.path.basename(self.recording_file) or entry.name.endswith(self.SNAPSHOT_SUFFIX):
+                    continue
 
-            full_file_name = os.path.join(tmp_folder, file_name)
-            
-            if os.path.isfile(full_file_name):
-                os.remove(full_file_name)
+                if entry.is_file():
+                    self.archive(entry.path, os.path.join(self.audio_folder, entry.name))
 
     def get_audio_chunk_as_np(self, offset=0, duration=None, sample_rate=16000) -> np.array:
         """
@@ -0,0 +1,103 @@
+from math import gcd
+import numpy as np
+import scipy.signal as signal
+
+"""
+Streaming polyphase resampler for the live audio of RecordingManager. It uses
+the same anti-aliasing FIR filter as scipy.signal.resample_poly (Kaiser window,
+beta 5, 10 zero crossings per side), but keeps the last input samples between
+calls, so chunks of any size can be fed as they are captured and the output is
+the same as resampling the whole recording at once. Only the output samples are
+computed: each one is the dot product of one filter phase with the most recent
+input samples. The filter delay is compensated, so output sample k is at time
+k / out_rate like the input; flush() returns the tail that needs the last inputs.
+"""
+
+class StreamingResampler:
+    def __init__(self, in_rate: int, out_rate: int) -> None:
+        """
+        Args:
+            in_rate (int): Sample rate of the input (the capture rate), in Hz.
+            out_rate (int): Sample rate of the output, in Hz.
+        """
+        divisor = gcd(int(in_rate), int(out_rate))
+        self.in_rate = int(in_rate)
+        self.out_rate = int(out_rate)
+        self.up = self.out_rate // divisor
+        self.down = self.in_rate // divisor
+
+        max_rate = max(self.up, self.down)
+        if max_rate > 1:
+            half_len = 10 * max_rate
+            taps = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * self.up
+        else:
+            # Equal rates pass the input through (see process())
+            half_len = 0
+            taps = np.ones(1)
+
+        # Phase p holds taps p, p + up, p + 2 up, ... (zero padded to a whole number per phase)
+        self._taps_per_phase = -(-len(taps) // self.up)
+        padded = np.zeros(self._taps_per_phase * self.up)
+        padded[:len(taps)] = taps
+        self._phases = padded.reshape(self._taps_per_phase, self.up).T.astype(np.float32)
+        self._delay = half_len
+
+        # The input before the first sample is silence
+        self._history = np.zeros(self._taps_per_phase - 1, dtype=np.float32)
+        self._samples_in = 0
+        self._samples_out = 0
+
+    @property
+    def passthrough(self) -> bool:
+        return self.up == self.down
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Resample the next chunk of input.
+        Args:
+            samples (np.ndarray): int16 or float samples; int16 is scaled to [-1, 1).
+        Returns:
+            np.ndarray: The float32 output samples that the input received so far determines.
+        """
+        samples = np.asarray(samples)
+        if samples.dtype == np.int16:
+            samples = samples.astype(np.float32) / 32768.0
+        else:
+            samples = samples.astype(np.float32, copy=False)
+
+        if self.passthrough:
+            self._samples_in += len(samples)
+            self._samples_out += len(samples)
+            return samples
+
+        buffer = np.concatenate((self._history, samples))
+        base = self._samples_in - len(self._history)  # Input index of buffer[0]
+        self._samples_in += len(samples)
+
+        # Output k needs the inputs up to (k * down + delay) // up
+        last = (self._samples_in * self.up - 1 - self._delay) // self.down
+        outputs = np.arange(self._samples_out, last + 1, dtype=np.int64)
+        if len(outputs):
+            positions = outputs * self.down + self._delay
+            newest = positions // self.up - base
+            window = newest[:, None] - np.arange(self._taps_per_phase)[None, :]
+            result = np.einsum('ij,ij->i', self._phases[positions % self.up], buffer[window])
+            self._samples_out = int(outputs[-1]) + 1
+        else:
+            result = np.zeros(0, dtype=np.float32)
+
+        self._history = buffer[len(buffer) - len(self._history):]
+        return result.astype(np.float32, copy=False)
+
+    def flush(self) -> np.ndarray:
+        """Returns the remaining output, as if the input were followed by silence."""
+        total = -(-self._samples_in * self.up // self.down)
+        remaining = total - self._samples_out
+        if remaining <= 0 or self.passthrough:
+            return np.zeros(0, dtype=np.float32)
+
+        samples_in = self._samples_in
+        tail = self.process(np.zeros(self._delay // self.up + self._taps_per_phase + 1, dtype=np.float32))
+        self._samples_in = samples_in
+        self._samples_out = total
+        return tail[:remaining]
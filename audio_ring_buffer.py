@@ -0,0 +1,135 @@
+import threading
+import numpy as np
+
+"""
+Preallocated ring buffer between the audio capture callback and its consumers
+(the recording file writer, the level meter, streaming transcription, ...).
+There is a single writer, the PortAudio callback, which only copies the chunk
+into the buffer and then publishes the new total frame count; it never takes a
+lock, so it cannot be held up by a slow consumer. Every consumer has its own
+read position. A consumer that falls more than the buffer capacity behind loses
+the oldest frames: the loss is counted as an overrun and the consumer resumes
+at the oldest frame still in the buffer.
+"""
+
+class _Consumer:
+    __slots__ = ('position', 'overruns', 'dropped_frames', 'event')
+
+    def __init__(self, position: int) -> None:
+        self.position = position
+        self.overruns = 0
+        self.dropped_frames = 0
+        self.event = threading.Event()
+
+class AudioRingBuffer:
+    def __init__(self, capacity_frames: int, dtype='int16') -> None:
+        """
+        Args:
+            capacity_frames (int): Number of (mono) frames the buffer holds.
+            dtype: Sample type of the captured audio (int16 for paInt16).
+        """
+        self.capacity = int(capacity_frames)
+        self.dtype = np.dtype(dtype)
+        self._buffer = np.zeros(self.capacity, dtype=self.dtype)
+        self._written = 0  # Total frames written since the buffer was created
+        self._consumers = {}
+
+    @property
+    def frames_written(self) -> int:
+        return self._written
+
+    def write(self, data) -> None:
+        """Copy a chunk (bytes or array) into the buffer. Called by the capture callback only."""
+        frames = np.frombuffer(data, dtype=self.dtype) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        count = len(frames)
+        if count > self.capacity:
+            frames = frames[-self.capacity:]
+
+        start = (self._written + count - len(frames)) % self.capacity
+        first = min(len(frames), self.capacity - start)
+        self._buffer[start:start + first] = frames[:first]
+        self._buffer[:len(frames) - first] = frames[first:]
+
+        # Publish the frames only once they are in the buffer
+        self._written += count
+        for consumer in list(self._consumers.values()):
+            consumer.event.set()
+
+    def add_consumer(self, name: str, position: int = None) -> int:
+        """
+        Register a consumer. It reads the frames written from 'position' (a frame count,
+        see frames_written) on, or from now on if None. A position in the past is clamped
+        to the oldest frame still in the buffer.
+        Returns:
+            int: The position the consumer starts at.
+        """
+        written = self._written
+        position = written if position is None else min(max(position, written - self.capacity, 0), written)
+        self._consumers[name] = _Consumer(position)
+        return position
+
+    def remove_consumer(self, name: str) -> None:
+        self._consumers.pop(name, None)
+
+    def wait(self, name: str, timeout: float = None) -> bool:
+        """Wait until new frames were written since the consumer's last wait. Returns False on timeout."""
+        consumer = self._consumers[name]
+        ready = consumer.event.wait(timeout)
+        consumer.event.clear()
+        return ready
+
+    def wake(self) -> None:
+        """Wake all waiting consumers, e.g. once the capture has finished."""
+        for consumer in list(self._consumers.values()):
+            consumer.event.set()
+
+    def read(self, name: str, end: int = None) -> np.ndarray:
+        """
+        Returns (a copy of) the frames written since the consumer's last read, up to
+        the frame count 'end' if given.
+        """
+        consumer = self._consumers[name]
+        written = self._written if end is None else max(min(end, self._written), consumer.position)
+        position = self._skip_overrun(consumer, consumer.position, written)
+        data = self._copy(position, written)
+
+        # The writer may have lapped the start of the range while it was copied
+        overwritten = self._written - self.capacity - position
+        if overwritten > 0:
+            self._count_overrun(consumer, overwritten)
+            data = data[overwritten:]
+
+        consumer.position = written
+        return data
+
+    def latest(self, frames: int) -> np.ndarray:
+        """Returns the last 'frames' frames written, without consuming anything."""
+        written = self._written
+        frames = min(frames, written, self.capacity)
+        return self._copy(written - frames, written)
+
+    def stats(self) -> dict:
+        """Returns the overruns and dropped frames of every consumer."""
+        return {
+            name: {"overruns": consumer.overruns, "dropped_frames": consumer.dropped_frames,
+                   "pending_frames": self._written - consumer.position}
+            for name, consumer in list(self._consumers.items())
+        }
+
+    def _skip_overrun(self, consumer: _Consumer, position: int, written: int) -> int:
+        behind = written - position
+        if behind > self.capacity:
+            self._count_overrun(consumer, behind - self.capacity)
+            return written - self.capacity
+        return position
+
+    @staticmethod
+    def _count_overrun(consumer: _Consumer, frames: int) -> None:
+        consumer.overruns += 1
+        consumer.dropped_frames += frames
+
+    def _copy(self, start: int, end: int) -> np.ndarray:
+        count = end - start
+        offset = start % self.capacity
+        first = min(count, self.capacity - offset)
+        return np.concatenate((self._buffer[offset:offset + first], self._buffer[:count - first]))
@@ -0,0 +1,191 @@
+import threading
+import time
+import numpy as np
+from signal_filters import StreamingFilter
+
+"""
+Live derived metrics (HRV and respiration rate) computed from the EmotiBit
+beat interval (BI) and PPG streams. Samples are kept in preallocated ring
+buffers; RMSSD is updated incrementally per beat, PPG is band-pass filtered
+block by block as it arrives and the spectral respiration rate is only
+recomputed every 'rr_hop' seconds, so the per-sample cost stays constant
+regardless of the window length.
+"""
+
+class RingBuffer:
+    """Fixed-capacity float64 ring buffer backed by a preallocated numpy array."""
+    def __init__(self, capacity: int) -> None:
+        self._data = np.zeros(capacity, dtype='f8')
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def append(self, value: float) -> float:
+        """Append a value. Returns the evicted value, or None if nothing was evicted."""
+        evicted = None
+        end = (self._start + self._size) % self._capacity
+        if self._size == self._capacity:
+            evicted = self._data[self._start]
+            self._start = (self._start + 1) % self._capacity
+        else:
+            self._size += 1
+        self._data[end] = value
+        return evicted
+
+    def extend(self, values) -> None:
+        values = np.asarray(values, dtype='f8')[-self._capacity:]
+        count = len(values)
+        end = (self._start + self._size) % self._capacity
+        first = min(count, self._capacity - end)
+        self._data[end:end + first] = values[:first]
+        self._data[:count - first] = values[first:]
+
+        overflow = max(0, self._size + count - self._capacity)
+        self._size = min(self._size + count, self._capacity)
+        self._start = (self._start + overflow) % self._capacity
+
+    def values(self) -> np.ndarray:
+        """Returns the buffered values in insertion order (a copy)."""
+        end = self._start + self._size
+        if end <= self._capacity:
+            return self._data[self._start:end].copy()
+        return np.concatenate((self._data[self._start:], self._data[:end - self._capacity]))
+
+    def clear(self) -> None:
+        self._start = 0
+        self._size = 0
+
+class DerivedMetricsEngine:
+    """
+    Maintains HRV (RMSSD) and respiration rate (RR) from streaming BI and PPG samples.
+    The add_* methods are meant to be called from a single thread (the streamer's
+    writer thread); get_latest() and subscribe() are safe to call from any thread.
+    Args:
+        ppg_fs (float): PPG sample rate in Hz.
+        rr_window (float): Length of the PPG window used for RR, in seconds.
+        rr_hop (float): Minimum time between RR recomputations, in seconds.
+        rr_band (tuple): Respiration band (low, high) in Hz.
+        rmssd_beats (int): Number of beat intervals in the RMSSD window.
+        min_beats (int): Beat intervals required before RMSSD is reported.
+        publish_interval (float): Time between published metrics, in seconds.
+        filter_order (int): Order of the Butterworth band-pass filter.
+    """
+    def __init__(self, ppg_fs: float = 25.0, rr_window: float = 30.0, rr_hop: float = 1.0,
+                 rr_band: tuple = (0.1, 0.5), rmssd_beats: int = 30, min_beats: int = 10,
+                 publish_interval: float = 1.0, filter_order: int = 4) -> None:
+        self.ppg_fs = ppg_fs
+        self.rr_hop = rr_hop
+        self.rr_band = rr_band
+        self.min_beats = min_beats
+        self.publish_interval = publish_interval
+        self._ppg_filter = StreamingFilter(filter_order, rr_band[0], rr_band[1], ppg_fs)
+        self._min_ppg_samples = int(ppg_fs / rr_band[0])  # One period of the slowest breathing rate
+        self._ppg = RingBuffer(int(rr_window * ppg_fs))
+        self._sq_diffs = RingBuffer(max(rmssd_beats - 1, 1))
+        self._sq_sum = 0.0
+        self._updates_since_resum = 0
+        self._last_bi = None
+        self._rmssd = None
+        self._rr = None
+        self._last_rr_time = 0.0
+        self._last_publish = 0.0
+        self._latest = {"timestamp_unix": None, "HRV": None, "RR": None}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def add_beat_intervals(self, values) -> None:
+        """Update RMSSD with new beat intervals (ms). O(1) per beat."""
+        for bi in values:
+            bi = float(bi)
+            if not np.isfinite(bi) or bi <= 0:
+                continue
+
+            if self._last_bi is not None:
+                sq_diff = (bi - self._last_bi) ** 2
+                evicted = self._sq_diffs.append(sq_diff)
+                self._sq_sum += sq_diff - (evicted if evicted is not None else 0.0)
+                self._updates_since_resum += 1
+
+                # Recompute the exact sum now and then so float error cannot accumulate
+                if self._updates_since_resum >= 1000:
+                    self._sq_sum = float(self._sq_diffs.values().sum())
+                    self._updates_since_resum = 0
+
+                if len(self._sq_diffs) + 1 >= self.min_beats:
+                    self._rmssd = float(np.sqrt(max(self._sq_sum, 0.0) / len(self._sq_diffs)))
+            self._last_bi = bi
+
+    def add_ppg(self, values) -> None:
+        """Band-pass filter PPG samples and append them to the RR window. RR itself is only recomputed in update()."""
+        self._ppg.extend(self._ppg_filter.process(values))
+
+    def update(self, now: float = None) -> dict:
+        """
+        Recompute RR if 'rr_hop' has elapsed and publish the metrics if 'publish_interval'
+        has elapsed. Returns the published metrics, or None if nothing was published.
+        """
+        now = time.time() if now is None else now
+        if now - self._last_rr_time >= self.rr_hop:
+            self._last_rr_time = now
+            self._rr = self._calculate_rr()
+
+        if now - self._last_publish < self.publish_interval:
+            return None
+
+        self._last_publish = now
+        metrics = {"timestamp_unix": now, "HRV": self._rmssd, "RR": self._rr}
+        with self._lock:
+            self._latest = metrics
+            subscribers = list(self._subscribers)
+
+        for callback in subscribers:
+            try:
+                callback(metrics)
+            except Exception as e:
+                print(f"Error in derived metrics subscriber: {e}")
+
+        return metrics
+
+    def _calculate_rr(self) -> float:
+        """Respiration rate (breaths per minute) from the dominant frequency in the respiration band."""
+        if len(self._ppg) < self._min_ppg_samples:
+            return None
+
+        filtered = self._ppg.values()
+        filtered -= filtered.mean()
+        spectrum = np.abs(np.fft.rfft(filtered))
+        freqs = np.fft.rfftfreq(len(filtered), 1 / self.ppg_fs)
+        band = (freqs >= self.rr_band[0]) & (freqs <= self.rr_band[1])
+        if not band.any():
+            return None
+
+        return float(freqs[band][np.argmax(spectrum[band])] * 60)
+
+    def get_latest(self) -> dict:
+        """Returns the most recently published metrics."""
+        with self._lock:
+            return dict(self._latest)
+
+    def subscribe(self, callback) -> None:
+        """Register a callback that receives every published metrics dictionary."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def reset(self) -> None:
+        """Clear all buffered samples and metrics, e.g. between sessions."""
+        self._ppg.clear()
+        self._ppg_filter.reset()
+        self._sq_diffs.clear()
+        self._sq_sum = 0.0
+        self._last_bi = None
+        self._rmssd = None
+        self._rr = None
+        with self._lock:
+            self._latest = {"timestamp_unix": None, "HRV": None, "RR": None}
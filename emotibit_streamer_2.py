@@ -1,7 +1,7 @@
 import csv
 import h5py
 import os
-from pythonosc import dispatcher, osc_server
+from pythonosc import dispatcher, osc_server, osc_packet
 from threading import Thread, Event
 import threading
 import numpy as np
@@ -11,7 +11,12 @@ import atexit
 from datetime import datetime, timezone, timedelta
 from collections import deque
 from timestamp_manager import TimestampManager
-import pandas as pd
+from derived_metrics import DerivedMetricsEngine
+import hdf5_export
+from hdf5_storage import (
+    BufferedHDF5Writer, LabelCodes, create_extendable_dataset, read_time_range, time_overlap,
+    EVENT_DTYPE, LABEL_CODE_DTYPE, STREAM_DTYPE
+)
 
 # TODO: Look into Neurokit 2 and EmotiBit tools for analysis
 """
@@ -20,9 +25,55 @@ All OSC addresses must be included in the oscOutputSettings.xml file. Some
 settings may not be present in the file, but the addresses can be included.
 A full list of type tags can be found here: 
 https://github.com/EmotiBit/EmotiBit_Docs/blob/master/Working_with_emotibit_data.md/#EmotiBit-data-types
+
+Two storage modes are supported:
+    "wide":    a single 'data' table with one sparse row per sample (EDA/HR/BI/PG columns).
+               event_marker and condition are stored as integer codes (see LabelCodes).
+               Rows are sorted by time within each write; earlier rows may overlap by up
+               to the table's 'time_overlap' attribute.
+    "streams": one float64 time + float32 value dataset per type tag under 'streams/',
+               plus an 'events' table of event marker/condition intervals.
 """
+class EmotiBitDispatcher(dispatcher.Dispatcher):
+    """
+    Hands every message of an OSC packet (a single message or a whole bundle) to
+    a batch handler in one call instead of invoking a handler per message.
+    """
+    def __init__(self, packet_handler) -> None:
+        super().__init__()
+        self._packet_handler = packet_handler
+
+    def call_handlers_for_packet(self, data: bytes, client_address) -> list:
+        try:
+            packet = osc_packet.OscPacket(data)
+        except osc_packet.ParseError:
+            return []
+
+        self._packet_handler([(timed_msg.message.address, timed_msg.message.params) for timed_msg in packet.messages])
+        return []
+
 class EmotiBitStreamer:
-    def __init__(self, port: int) -> None:
+    # OSC type tag -> column in the 'data' dataset
+    STREAM_COLUMNS = {"EDA": "EDA", "HR": "HR", "BI": "BI", "PPG:GRN": "PG"}
+
+    # Nominal sample rates (Hz) used to space the samples of a multi-value message.
+    # Type tags not listed here are spaced by the time since their previous message.
+    SAMPLE_RATES = {
+        "EDA": 15.0, "EA": 15.0, "EL": 15.0,
+        "PPG:RED": 25.0, "PPG:IR": 25.0, "PPG:GRN": 25.0,
+        "ACC:X": 25.0, "ACC:Y": 25.0, "ACC:Z": 25.0,
+        "GYRO:X": 25.0, "GYRO:Y": 25.0, "GYRO:Z": 25.0,
+        "MAG:X": 25.0, "MAG:Y": 25.0, "MAG:Z": 25.0,
+        "TEMP": 7.5, "T1": 7.5, "TH": 7.5
+    }
+    ADDRESS_PREFIX = "/EmotiBit/0/"
+
+    STORAGE_MODES = ("wide", "streams")
+
+    def __init__(self, port: int, queue_size: int = 20000, storage_mode: str = "wide") -> None:
+        if storage_mode not in self.STORAGE_MODES:
+            raise ValueError(f"Invalid storage mode '{storage_mode}'. Valid modes: {self.STORAGE_MODES}")
+
         self._ip = "127.0.0.1"
         self._port = port
         self.timestamp_manager = TimestampManager()
@@ -31,7 +82,11 @@ class EmotiBitStreamer:
         self.data_buffer = deque(maxlen=3000)
         self._event_marker = 'startup'
         self._condition = 'None'
-        self.dispatcher = dispatcher.Dispatcher()
+        self.marker_codes = LabelCodes('event_marker', [self._event_marker])
+        self.condition_codes = LabelCodes('condition', [self._condition])
+        self._event_marker_code = self.marker_codes.code(self._event_marker)
+        self._condition_code = self.condition_codes.code(self._condition)
+        self.dispatcher = EmotiBitDispatcher(self.packet_handler)
         self.dispatcher.map("/EmotiBit/0/*", self.generic_handler)
         self.server = osc_server.ThreadingOSCUDPServer((self._ip, self._port), self.dispatcher)
         self.server_thread = None
@@ -39,11 +94,33 @@ class EmotiBitStreamer:
         self.default_value = 0
         self._data_folder = None
         self.csv_filename = None
+        self.parquet_filename = None
         self.csv_writer = None
         self.lock = threading.Lock()
         self.hdf5_filename = None
         self.hdf5_file = None
         self.dataset = None
+        self.writer = None
+        self.storage_mode = storage_mode
+        self.stream_writers = {}
+        self.events_writer = None
+        self.export_job = None
+        self._event_lock = threading.Lock()
+        self._open_interval = None
+        self._pending_events = []
+        self.queue_size = queue_size
+        self._queue = deque()
+        self._queue_event = Event()
+        self._writer_stop = Event()
+        self._writer_thread = None
+        self._enqueued = 0
+        self._dropped = 0
+        self._high_water = 0
+        self._written = 0
+        self._last_sample_time = {}
+        self._last_row_time = None
+        self._time_overlap = 0.0
+        self.derived_metrics = DerivedMetricsEngine(ppg_fs=self.SAMPLE_RATES["PPG:GRN"])
         self._time_started = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         atexit.register(self.stop)
         print("Emotibit Initialized... ")
@@ -71,7 +148,7 @@ class EmotiBitStreamer:
     
     @condition.setter
     def condition(self, value: str) -> None:
-        self._condition = value
+        self.set_event(self._event_marker, value)
 
     @property 
     def event_marker(self) -> str:
@@ -79,7 +156,18 @@ class EmotiBitStreamer:
 
     @event_marker.setter
     def event_marker(self, value: str) -> None:
-        self._event_marker = value
+        self.set_event(value, self._condition)
+
+    def set_event(self, event_marker: str, condition: str) -> None:
+        """Set the event marker and condition together (an EventManager subscriber); a change opens one new interval."""
+        if (event_marker, condition) == (self._event_marker, self._condition):
+            return
+
+        self._event_marker = event_marker
+        self._event_marker_code = self.marker_codes.code(event_marker)
+        self._condition = condition
+        self._condition_code = self.condition_codes.code(condition)
+        self._mark_interval()
 
     def set_data_folder(self, subject_folder):
         self.data_folder = os.path.join(subject_folder, "emotibit_data")
@@ -96,6 +184,7 @@ class EmotiBitStreamer:
         current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
         self.hdf5_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_biometrics.h5")
         self.csv_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_biometrics.csv")
+        self.parquet_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_biometrics.parquet")
 
     def initialize_hdf5_file(self):
         """
@@ -104,24 +193,31 @@ class EmotiBitStreamer:
         """
         try:
             self.hdf5_file = h5py.File(self.hdf5_filename, 'a')  
-            if 'data' not in self.hdf5_file:  
+            if self.storage_mode == "streams":
+                self._initialize_streams_storage()
+            elif 'data' not in self.hdf5_file:  
+                # The ISO 'timestamp' column is derived from timestamp_unix at export time
                 dtype = np.dtype([
-                    ('timestamp_unix', 'f8'),  # Unix timestamp in milliseconds
-                    ('timestamp', h5py.string_dtype(encoding='utf-8')),
+                    ('timestamp_unix', 'f8'),  # Unix timestamp in seconds
                     ('EDA', 'f4'),
                     ('HR', 'f4'),
                     ('BI', 'f4'),
                     ('PG', 'f4'),
-                    ('event_marker', h5py.string_dtype(encoding='utf-8')),
-                    ('condition', h5py.string_dtype(encoding='utf-8'))
+                    ('event_marker', LABEL_CODE_DTYPE),
+                    ('condition', LABEL_CODE_DTYPE)
                 ])
-                self.dataset = self.hdf5_file.create_dataset(
-                    'data', shape=(0,), maxshape=(None,), dtype=dtype
-                )
+                self.dataset = create_extendable_dataset(self.hdf5_file, 'data', dtype)
             else:
                 self.dataset = self.hdf5_file['data']  
 
-            if "data" in self.hdf5_file:
+            if self.dataset is not None:
+                self.writer = BufferedHDF5Writer(self.dataset, index_field='timestamp_unix')
+                self._time_overlap = time_overlap(self.dataset)
+                self._load_label_codes()
+
+            if self.storage_mode == "streams":
+                print("Per-stream datasets will be created under 'streams' in the HDF5 file.")
+            elif "data" in self.hdf5_file:
                 print("Dataset 'data' found in the HDF5 file.")
             else:
                 print("Dataset 'data' not found in the HDF5 file.")
@@ -133,6 +229,62 @@ class EmotiBitStreamer:
         except Exception as e:
             print(f"Error initializing HDF5 file: {e}")
 
+    def _load_label_codes(self) -> None:
+        """Continue the label codes of the 'data' table (files are opened in append mode)."""
+        self.marker_codes = LabelCodes.from_dataset(self.dataset, 'event_marker')
+        self.condition_codes = LabelCodes.from_dataset(self.dataset, 'condition')
+        self._event_marker_code = self.marker_codes.code(self._event_marker)
+        self._condition_code = self.condition_codes.code(self._condition)
+        self._save_label_codes()
+
+    def _save_label_codes(self) -> None:
+        """Write new event marker/condition labels to the 'data' table. Must be called with self.lock held."""
+        if self.dataset is not None and self.dataset.dtype['event_marker'].kind == 'u':
+            self.marker_codes.save(self.dataset)
+            self.condition_codes.save(self.dataset)
+
+    def _initialize_streams_storage(self) -> None:
+        """Opens the 'streams' group and the 'events' table. Stream datasets are created on first sample."""
+        streams = self.hdf5_file.require_group('streams')
+        self.stream_writers = {
+            name: BufferedHDF5Writer(streams[name], index_field='timestamp_unix') for name in streams
+        }
+
+        if 'events' not in self.hdf5_file:
+            create_extendable_dataset(self.hdf5_file, 'events', EVENT_DTYPE, chunk_rows=64)
+        self.events_writer = BufferedHDF5Writer(self.hdf5_file['events'], block_rows=64)
+
+    def _stream_writer(self, stream_type: str) -> BufferedHDF5Writer:
+        writer = self.stream_writers.get(stream_type)
+        if writer is None:
+            dataset = create_extendable_dataset(self.hdf5_file['streams'], stream_type, STREAM_DTYPE)
+            writer = BufferedHDF5Writer(dataset, index_field='timestamp_unix')
+            self.stream_writers[stream_type] = writer
+        return writer
+
+    def _mark_interval(self) -> None:
+        """Closes the current event marker/condition interval and opens a new one (streams mode only)."""
+        if not self.is_streaming or self.storage_mode != "streams":
+            return
+
+        now = self.timestamp_manager.get_unix_fast()
+        with self._event_lock:
+            if self._open_interval is not None:
+                start, event_marker, condition = self._open_interval
+                self._pending_events.append((start, now, event_marker, condition))
+            self._open_interval = (now, self._event_marker, self._condition)
+
+    def _close_interval(self) -> None:
+        if self.storage_mode != "streams":
+            return
+
+        now = self.timestamp_manager.get_unix_fast()
+        with self._event_lock:
+            if self._open_interval is not None:
+                start, event_marker, condition = self._open_interval
+                self._pending_events.append((start, now, event_marker, condition))
+                self._open_interval = None
+
     def start(self) -> None:
         if self.server_thread and self.server_thread.is_alive():
             print("Server is already running.")
@@ -144,23 +296,57 @@ class EmotiBitStreamer:
         print(f"Starting server at {self._ip}:{self._port}")
 
         self.shutdown_event.clear()
+        self.timestamp_manager.resync_clock()
+        self.derived_metrics.reset()
+        self._last_sample_time = {}
+        self._last_row_time = None
+        self.start_writer()
 
         self.server_thread = Thread(target=self.server.serve_forever)
         self.server_thread.start()
         self.is_streaming = True
+        self._mark_interval()
+
+    def start_writer(self) -> None:
+        """Start the thread that drains the sample queue into the HDF5 file."""
+        if self._writer_thread and self._writer_thread.is_alive():
+            return
+
+        self._writer_stop.clear()
+        self._writer_thread = Thread(target=self._writer_loop, daemon=True)
+        self._writer_thread.start()
+
+    def stop_writer(self, timeout: float = 5.0) -> None:
+        """Stop the writer thread after it has drained everything still queued."""
+        if self._writer_thread is None:
+            return
+
+        self._writer_stop.set()
+        self._queue_event.set()
+        self._writer_thread.join(timeout=timeout)
+        self._writer_thread = None
 
     def close_h5_file(self):
         if self.hdf5_file:
+            self._write_pending_events()
+            self._save_label_codes()
+            for writer in [self.writer, self.events_writer, *self.stream_writers.values()]:
+                if writer is not None:
+                    writer.close()
             self.hdf5_file.flush()
             self.hdf5_file.close()
             self.hdf5_file = None  
             self.dataset = None    
+            self.writer = None
+            self.events_writer = None
+            self.stream_writers = {}
 
             return "HDF5 file closed."
         else:
             return "No HDF5 file to close."
 
-    def stop(self) -> None:
+    def stop(self) -> hdf5_export.ExportJob:
+        """Stop streaming, close the HDF5 file and start its CSV export. Returns the export job."""
         if self.server_thread:
             print(f"Stopping server at {self._ip}:{self._port}")
             self.shutdown_event.set()
@@ -169,16 +355,18 @@ class EmotiBitStreamer:
             self.server_thread.join(timeout=3.0)
             self.server_thread = None
             self.is_streaming = False
+            self._close_interval()
             print("EmotiBit OSC server stopped successfully.")
+            self.stop_writer()
+            print(f"EmotiBit queue stats: {self.get_queue_stats()}")
             print("Closing EmotiBit H5 file...")
 
             with self.lock:  # Ensure thread-safe access to the HDF5 file
                 self.close_h5_file()
                 print("EmotiBit H5 file closed.")
 
-            print("Converting EmotiBit H5 to CSV...")
-            self.hdf5_to_csv()
-            print("EmotiBit H5 file converted to CSV.")
+            self.export_files()
+            return self.export_job
             
         else:
             print("Server is not running.")
@@ -187,121 +375,345 @@ class EmotiBitStreamer:
     # Data Handlers
     ###########################################
     def generic_handler(self, address: str, *args) -> None:
-        """Generic handler for all incoming OSC messages."""
+        """Handler for a single OSC message. All values of the message are kept."""
+        self.packet_handler([(address, args)])
+
+    def packet_handler(self, messages: list) -> None:
+        """
+        Handler for all (address, values) messages of one OSC packet. This runs on the
+        OSC server's worker threads, so it only timestamps the packet and queues one
+        entry per message for the writer thread.
+        """
         if not self.is_streaming:
             # Bail out if stopping
             print("EmotiBitStreamer is not currently streaming. Please start the server first.")
             return
 
-        if not hasattr(self, 'timestamp_unix') or self.timestamp_unix != self.timestamp_manager.get_timestamp("unix"):
-            self.timestamp_unix = self.timestamp_manager.get_timestamp('unix')
+        timestamp_unix = self.timestamp_manager.get_unix_fast()
+        event_marker = self._event_marker_code
+        condition = self._condition_code
+        entries = []
+        for address, values in messages:
+            if not address.startswith(self.ADDRESS_PREFIX) or not values:
+                continue
 
-        if not hasattr(self, 'current_timestamp') or self.current_timestamp != self.timestamp_manager.get_timestamp("iso"):
-            self.current_timestamp = datetime.fromtimestamp(self.timestamp_unix).isoformat()
+            stream_type = address[len(self.ADDRESS_PREFIX):]
+            if self.storage_mode == "wide" and stream_type not in self.STREAM_COLUMNS:
+                continue
 
-        if not hasattr(self, 'current_row') or self.current_row["timestamp"] != self.current_timestamp:
-            self.current_row = {key: None for key in ["timestamp_unix", "timestamp", "EDA", "HR", "BI", "PG", "event_marker", "condition"]}
-        
-        stream_type = address.split('/')[-1]
-        timestamp = self.current_timestamp
-        timestamp_unix = self.timestamp_unix
-        value = args[0]
-        self.current_row["timestamp_unix"] = timestamp_unix
-        self.current_row["timestamp"] = timestamp
-        self.current_row["event_marker"] = self.event_marker
-        self.current_row["condition"] = self.condition
-
-        if stream_type == "EDA":
-            self.current_row["EDA"] = value
-        elif stream_type == "HR":
-            self.current_row["HR"] = value
-        elif stream_type == "BI":
-            self.current_row["BI"] = value
-        elif stream_type == "PPG:GRN":
-            self.current_row["PG"] = value
-
-        if any(self.current_row[key] is not None for key in ["EDA", "HR", "BI", "PG"]):
-            self.write_to_hdf5(self.current_row)
+            entries.append((stream_type, timestamp_unix, values, event_marker, condition))
+
+        if not entries:
+            return
+
+        if len(self._queue) + len(entries) > self.queue_size:
+            self._dropped += len(entries)
+            return
+
+        self._queue.extend(entries)
+        self._enqueued += len(entries)
+
+        depth = len(self._queue)
+        if depth > self._high_water:
+            self._high_water = depth
+
+        if not self._queue_event.is_set():
+            self._queue_event.set()
 
     ###########################################
-    # Utility Methods
+    # Writer Thread
     ###########################################
+    def _writer_loop(self) -> None:
+        """Drain queued messages into the HDF5 file until stopped and the queue is empty."""
+        while True:
+            self._queue_event.wait(timeout=min(0.5, self.derived_metrics.publish_interval))
+            self._queue_event.clear()
+            try:
+                self._drain_queue()
+            except Exception as e:
+                # Keep draining: a dead writer thread would let the queue fill and drop every message
+                print(f"Error draining EmotiBit queue: {e}")
+
+            if self._writer_stop.is_set() and not self._queue:
+                break
 
-    def write_to_hdf5(self, row: dict) -> None:
-        """Write the incoming dictionary to the HDF5 dataset as a single row."""
-        with self.lock:  # Ensure thread-safe access to the dataset
+    def _drain_queue(self) -> None:
+        entries = []
+        while True:
             try:
-                if self.hdf5_file is None or self.dataset is None:
-                    print("HDF5 file or dataset is not initialized.")
-                    return
-
-                new_data = np.zeros(1, dtype=self.dataset.dtype)  
-                new_data[0]['timestamp_unix'] = row.get('timestamp_unix', '')
-                new_data[0]['timestamp'] = row.get('timestamp', '')  
-                new_data[0]['EDA'] = row.get('EDA', np.nan)
-                new_data[0]['HR'] = row.get('HR', np.nan)
-                new_data[0]['BI'] = row.get('BI', np.nan)
-                new_data[0]['PG'] = row.get('PG', np.nan)
-                new_data[0]['event_marker'] = row.get('event_marker', '')
-                new_data[0]['condition'] = row.get('condition', '')
-
-                new_size = self.dataset.shape[0] + 1
-                self._resize_dataset(new_size)  
-                self.dataset[-1] = new_data[0]
+                entries.append(self._queue.popleft())
+            except IndexError:
+                break
+
+        metrics = self._update_derived_metrics(entries)
+
+        with self.lock:
+            if metrics is not None and self.storage_mode == "streams":
+                self._write_derived_metrics(metrics)
+
+            if self.storage_mode == "streams":
+                self.write_streams(entries)
+                self._write_pending_events()
+            elif entries and self.dataset is not None:
+                # Packets that arrive before initialize_hdf5_file() or after close_h5_file() are dropped
+                rows = []
+                for entry in entries:
+                    rows.extend(self._rows_from_entry(entry))
+                # The messages of one packet share an arrival time, so interleave their samples by time
+                rows.sort(key=lambda row: row[0])
+                self.write_to_hdf5(rows)
+            elif self.writer is not None:
+                self.writer.flush_if_due()
+
+    def _update_derived_metrics(self, entries: list) -> dict:
+        """Feed BI and PPG samples to the derived metrics engine. Returns the metrics if they were published."""
+        for stream_type, _, values, _, _ in entries:
+            if stream_type == "BI":
+                self.derived_metrics.add_beat_intervals(values)
+            elif stream_type == "PPG:GRN":
+                self.derived_metrics.add_ppg(values)
+
+        return self.derived_metrics.update(self.timestamp_manager.get_unix_fast())
+
+    def _write_derived_metrics(self, metrics: dict) -> None:
+        """Append published HRV/RR values to the 'HRV' and 'RR' streams. Must be called with self.lock held."""
+        if self.hdf5_file is None:
+            return
 
-            except Exception as e:
-                print(f"Error writing to HDF5: {e}")
+        for stream_type in ("HRV", "RR"):
+            if metrics[stream_type] is not None:
+                self._stream_writer(stream_type).append((metrics["timestamp_unix"], metrics[stream_type]))
+
+    def get_derived_metrics(self) -> dict:
+        """Returns the latest published HRV (RMSSD, ms) and RR (breaths per minute)."""
+        return self.derived_metrics.get_latest()
 
-    def _resize_dataset(self, new_size):
-        """Resize the HDF5 dataset while ensuring thread synchronization."""
+    def _sample_times(self, stream_type: str, arrival: float, count: int) -> np.ndarray:
+        """
+        Interpolate per-sample timestamps for a message holding 'count' samples that arrived
+        at 'arrival'. The last sample is stamped with the arrival time and the others are
+        spaced by the nominal sample period, or by the time since the previous message.
+        If that would overlap the previous message of the type tag, the samples are spread
+        evenly since then instead, so the timestamps of each type tag keep increasing.
+        """
+        previous = self._last_sample_time.get(stream_type)
+        if previous is not None and arrival < previous:
+            # Packets stamped by different server threads can be queued slightly out of order
+            arrival = previous
+        self._last_sample_time[stream_type] = arrival
+
+        rate = self.SAMPLE_RATES.get(stream_type)
+        if count == 1:
+            times = np.array([arrival])
+        elif rate:
+            times = arrival - np.arange(count - 1, -1, -1) / rate
+        elif previous is not None and arrival > previous:
+            times = arrival - (arrival - previous) / count * np.arange(count - 1, -1, -1)
+        else:
+            times = np.full(count, arrival)
+
+        if previous is not None and times[0] <= previous:
+            times = previous + (arrival - previous) * np.arange(1, count + 1) / count
+        return times
+
+    def _rows_from_entry(self, entry: tuple) -> list:
+        """Convert a queued (stream_type, timestamp_unix, values, event_marker, condition) entry to 'data' rows."""
+        stream_type, arrival, values, event_marker, condition = entry
+        column = self.STREAM_COLUMNS[stream_type]
+        has_iso = 'timestamp' in self.dataset.dtype.names  # Files created before ISO strings were deferred to export
+        if self.dataset.dtype['event_marker'].kind == 'O':
+            # Files created before event markers and conditions were coded
+            event_marker = self.marker_codes.label(event_marker)
+            condition = self.condition_codes.label(condition)
+        rows = []
+        for timestamp_unix, value in zip(self._sample_times(stream_type, arrival, len(values)).tolist(), values):
+            row = (
+                value if column == "EDA" else np.nan,
+                value if column == "HR" else np.nan,
+                value if column == "BI" else np.nan,
+                value if column == "PG" else np.nan,
+                event_marker,
+                condition
+            )
+            if has_iso:
+                rows.append((timestamp_unix, datetime.fromtimestamp(timestamp_unix).isoformat()) + row)
+            else:
+                rows.append((timestamp_unix,) + row)
+        return rows
+
+    def get_queue_stats(self) -> dict:
+        """
+        Returns the queue depth and high-water mark (in messages) and the counters for
+        monitoring: 'enqueued' and 'dropped' count messages, 'written' counts samples.
+        """
+        return {
+            "queue_depth": len(self._queue),
+            "queue_size": self.queue_size,
+            "high_water": self._high_water,
+            "enqueued": self._enqueued,
+            "dropped": self._dropped,
+            "written": self._written
+        }
+
+    ###########################################
+    # Time-Range Queries
+    ###########################################
+
+    def read_time_range(self, start_unix: float, end_unix: float = None, stream: str = None):
+        """
+        Returns the recorded rows with start_unix <= timestamp_unix < end_unix, located by
+        binary search instead of scanning the file. Works while recording (pending rows are
+        flushed first) and after the file has been closed.
+        Args:
+            start_unix (float): Start of the range (inclusive).
+            end_unix (float): End of the range (exclusive). None reads to the end.
+            stream (str): Streams mode only: a single stream type, e.g. 'EDA'. None returns all streams.
+        Returns:
+            np.ndarray: The 'data' rows in wide mode or for a single stream, or
+            dict: Stream type -> rows in streams mode when 'stream' is None.
+        """
+        with self.lock:
+            if self.hdf5_file is not None:
+                return self._read_time_range(self.hdf5_file, start_unix, end_unix, stream, live=True)
+
+        if not self.hdf5_filename or not os.path.exists(self.hdf5_filename):
+            print("No EmotiBit HDF5 file to read.")
+            return None
+
+        with h5py.File(self.hdf5_filename, 'r') as h5_file:
+            return self._read_time_range(h5_file, start_unix, end_unix, stream, live=False)
+
+    def read_recent(self, seconds: float, stream: str = None):
+        """Returns the rows recorded in the last 'seconds' seconds (see read_time_range)."""
+        return self.read_time_range(self.timestamp_manager.get_unix_fast() - seconds, None, stream)
+
+    def _read_time_range(self, h5_file, start_unix: float, end_unix: float, stream: str, live: bool):
+        def read(dataset, writer):
+            if live and writer is not None:
+                writer.flush()
+                return read_time_range(dataset, start_unix, end_unix,
+                                       num_rows=writer.rows_written, index=writer.time_index)
+            return read_time_range(dataset, start_unix, end_unix)
+
+        if 'streams' not in h5_file:
+            if 'data' not in h5_file:
+                return None
+            return read(h5_file['data'], self.writer)
+
+        streams = h5_file['streams']
+        names = [stream] if stream is not None else list(streams)
+        rows = {
+            name: read(streams[name], self.stream_writers.get(name))
+            for name in names if name in streams
+        }
+        return rows.get(stream) if stream is not None else rows
+
+    ###########################################
+    # Utility Methods
+    ###########################################
+
+    def write_to_hdf5(self, rows: list) -> None:
+        """
+        Append a batch of 'data' rows (tuples in dtype field order, sorted by time) to the
+        buffered writer. Must be called with self.lock held.
+        """
+        try:
+            if self.hdf5_file is None or self.writer is None:
+                print("HDF5 file or dataset is not initialized.")
+                return
+
+            self._save_label_codes()
+            self.writer.append_rows(np.array(rows, dtype=self.dataset.dtype))
+            self._written += len(rows)
+            self._update_time_overlap(rows[0][0], rows[-1][0])
+
+        except Exception as e:
+            print(f"Error writing to HDF5: {e}")
+
+    def _update_time_overlap(self, first: float, last: float) -> None:
+        """
+        The samples of a multi-value message are spaced back from its arrival, so a batch
+        can start before rows written earlier. Record the largest such step back in the
+        'time_overlap' attribute (see hdf5_storage.read_time_range). Must be called with self.lock held.
+        """
+        if self._last_row_time is not None and self._last_row_time - first > self._time_overlap:
+            self._time_overlap = self._last_row_time - first
+            self.dataset.attrs['time_overlap'] = self._time_overlap
+        self._last_row_time = last if self._last_row_time is None else max(self._last_row_time, last)
+
+    def write_streams(self, samples: list) -> None:
+        """
+        Append queued messages to their per-stream datasets, one batch per stream type.
+        Must be called with self.lock held.
+        """
         try:
-            current_size = self.dataset.shape[0]
-            if new_size > current_size:
-                self.dataset.resize(new_size, axis=0)
+            if self.hdf5_file is None:
+                if samples:
+                    print("HDF5 file or dataset is not initialized.")
+                return
+
+            by_stream = {}
+            for stream_type, arrival, values, _, _ in samples:
+                rows = np.empty(len(values), dtype=STREAM_DTYPE)
+                rows['timestamp_unix'] = self._sample_times(stream_type, arrival, len(values))
+                rows['value'] = values
+                by_stream.setdefault(stream_type, []).append(rows)
+
+            for stream_type, blocks in by_stream.items():
+                rows = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+                self._stream_writer(stream_type).append_rows(rows)
+                self._written += len(rows)
+
+            for writer in self.stream_writers.values():
+                writer.flush_if_due()
 
         except Exception as e:
-            print(f"Error resizing dataset: {e}")
+            print(f"Error writing to HDF5: {e}")
+
+    def _write_pending_events(self) -> None:
+        """Move closed event intervals to the 'events' table. Must be called with self.lock held."""
+        if self.events_writer is None:
+            return
+
+        with self._event_lock:
+            events, self._pending_events = self._pending_events, []
+
+        if events:
+            self.events_writer.append_rows(np.array(events, dtype=EVENT_DTYPE))
+            self.events_writer.flush()
 
     def hdf5_to_csv(self):
         """
-        Convert an HDF5 file to a CSV file.
+        Convert an HDF5 file to a CSV file in this process (see export_files() for the background version).
         Dependencies:
             h5_filename (str): The path to the HDF5 file.
             csv_filename (str): The path to the CSV file to be created.
         """
         try:
-            chunk_size = 1000
-            with h5py.File(self.hdf5_filename, 'r') as h5_file:
-                if 'data' not in h5_file:
-                    print(f"Dataset 'data' not found in the file {self.hdf5_filename}.")
-                    return
-                
-                dataset = h5_file['data']
-                field_names = dataset.dtype.names
-                first_chunk = True
-
-                for start in range(0, dataset.shape[0], chunk_size):
-                    end = min(start + chunk_size, dataset.shape[0])
-                    chunk = dataset[start:end]
-
-                    chunk_dict = {
-                        field: np.char.decode(chunk[field], 'utf-8') if chunk[field].dtype.kind == 'S' 
-                            else [x.decode('utf-8') if isinstance(x, bytes) else x for x in chunk[field]]
-                        for field in field_names
-                    }
-
-                    chunk_df = pd.DataFrame(chunk_dict)
-
-                    if first_chunk:
-                        chunk_df.to_csv(self.csv_filename, mode='w', index=False, header=True)
-                        first_chunk = False
-                    else:
-                        chunk_df.to_csv(self.csv_filename, mode='a', header=False, index=False)
-            
+            hdf5_export.hdf5_to_csv(self.hdf5_filename, self.csv_filename)
             print(f"HDF5 file '{self.hdf5_filename}' successfully converted to CSV file '{self.csv_filename}'.")
         
         except FileNotFoundError:
             print(f"Error: The HDF5 file '{self.hdf5_filename}' was not found.")
             
         except Exception as e:
-            print(f"Error converting HDF5 to CSV: {e}")
\ No newline at end of file
+            print(f"Error converting HDF5 to CSV: {e}")
+
+    def export_files(self) -> hdf5_export.ExportJob:
+        """
+        Convert the (closed) HDF5 file to CSV, and to Parquet if pyarrow is installed,
+        in a separate process.
+        Returns:
+            ExportJob: The handle of the export, also kept in 'export_job'. None if it could not be started.
+        """
+        outputs = [self.csv_filename]
+        if hdf5_export.pa is not None and self.parquet_filename:
+            outputs.append(self.parquet_filename)
+
+        try:
+            self.export_job = hdf5_export.ExportJob(self.hdf5_filename, *outputs)
+            print(f"Converting '{self.hdf5_filename}' to {', '.join(outputs)} in the background...")
+        except Exception as e:
+            print(f"Error starting the CSV export: {e}")
+            self.export_job = None
+        return self.export_job
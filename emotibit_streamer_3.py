@@ -1,13 +1,15 @@
+import bisect
 import csv
 from pythonosc import dispatcher, osc_server
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import numpy as np
-from scipy.signal import butter, filtfilt, hilbert
+from scipy.signal import hilbert
 import time
 import atexit
 from datetime import datetime, timedelta
 from collections import deque
 from timestamp_manager import TimestampManager
+from signal_filters import bandpass_filter
 
 """
 This class manages the OSC server that receives data from the EmotiBit.
@@ -18,8 +20,71 @@ https://github.com/EmotiBit/EmotiBit_Docs/blob/master/Working_with_emotibit_data
 
 """
 
+METRIC_KEYS = ["EDA", "HR", "BI", "HRV", "PG", "RR"]
+
+# Rows between entries of the sparse (timestamp, file offset) index of the CSV file
+CSV_INDEX_INTERVAL = 256
+
+class RunningStats:
+    """Running count, sum and sum of squares of a channel; O(1) per update."""
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+
+    def remove(self, value: float) -> None:
+        self.count -= 1
+        self.total -= value
+        self.total_sq -= value * value
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else None
+
+    def std(self) -> float:
+        if self.count < 2:
+            return None
+        variance = (self.total_sq - self.total * self.total / self.count) / (self.count - 1)
+        return max(variance, 0.0) ** 0.5
+
+    def reset(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+
+class WindowedStats:
+    """
+    Running statistics over the last 'window_seconds' of a channel. Samples are kept in a
+    time-ordered ring buffer and expire from the front, so each sample is added and removed once.
+    Not thread-safe: EmotiBitStreamer only uses it with its _stats_lock held.
+    """
+    def __init__(self, window_seconds: float, maxlen: int = 100000) -> None:
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=maxlen)
+        self.stats = RunningStats()
+
+    def add(self, timestamp_unix: float, value: float) -> None:
+        if len(self.samples) == self.samples.maxlen:
+            self.stats.remove(self.samples[0][1])
+        self.samples.append((timestamp_unix, value))
+        self.stats.add(value)
+        self.expire(timestamp_unix)
+
+    def expire(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        while self.samples and self.samples[0][0] < cutoff:
+            self.stats.remove(self.samples.popleft()[1])
+
+    def reset(self) -> None:
+        self.samples.clear()
+        self.stats.reset()
+
 class EmotiBitStreamer:
-    def __init__(self, port: int, csv_filename: str = "tmp.csv") -> None:
+    def __init__(self, port: int, csv_filename: str = "tmp.csv", lookback_minutes: int = 2) -> None:
         self._ip = "127.0.0.1"
         self._port = port
         self.csv_filename = csv_filename
@@ -30,6 +95,9 @@ class EmotiBitStreamer:
         self.data_window = {key: deque(maxlen=500) for key in ["BI", "PG"]}  # Sliding window for derived metrics
         self._event_marker = 'subject_idle'
         self.collecting_baseline = False
+        self.baseline_stats = {key: RunningStats() for key in METRIC_KEYS}
+        self.live_stats = {key: WindowedStats(lookback_minutes * 60) for key in METRIC_KEYS}
+        self._stats_lock = Lock()  # The OSC server's worker threads and Flask both use the statistics
         self.dispatcher = dispatcher.Dispatcher()
         self.dispatcher.map("/EmotiBit/0/*", self.generic_handler)
         self.server = osc_server.ThreadingOSCUDPServer((self._ip, self._port), self.dispatcher)
@@ -38,6 +106,9 @@ class EmotiBitStreamer:
         self.default_value = 0
         self.csv_file = None
         self.csv_writer = None
+        self._csv_rows = 0
+        self._csv_index_times = []
+        self._csv_index_offsets = []
         
         atexit.register(self.stop)
 
@@ -54,7 +125,10 @@ class EmotiBitStreamer:
             print("Already collecting baseline data.")
             return
         
-        self.collecting_baseline = True
+        with self._stats_lock:
+            for stats in self.baseline_stats.values():
+                stats.reset()
+            self.collecting_baseline = True
 
     def stop_baseline_collection(self) -> None:
         if not self.collecting_baseline:
@@ -72,10 +146,14 @@ class EmotiBitStreamer:
         print(f"Starting server at {self._ip}:{self._port}")
 
         self.shutdown_event.clear()
+        self.timestamp_manager.resync_clock()
 
         self.csv_file = open(self.csv_filename, mode="w", newline="")
         self.csv_writer = csv.writer(self.csv_file)
         self.csv_writer.writerow(["timestamp", "EDA", "HR", "BI", "HRV", "PG", "RR", "baseline_status"])
+        self._csv_rows = 0
+        self._csv_index_times = []
+        self._csv_index_offsets = []
 
         self.server_thread = Thread(target=self.server.serve_forever)
         self.server_thread.start()
@@ -115,12 +193,14 @@ class EmotiBitStreamer:
         
         stream_type = address.split('/')[-1]
         timestamp = self.current_timestamp
+        timestamp_unix = self.timestamp_manager.get_unix_fast()
         value = args[0]
         self.last_received[stream_type] = time.time()
         derived_value = None
 
         self.current_row["timestamp"] = timestamp
         self.current_row["event_marker"] = self.event_marker
+        self.current_row["baseline_status"] = "baseline" if self.collecting_baseline else "live"
 
         if stream_type in self.data_window:
             self.data_window[stream_type].append(value)
@@ -140,8 +220,29 @@ class EmotiBitStreamer:
         elif stream_type == "PG":
             self.current_row["PG"] = value
 
+        self.update_aggregates(timestamp_unix, stream_type, value, derived_value)
         self.write_to_csv(self.current_row)
 
+    def update_aggregates(self, timestamp_unix: float, stream_type: str, value, derived_value) -> None:
+        """Add the new sample (and any derived HRV/RR value) to the baseline or live window statistics."""
+        updates = {}
+        if stream_type in METRIC_KEYS and value is not None:
+            updates[stream_type] = value
+        if derived_value is not None:
+            updates["HRV" if stream_type == "BI" else "RR"] = derived_value
+
+        with self._stats_lock:
+            for key, new_value in updates.items():
+                try:
+                    new_value = float(new_value)
+                except (TypeError, ValueError):
+                    continue
+
+                if self.collecting_baseline:
+                    self.baseline_stats[key].add(new_value)
+                else:
+                    self.live_stats[key].add(timestamp_unix, new_value)
+
     ###########################################
     # Derived Metrics
     ###########################################
@@ -173,11 +274,7 @@ class EmotiBitStreamer:
         return resp_freq * 60  # Convert to breaths per minute
     
     def bandpass_filter(self, data, lowcut, highcut, fs, order=4):
-        nyquist = 0.5 * fs
-        low = lowcut / nyquist
-        high = highcut / nyquist
-        b, a = butter(order, [low, high], btype="band")
-        return filtfilt(b, a, data)
+        return bandpass_filter(data, lowcut, highcut, fs, order)
 
     ###########################################
     # Utility Methods
@@ -214,10 +311,9 @@ class EmotiBitStreamer:
         non_baseline_entries = []
         try:
             with open(self.csv_filename, 'r') as file:
-                csv_reader = csv.DictReader(file)
-                
                 current_time = datetime.now()
                 time_threshold = current_time - timedelta(minutes=lookback_minutes)
+                csv_reader = self._csv_reader_from(file, self.csv_filename, time_threshold)
                 
                 for row in csv_reader:
                     baseline_status = row.get("baseline_status")
@@ -257,25 +353,29 @@ class EmotiBitStreamer:
         averages = {key: sum(values) / len(values) if values else None for key, values in averages.items()}
         return averages
     
-    def compare_baseline(self) -> dict:
+    def compare_baseline(self, lookback_minutes: int = None) -> dict:
         """
-        Compare the averages of the baseline data with a specified window of live data
-        from the CSV file. If there is not enough data, return a message indicating so.
+        Compare the averages of the baseline data with a window of live data. Both are
+        maintained in memory as samples arrive, so this never reads the CSV file.
+        Args:
+            lookback_minutes (int): The live window length. Defaults to the window set in the constructor.
+                                    Samples that already expired are not recovered if the window grows.
 
         Returns:
-            dict or str: A dictionary with comparison results or a string message if
-                         not enough data has been collected.
+            dict: For each channel, the baseline and live averages and which one is higher
+                  (None if there is not enough data for either).
         """
-        live_data = self.get_live_entries()
-        baseline_data = self.get_baseline_entries()
-
-        baseline_averages = self.get_averages(baseline_data)
-        live_averages = self.get_averages(live_data)
-
+        now = self.timestamp_manager.get_unix_fast()
         comparison_results = {}
-        for key in ["EDA", "HR", "BI", "HRV", "PG", "RR"]:
-            baseline_avg = baseline_averages.get(key)
-            live_avg = live_averages.get(key)
+        for key in METRIC_KEYS:
+            with self._stats_lock:
+                live = self.live_stats[key]
+                if lookback_minutes is not None and lookback_minutes * 60 != live.window_seconds:
+                    live.window_seconds = lookback_minutes * 60
+                live.expire(now)
+
+                baseline_avg = self.baseline_stats[key].mean()
+                live_avg = live.stats.mean()
             
             # Calculate the difference and check if the non-baseline average is elevated
             if baseline_avg is not None and live_avg is not None:
@@ -311,8 +411,13 @@ class EmotiBitStreamer:
                 current_row["RR"] if current_row["RR"] is not None else 'N/A',      # RR
                 current_row["baseline_status"]  
             ]
+
+            if self._csv_rows % CSV_INDEX_INTERVAL == 0 and current_row["timestamp"]:
+                self._csv_index_times.append(datetime.fromisoformat(current_row["timestamp"]))
+                self._csv_index_offsets.append(self.csv_file.tell())
             
             self.csv_writer.writerow(row)
+            self._csv_rows += 1
         else:
             print("CSV writer is not initialized.")
 
@@ -331,7 +436,7 @@ class EmotiBitStreamer:
 
         try:
             with open(csv_filename, mode="r") as csv_file:
-                csv_reader = csv.DictReader(csv_file)
+                csv_reader = self._csv_reader_from(csv_file, csv_filename, cutoff_time)
                 for row in csv_reader:
                     timestamp_str = row["timestamp"]
                     timestamp = datetime.fromisoformat(timestamp_str)
@@ -344,4 +449,26 @@ class EmotiBitStreamer:
         except Exception as e:
             print(f"Error reading CSV file: {e}")
 
-        return recent_data
\ No newline at end of file
+        return recent_data
+
+    def _csv_reader_from(self, file, csv_filename: str, cutoff_time: datetime) -> csv.DictReader:
+        """
+        Returns a DictReader positioned at the last indexed row written before 'cutoff_time',
+        so only the rows near the requested range are parsed. Rows are written in time order;
+        files not written by this streamer are read from the start.
+        Args:
+            file: The CSV file opened for reading.
+            csv_filename (str): The path of 'file'.
+            cutoff_time (datetime): The earliest timestamp of interest.
+        """
+        if csv_filename != self.csv_filename or not self._csv_index_times:
+            return csv.DictReader(file)
+
+        if self.csv_file:
+            self.csv_file.flush()
+
+        fieldnames = next(csv.reader([file.readline()]))
+        block = bisect.bisect_right(self._csv_index_times, cutoff_time) - 1
+        if block > 0:
+            file.seek(self._csv_index_offsets[block])
+        return csv.DictReader(file, fieldnames=fieldnames)
@@ -0,0 +1,231 @@
+import csv
+import os
+import threading
+from datetime import datetime, timezone
+import h5py
+import numpy as np
+from hdf5_storage import create_extendable_dataset, valid_rows, EVENT_DTYPE
+from timestamp_manager import TimestampManager
+
+"""
+Session-wide table of event marker/condition intervals. Every change of the
+event marker or condition closes the open (start_unix, end_unix, event_marker,
+condition) interval and opens a new one, so the start and end of a task can be
+read directly instead of scanning sensor rows for marker changes. Sensor data
+of a task is then sliced with two binary searches per interval (see
+slice_by_event()). Subscribers (the sensor managers) are told about every change.
+
+The intervals are kept in memory and written to '<date>_<subject>_events.h5' in
+the subject folder as they change; the open interval is stored with a NaN end.
+Switching to another subject closes the previous subject's files; only the open
+interval is carried over to the new subject.
+"""
+
+class EventManager:
+    def __init__(self) -> None:
+        self.timestamp_manager = TimestampManager()
+        self.lock = threading.Lock()
+        self._event_marker = 'startup'
+        self._condition = 'None'
+        self._intervals = []  # [start_unix, end_unix (None while open), event_marker, condition]
+        self._subscribers = []
+        self.data_folder = None
+        self.hdf5_filename = None
+        self.csv_filename = None
+        self.hdf5_file = None
+        self.dataset = None
+        self._row_offset = 0
+
+    @property
+    def event_marker(self) -> str:
+        return self._event_marker
+
+    @event_marker.setter
+    def event_marker(self, value: str) -> None:
+        self.set(event_marker=value)
+
+    @property
+    def condition(self) -> str:
+        return self._condition
+
+    @condition.setter
+    def condition(self, value: str) -> None:
+        self.set(condition=value)
+
+    def set_data_folder(self, subject_folder: str) -> None:
+        self.data_folder = subject_folder
+        if not os.path.exists(self.data_folder):
+            os.makedirs(self.data_folder)
+
+    def set_filenames(self, subject_id: str) -> None:
+        if self.data_folder is None:
+            raise ValueError("Data folder must be set before setting filenames.")
+
+        # The previous subject's intervals go to the previous subject's files
+        self.close_h5_file()
+
+        current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        self.hdf5_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_events.h5")
+        self.csv_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_events.csv")
+
+    def initialize_hdf5_file(self) -> None:
+        """Open the session's event table and write the open interval to it."""
+        self.close_h5_file()
+        try:
+            with self.lock:
+                self.hdf5_file = h5py.File(self.hdf5_filename, 'a')
+                if 'events' not in self.hdf5_file:
+                    create_extendable_dataset(self.hdf5_file, 'events', EVENT_DTYPE, chunk_rows=64)
+                self.dataset = self.hdf5_file['events']
+                self._row_offset = valid_rows(self.dataset)
+
+                # Closed intervals belong to earlier sessions (or to no subject)
+                self._intervals = [interval for interval in self._intervals[-1:] if interval[1] is None]
+                if not self._intervals:
+                    self._open_interval(self.timestamp_manager.get_unix_fast())
+                for index in range(len(self._intervals)):
+                    self._write_interval(index)
+
+            print("HDF5 file created for session events: ", self.hdf5_filename)
+
+        except Exception as e:
+            print(f"Error initializing event HDF5 file: {e}")
+
+    def close_h5_file(self) -> None:
+        """Close the open interval, the HDF5 file and write the intervals to CSV."""
+        with self.lock:
+            if self.hdf5_file is None:
+                return
+
+            if self._intervals and self._intervals[-1][1] is None:
+                self._intervals[-1][1] = self.timestamp_manager.get_unix_fast()
+                self._write_interval(len(self._intervals) - 1)
+
+            self.dataset.resize((valid_rows(self.dataset),))
+            self.hdf5_file.close()
+            self.hdf5_file = None
+            self.dataset = None
+
+        self.events_to_csv()
+
+    ###########################################
+    # Event Changes
+    ###########################################
+    def set(self, event_marker: str = None, condition: str = None) -> None:
+        """
+        Set the event marker and/or the condition (None keeps the current value). Any
+        change closes the open interval and opens a new one, so setting both at once
+        records a single interval change.
+        """
+        with self.lock:
+            event_marker = self._event_marker if event_marker is None else event_marker
+            condition = self._condition if condition is None else condition
+            changed = (event_marker, condition) != (self._event_marker, self._condition)
+            if changed:
+                now = self.timestamp_manager.get_unix_fast()
+                self._event_marker = event_marker
+                self._condition = condition
+                if self._intervals and self._intervals[-1][1] is None:
+                    self._intervals[-1][1] = now
+                    self._write_interval(len(self._intervals) - 1)
+                self._open_interval(now)
+            subscribers = list(self._subscribers)
+
+        if not changed:
+            return
+
+        for callback in subscribers:
+            try:
+                callback(event_marker, condition)
+            except Exception as e:
+                print(f"Error in event subscriber: {e}")
+
+    def subscribe(self, callback) -> None:
+        """Register a callback(event_marker, condition) that is called on every change."""
+        with self.lock:
+            self._subscribers.append(callback)
+
+    def _open_interval(self, now: float) -> None:
+        """Must be called with self.lock held."""
+        self._intervals.append([now, None, self._event_marker, self._condition])
+        self._write_interval(len(self._intervals) - 1)
+
+    def _write_interval(self, index: int) -> None:
+        """Write (or rewrite) an interval in the HDF5 table. Must be called with self.lock held."""
+        if self.dataset is None:
+            return
+
+        try:
+            start, end, event_marker, condition = self._intervals[index]
+            row = self._row_offset + index
+            if row >= self.dataset.shape[0]:
+                self.dataset.resize((max(row + 1, self.dataset.shape[0] * 2),))
+            self.dataset[row] = (start, np.nan if end is None else end, str(event_marker), str(condition))
+            self.dataset.attrs['n_rows'] = max(row + 1, int(self.dataset.attrs['n_rows']))
+            self.hdf5_file.flush()
+
+        except Exception as e:
+            print(f"Error writing event interval: {e}")
+
+    ###########################################
+    # Queries
+    ###########################################
+    def intervals(self, event_marker: str = None, condition: str = None) -> list:
+        """
+        Returns the recorded intervals, optionally only those of one event marker and/or condition.
+        Returns:
+            list: Dictionaries with 'start_unix', 'end_unix' (None while open), 'event_marker' and 'condition'.
+        """
+        with self.lock:
+            intervals = [list(interval) for interval in self._intervals]
+
+        return [
+            {"start_unix": start, "end_unix": end, "event_marker": marker, "condition": cond}
+            for start, end, marker, cond in intervals
+            if (event_marker is None or marker == event_marker) and (condition is None or cond == condition)
+        ]
+
+    def slice_by_event(self, reader, event_marker: str = None, condition: str = None, **kwargs) -> list:
+        """
+        Read the sensor data recorded during each matching interval.
+        Args:
+            reader: An object with read_time_range(start_unix, end_unix, ...), e.g. EmotiBitStreamer or VernierManager.
+            event_marker (str): Only intervals of this event marker.
+            condition (str): Only intervals of this condition.
+            **kwargs: Passed to reader.read_time_range (e.g. stream='EDA').
+        Returns:
+            list: (interval, rows) tuples.
+        """
+        return [
+            (interval, reader.read_time_range(interval["start_unix"], interval["end_unix"], **kwargs))
+            for interval in self.intervals(event_marker, condition)
+        ]
+
+    def events_to_csv(self) -> None:
+        """Write the intervals with unix and ISO start/end times to the session's events CSV."""
+        if not self.csv_filename:
+            return
+
+        try:
+            intervals = self.intervals()
+            start_iso = TimestampManager.format_iso([interval["start_unix"] for interval in intervals])
+            # Open intervals have no end; format their start instead and blank it below
+            end_iso = TimestampManager.format_iso([
+                interval["end_unix"] if interval["end_unix"] is not None else interval["start_unix"]
+                for interval in intervals
+            ])
+
+            with open(self.csv_filename, 'w', newline='') as csv_file:
+                writer = csv.writer(csv_file)
+                writer.writerow(["start_unix", "end_unix", "start", "end", "event_marker", "condition"])
+                for interval, start, end in zip(intervals, start_iso, end_iso):
+                    is_open = interval["end_unix"] is None
+                    writer.writerow([
+                        interval["start_unix"], '' if is_open else interval["end_unix"],
+                        start, '' if is_open else end, interval["event_marker"], interval["condition"]
+                    ])
+
+            print(f"Session events written to '{self.csv_filename}'.")
+
+        except Exception as e:
+            print(f"Error writing events CSV: {e}")
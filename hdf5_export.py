@@ -0,0 +1,482 @@
+import os
+import subprocess
+import sys
+import time
+import h5py
+import numpy as np
+from hdf5_storage import read_labels, valid_rows
+from timestamp_manager import TimestampManager
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+"""
+CSV and columnar (Parquet / Arrow IPC) export of the sensor HDF5 files (EmotiBit,
+Vernier). Multi-device Vernier files (a 'data' table per 'devices/<name>' group) are
+merged by time with a 'device' column. For CSV, columns are read in large slices
+and converted to Python lists once per slice; each row is then formatted in Python
+with a single %-format string (no pandas DataFrame per chunk). Variable-length
+strings are decoded once per distinct value. The columnar files keep float32 sensor values, a UTC timestamp column and
+dictionary-encoded (categorical) strings, so a single column of a whole trial can
+be loaded in milliseconds (see read_columnar()). Columnar export needs pyarrow.
+
+The module can be run as a script (python hdf5_export.py <h5_file> <output> ...),
+which is how ExportJob converts a file in a separate process without blocking the
+server. The output format follows the extension: .csv, .parquet, or .arrow/.feather.
+"""
+
+EXPORT_CHUNK_ROWS = 250000
+TIMESTAMP_FORMAT = '%.6f'   # Unix timestamps: microsecond resolution
+FLOAT_FORMAT = '%.7g'       # Sensor values are stored as float32 (~7 significant digits)
+
+def _csv_field(text: str) -> str:
+    """Quote a string field if it contains a delimiter, quote or line break."""
+    if any(c in text for c in ',"\n\r'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+def _decode_strings(values, quote: bool = True) -> list:
+    """Decode a column of HDF5 variable-length strings, decoding each distinct value once."""
+    values = values.tolist()
+    lookup = {}
+    for v in set(values):
+        text = v.decode('utf-8') if isinstance(v, bytes) else str(v)
+        lookup[v] = _csv_field(text) if quote else text
+    return [lookup[v] for v in values]
+
+def _format_floats(column: np.ndarray, float_format: str) -> tuple:
+    """
+    Returns the (format, values) of a float column. Missing values are written as empty
+    fields, as pandas does; only a column that holds NaNs is formatted value by value.
+    """
+    values = column.tolist()
+    if not np.isnan(column).any():
+        return float_format, values
+    return '%s', ['' if v != v else float_format % v for v in values]
+
+def format_rows(names: list, columns: dict) -> str:
+    """
+    Format equally long columns as CSV lines.
+    Args:
+        names (list): The column names, in output order.
+        columns (dict): Column name -> numpy array. Float columns ending in '_unix' are
+                        written as timestamps, other floats with FLOAT_FORMAT (NaN as an
+                        empty field), anything else (e.g. decoded strings) as is.
+    Returns:
+        str: The CSV lines (without header).
+    """
+    formats = []
+    values = []
+    for name in names:
+        column = columns[name]
+        if isinstance(column, np.ndarray) and column.dtype.kind == 'f':
+            float_format, column_values = _format_floats(column, TIMESTAMP_FORMAT if name.endswith('_unix') else FLOAT_FORMAT)
+            formats.append(float_format)
+            values.append(column_values)
+        elif isinstance(column, np.ndarray) and column.dtype.kind in 'iu':
+            formats.append('%d')
+            values.append(column.tolist())
+        else:
+            formats.append('%s')
+            values.append(column if isinstance(column, list) else _decode_strings(np.asarray(column)))
+
+    line = ','.join(formats) + '\n'
+    return ''.join([line % row for row in zip(*values)])
+
+def _export_table(dataset, csv_file, chunk_rows: int) -> int:
+    """Export a compound 'data' table, adding the ISO 'timestamp' column if it is not stored."""
+    names = list(dataset.dtype.names)
+    add_iso = 'timestamp' not in names and 'timestamp_unix' in names
+    header = list(names)
+    if add_iso:
+        header.insert(header.index('timestamp_unix') + 1, 'timestamp')
+
+    # Coded columns (see hdf5_storage.LabelCodes) are written as their labels
+    labels = {}
+    for name in names:
+        field_labels = read_labels(dataset, name)
+        if field_labels is not None:
+            labels[name] = np.array([_csv_field(label) for label in field_labels], dtype=object)
+
+    csv_file.write(','.join(header) + '\n')
+    num_rows = valid_rows(dataset)
+    for start in range(0, num_rows, chunk_rows):
+        chunk = dataset[start:min(start + chunk_rows, num_rows)]
+        columns = {name: chunk[name] for name in names}
+        for name, field_labels in labels.items():
+            columns[name] = field_labels[chunk[name]].tolist()
+        if add_iso:
+            columns['timestamp'] = TimestampManager.format_iso(chunk['timestamp_unix']).tolist()
+        csv_file.write(format_rows(header, columns))
+
+    return num_rows
+
+def _load_streams(h5_file) -> dict:
+    """
+    Merge the per-stream datasets of a 'streams' mode file into time-sorted columns.
+    Streams, event markers and conditions are returned as integer codes into the
+    'stream_names', 'markers' and 'conditions' lists; marker/condition code 0 is the
+    blank label of samples recorded before the first event interval.
+    """
+    names = list(h5_file['streams'])
+    if not names:
+        raise KeyError("No stream datasets found.")
+
+    times, values, stream_codes = [], [], []
+    for code, name in enumerate(names):
+        dataset = h5_file['streams'][name]
+        data = dataset[:valid_rows(dataset)]
+        times.append(data['timestamp_unix'])
+        values.append(data['value'])
+        stream_codes.append(np.full(len(data), code, dtype='i4'))
+
+    times = np.concatenate(times)
+    order = np.argsort(times, kind='stable')
+    streams = {
+        'timestamp_unix': times[order],
+        'value': np.concatenate(values)[order],
+        'stream': np.concatenate(stream_codes)[order],
+        'stream_names': names,
+        'markers': [''],
+        'conditions': ['']
+    }
+
+    events = h5_file['events'][:valid_rows(h5_file['events'])] if 'events' in h5_file else None
+    if events is not None and len(events):
+        events = events[np.argsort(events['start_unix'], kind='stable')]
+        streams['markers'] += _decode_strings(events['event_marker'], quote=False)
+        streams['conditions'] += _decode_strings(events['condition'], quote=False)
+        event_idx = np.searchsorted(events['start_unix'], streams['timestamp_unix'], side='right')
+    else:
+        event_idx = np.zeros(len(times), dtype='i8')
+
+    streams['event'] = event_idx.astype('i4')
+    return streams
+
+def _export_streams(h5_file, csv_file, chunk_rows: int) -> int:
+    """
+    Export a 'streams' mode file as long-format CSV (one row per sample, sorted by time)
+    with the event marker and condition looked up from the 'events' interval table.
+    """
+    streams = _load_streams(h5_file)
+    times = streams['timestamp_unix']
+    stream_names = np.array([_csv_field(name) for name in streams['stream_names']], dtype=object)
+    markers = np.array([_csv_field(m) for m in streams['markers']], dtype=object)
+    conditions = np.array([_csv_field(c) for c in streams['conditions']], dtype=object)
+
+    header = ['timestamp_unix', 'timestamp', 'stream', 'value', 'event_marker', 'condition']
+    csv_file.write(','.join(header) + '\n')
+    for start in range(0, len(times), chunk_rows):
+        part = slice(start, start + chunk_rows)
+        event_idx = streams['event'][part]
+        csv_file.write(format_rows(header, {
+            'timestamp_unix': times[part],
+            'timestamp': TimestampManager.format_iso(times[part]).tolist(),
+            'stream': stream_names[streams['stream'][part]].tolist(),
+            'value': streams['value'][part],
+            'event_marker': markers[event_idx].tolist(),
+            'condition': conditions[event_idx].tolist()
+        }))
+
+    return len(times)
+
+def _load_devices(h5_file) -> dict:
+    """
+    Merge the 'data' tables of a multi-device file ('devices/<name>/data') into
+    time-sorted columns. The 'device' column and coded or string columns are integer
+    codes into the lists of 'labels' (device names for 'device').
+    Returns:
+        dict: {'names': column names, 'columns': name -> array, 'labels': name -> list}
+    """
+    device_names = [name for name in h5_file['devices'] if 'data' in h5_file['devices'][name]]
+    if not device_names:
+        raise KeyError("No device datasets found.")
+
+    fields = [name for name in h5_file['devices'][device_names[0]]['data'].dtype.names if name != 'timestamp']
+    parts = {name: [] for name in fields + ['device']}
+    labels = {'device': device_names}
+    lookups = {}
+
+    for device_code, device_name in enumerate(device_names):
+        dataset = h5_file['devices'][device_name]['data']
+        data = dataset[:valid_rows(dataset)]
+        parts['device'].append(np.full(len(data), device_code, dtype='i4'))
+        for name in fields:
+            field_labels = read_labels(dataset, name)
+            if field_labels is None and dataset.dtype[name].kind not in 'OSU':
+                parts[name].append(data[name])
+                continue
+
+            # Map the labels of each device to the codes of the merged column
+            lookup = lookups.setdefault(name, {})
+            merged = labels.setdefault(name, [])
+            values = field_labels if field_labels is not None else _decode_strings(data[name], quote=False)
+            codes = []
+            for label in values:
+                if label not in lookup:
+                    lookup[label] = len(merged)
+                    merged.append(label)
+                codes.append(lookup[label])
+            codes = np.array(codes, dtype='i4')
+            parts[name].append(codes[data[name]] if field_labels is not None else codes)
+
+    columns = {name: np.concatenate(values) for name, values in parts.items()}
+    order = np.argsort(columns['timestamp_unix'], kind='stable')
+    names = ['timestamp_unix', 'device'] + [name for name in fields if name != 'timestamp_unix']
+    return {
+        'names': names,
+        'columns': {name: column[order] for name, column in columns.items()},
+        'labels': labels
+    }
+
+def _export_devices(h5_file, csv_file, chunk_rows: int) -> int:
+    """Export a multi-device file as one CSV sorted by time, with the device name of every row."""
+    devices = _load_devices(h5_file)
+    columns = devices['columns']
+    labels = {name: np.array([_csv_field(label) for label in values], dtype=object)
+              for name, values in devices['labels'].items()}
+
+    header = list(devices['names'])
+    header.insert(1, 'timestamp')
+    csv_file.write(','.join(header) + '\n')
+    num_rows = len(columns['timestamp_unix'])
+    for start in range(0, num_rows, chunk_rows):
+        part = slice(start, start + chunk_rows)
+        chunk = {name: column[part] for name, column in columns.items()}
+        for name, field_labels in labels.items():
+            chunk[name] = field_labels[chunk[name]].tolist()
+        chunk['timestamp'] = TimestampManager.format_iso(chunk['timestamp_unix']).tolist()
+        csv_file.write(format_rows(header, chunk))
+
+    return num_rows
+
+def hdf5_to_csv(h5_filename: str, csv_filename: str, chunk_rows: int = EXPORT_CHUNK_ROWS) -> int:
+    """
+    Convert a sensor HDF5 file ('data' table, EmotiBit 'streams' layout or Vernier
+    'devices' groups) to CSV.
+    Args:
+        h5_filename (str): The path to the HDF5 file.
+        csv_filename (str): The path to the CSV file to be created.
+        chunk_rows (int): Rows read and formatted per slice.
+    Returns:
+        int: The number of rows written.
+    Raises:
+        KeyError: If the file holds no 'data' table, 'streams' group or 'devices' group.
+    """
+    with h5py.File(h5_filename, 'r') as h5_file:
+        if not any(name in h5_file for name in ('streams', 'devices', 'data')):
+            raise KeyError(f"Dataset 'data' not found in the file {h5_filename}.")
+
+        with open(csv_filename, 'w', newline='') as csv_file:
+            if 'streams' in h5_file:
+                return _export_streams(h5_file, csv_file, chunk_rows)
+            if 'devices' in h5_file:
+                return _export_devices(h5_file, csv_file, chunk_rows)
+            return _export_table(h5_file['data'], csv_file, chunk_rows)
+
+def _dictionary_array(codes, dictionary: list):
+    """A categorical (dictionary-encoded) string column."""
+    return pa.DictionaryArray.from_arrays(
+        pa.array(codes, type=pa.int32()), pa.array(dictionary, type=pa.string())
+    )
+
+def _timestamp_array(unix_times):
+    """Unix seconds as a UTC timestamp column with microsecond resolution."""
+    return pa.array(np.round(unix_times * 1e6).astype('int64'), type=pa.timestamp('us', tz='UTC'))
+
+def _table_columns(dataset, chunk_rows: int) -> dict:
+    """Read a compound 'data' table into typed Arrow columns, dictionary-encoding its strings."""
+    num_rows = valid_rows(dataset)
+    names = [name for name in dataset.dtype.names if name != 'timestamp']
+    parts = {name: [] for name in names}
+    lookups = {name: {} for name in names}
+    dictionaries = {name: [] for name in names}
+
+    for start in range(0, num_rows, chunk_rows):
+        chunk = dataset[start:min(start + chunk_rows, num_rows)]
+        for name in names:
+            column = chunk[name]
+            if column.dtype.kind not in 'OSU':
+                parts[name].append(column)
+                continue
+
+            values = column.tolist()
+            lookup = lookups[name]
+            for v in set(values):
+                if v not in lookup:
+                    lookup[v] = len(lookup)
+                    dictionaries[name].append(v.decode('utf-8') if isinstance(v, bytes) else str(v))
+            parts[name].append(np.array([lookup[v] for v in values], dtype='i4'))
+
+    columns = {}
+    for name in names:
+        values = np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype=dataset.dtype[name])
+        labels = read_labels(dataset, name)
+        if labels is not None:
+            columns[name] = _dictionary_array(values.astype('i4'), labels)
+        elif dataset.dtype[name].kind in 'OSU':
+            columns[name] = _dictionary_array(values.astype('i4'), dictionaries[name])
+        else:
+            # NaN marks a missing sample in the HDF5 file; store it as null
+            columns[name] = pa.array(values, from_pandas=True)
+
+        if name == 'timestamp_unix':
+            columns['timestamp'] = _timestamp_array(values)
+
+    return columns
+
+def _streams_columns(h5_file) -> dict:
+    """Typed Arrow columns of a 'streams' mode file, in the long format of the CSV export."""
+    streams = _load_streams(h5_file)
+    return {
+        'timestamp_unix': pa.array(streams['timestamp_unix']),
+        'timestamp': _timestamp_array(streams['timestamp_unix']),
+        'stream': _dictionary_array(streams['stream'], streams['stream_names']),
+        'value': pa.array(streams['value'], from_pandas=True),
+        'event_marker': _dictionary_array(streams['event'], streams['markers']),
+        'condition': _dictionary_array(streams['event'], streams['conditions'])
+    }
+
+def _devices_columns(h5_file) -> dict:
+    """Typed Arrow columns of a multi-device file, in the layout of the CSV export."""
+    devices = _load_devices(h5_file)
+    columns = {}
+    for name in devices['names']:
+        values = devices['columns'][name]
+        if name in devices['labels']:
+            columns[name] = _dictionary_array(values, devices['labels'][name])
+        else:
+            columns[name] = pa.array(values, from_pandas=True)
+        if name == 'timestamp_unix':
+            columns['timestamp'] = _timestamp_array(values)
+    return columns
+
+def hdf5_to_columnar(h5_filename: str, out_filename: str, chunk_rows: int = EXPORT_CHUNK_ROWS) -> int:
+    """
+    Convert a sensor HDF5 file to a columnar file: zstd-compressed Parquet for '.parquet',
+    otherwise an uncompressed Arrow IPC file that can be memory-mapped without copying.
+    Sensor values keep their float32 type (missing samples become nulls), 'timestamp' is
+    a UTC timestamp[us] column and string columns such as event_marker and condition are
+    dictionary-encoded, so they load as pandas categoricals.
+    Args:
+        h5_filename (str): The path to the HDF5 file.
+        out_filename (str): The path to the .parquet or .arrow/.feather file to be created.
+        chunk_rows (int): Rows read per slice.
+    Returns:
+        int: The number of rows written.
+    Raises:
+        ImportError: If pyarrow is not installed.
+        KeyError: If the file holds no 'data' table, 'streams' group or 'devices' group.
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for Parquet/Arrow export.")
+
+    with h5py.File(h5_filename, 'r') as h5_file:
+        if 'streams' in h5_file:
+            columns = _streams_columns(h5_file)
+        elif 'devices' in h5_file:
+            columns = _devices_columns(h5_file)
+        elif 'data' in h5_file:
+            columns = _table_columns(h5_file['data'], chunk_rows)
+        else:
+            raise KeyError(f"Dataset 'data' not found in the file {h5_filename}.")
+
+    table = pa.table(columns)
+    if out_filename.endswith('.parquet'):
+        pq.write_table(table, out_filename, compression='zstd')
+    else:
+        with pa.OSFile(out_filename, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    return table.num_rows
+
+def read_columnar(filename: str, columns: list = None):
+    """
+    Load a Parquet or Arrow IPC export, optionally only some of its columns.
+    Arrow IPC files are memory-mapped, so unused columns are never read.
+    Returns:
+        pyarrow.Table: The table (use .to_pandas() for a DataFrame).
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required to read Parquet/Arrow files.")
+
+    if filename.endswith('.parquet'):
+        return pq.read_table(filename, columns=columns)
+
+    table = pa.ipc.open_file(pa.memory_map(filename, 'r')).read_all()
+    return table.select(columns) if columns is not None else table
+
+def export_file(h5_filename: str, out_filename: str) -> int:
+    """Export to CSV, Parquet or Arrow IPC depending on the extension of 'out_filename'."""
+    if out_filename.endswith('.csv'):
+        return hdf5_to_csv(h5_filename, out_filename)
+    return hdf5_to_columnar(h5_filename, out_filename)
+
+class ExportJob:
+    """
+    Handle of an export (CSV and/or columnar files) running in a separate Python
+    process, so stopping a sensor does not wait for the conversion. Output of the
+    export goes to the server's console.
+    """
+    def __init__(self, h5_filename: str, *output_filenames: str) -> None:
+        self.h5_filename = h5_filename
+        self.output_filenames = list(output_filenames)
+        self.started = time.time()
+        self.finished = None
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), h5_filename, *self.output_filenames]
+        )
+
+    @property
+    def status(self) -> str:
+        """'running', 'completed' or 'failed'."""
+        returncode = self._process.poll()
+        if returncode is None:
+            return "running"
+
+        if self.finished is None:
+            self.finished = time.time()
+        return "completed" if returncode == 0 else "failed"
+
+    def done(self) -> bool:
+        return self.status != "running"
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for the export to finish. Returns True if it completed successfully."""
+        try:
+            self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False
+        return self.status == "completed"
+
+    def to_dict(self) -> dict:
+        status = self.status
+        return {
+            "h5_filename": self.h5_filename,
+            "output_filenames": self.output_filenames,
+            "status": status,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python hdf5_export.py <h5_file> <output_file> [<output_file> ...]")
+        sys.exit(2)
+
+    failed = False
+    for out_filename in sys.argv[2:]:
+        try:
+            start_time = time.time()
+            rows = export_file(sys.argv[1], out_filename)
+            print(f"HDF5 file '{sys.argv[1]}' converted to '{out_filename}' "
+                  f"({rows} rows, {time.time() - start_time:.1f} s).")
+        except Exception as e:
+            print(f"Error converting HDF5 to '{out_filename}': {e}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
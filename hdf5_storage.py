@@ -0,0 +1,299 @@
+import bisect
+import threading
+import time
+import h5py
+import numpy as np
+
+"""
+Storage helpers shared by the sensor managers (EmotiBit, Vernier). Rows are
+accumulated in a preallocated numpy block and written to a chunked, extendable
+HDF5 dataset in large slices instead of resizing the dataset once per sample.
+The dataset capacity grows geometrically; the number of valid rows is kept in
+the 'n_rows' attribute so a file left open by a crash can still be read back.
+Categorical string columns (event marker, condition) are stored as small integer
+codes; the labels are kept in a '<field>_labels' attribute (see LabelCodes).
+A table whose rows are only sorted within each write (e.g. the EmotiBit 'data' table,
+where a multi-sample message reaches back before rows written earlier) records the
+largest step back in time in its 'time_overlap' attribute; the range reads take it
+into account.
+"""
+
+DEFAULT_CHUNK_ROWS = 4096
+
+# One row of a single sensor channel (see the 'streams' storage mode)
+STREAM_DTYPE = np.dtype([
+    ('timestamp_unix', 'f8'),
+    ('value', 'f4')
+])
+
+# One event marker/condition interval
+EVENT_DTYPE = np.dtype([
+    ('start_unix', 'f8'),
+    ('end_unix', 'f8'),
+    ('event_marker', h5py.string_dtype(encoding='utf-8')),
+    ('condition', h5py.string_dtype(encoding='utf-8'))
+])
+
+# One interval during which a sensor was disconnected (NaN end while it still is)
+GAP_DTYPE = np.dtype([
+    ('start_unix', 'f8'),
+    ('end_unix', 'f8')
+])
+
+# Integer code of a categorical column (see LabelCodes)
+LABEL_CODE_DTYPE = np.dtype('u2')
+
+def labels_attr(field: str) -> str:
+    """Name of the attribute holding the labels of a coded column."""
+    return f"{field}_labels"
+
+def read_labels(dataset, field: str) -> list:
+    """Returns the labels of a coded column, or None if the column is not coded."""
+    if dataset.dtype[field].kind not in 'iu' or labels_attr(field) not in dataset.attrs:
+        return None
+    return [
+        label.decode('utf-8') if isinstance(label, bytes) else str(label)
+        for label in dataset.attrs[labels_attr(field)]
+    ]
+
+def create_extendable_dataset(h5_file, name: str, dtype, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """
+    Create an empty, chunked, resizable 1-D dataset.
+    Args:
+        h5_file (h5py.File or h5py.Group): The parent object of the dataset.
+        name (str): The dataset name.
+        dtype (np.dtype): The row dtype (usually a compound dtype).
+        chunk_rows (int): Number of rows per HDF5 chunk.
+    Returns:
+        h5py.Dataset: The new dataset.
+    """
+    dataset = h5_file.create_dataset(
+        name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(chunk_rows,)
+    )
+    dataset.attrs['n_rows'] = 0
+    return dataset
+
+def valid_rows(dataset) -> int:
+    """Returns the number of rows that hold data (the dataset may be overallocated)."""
+    return int(min(dataset.attrs.get('n_rows', dataset.shape[0]), dataset.shape[0]))
+
+def time_overlap(dataset) -> float:
+    """Returns how far (in seconds) a row may be earlier than a row before it (0 for sorted tables)."""
+    return float(dataset.attrs.get('time_overlap', 0.0))
+
+def find_time_range(dataset, start_unix: float, end_unix: float, field: str = 'timestamp_unix',
+                    num_rows: int = None, scan_rows: int = DEFAULT_CHUNK_ROWS, index: tuple = None,
+                    overlap: float = 0.0) -> tuple:
+    """
+    Binary search a time-ordered dataset for the rows with start_unix <= field < end_unix.
+    The sparse 'index' (see BufferedHDF5Writer.time_index) narrows the search in memory;
+    otherwise single values are probed until the candidate range fits in 'scan_rows' rows,
+    which are then read in one slice, so only O(log(n / scan_rows)) small reads hit the file.
+    If rows may step back in time by up to 'overlap' seconds, the bounds are searched
+    'overlap' further out: the returned range then holds every matching row, but also
+    rows outside the time range that have to be filtered (see read_time_range()).
+    Args:
+        dataset (h5py.Dataset): A compound dataset sorted by 'field'.
+        start_unix (float): Start of the range (inclusive).
+        end_unix (float): End of the range (exclusive).
+        field (str): The timestamp field.
+        num_rows (int): Number of valid rows. Defaults to valid_rows(dataset).
+        scan_rows (int): Candidate range size below which a slice is read instead of probing.
+        index (tuple): Optional (block_start_times, block_start_rows) lists of a writer.
+        overlap (float): The largest step back in time between rows (see time_overlap()).
+    Returns:
+        tuple: The (start, stop) row indices of the range.
+    """
+    column = dataset.fields(field)
+    num_rows = valid_rows(dataset) if num_rows is None else num_rows
+
+    def search(value: float) -> int:
+        lo, hi = 0, num_rows
+        if index is not None and index[0]:
+            times, rows = index
+            block = bisect.bisect_left(times, value)
+            if block > 0:
+                lo = rows[block - 1]
+            hi = min(rows[block], num_rows) if block < len(rows) else num_rows
+
+        while hi - lo > scan_rows:
+            mid = (lo + hi) // 2
+            if column[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo + int(np.searchsorted(column[lo:hi], value, side='left'))
+
+    start = search(start_unix - overlap)
+    stop = search(end_unix + overlap) if end_unix is not None else num_rows
+    return start, max(start, stop)
+
+def read_time_range(dataset, start_unix: float, end_unix: float = None, field: str = 'timestamp_unix',
+                    num_rows: int = None, index: tuple = None) -> np.ndarray:
+    """
+    Returns the rows of a time-ordered dataset with start_unix <= field < end_unix, in
+    file order. Rows of a table with a 'time_overlap' are filtered after the read.
+    """
+    overlap = time_overlap(dataset)
+    start, stop = find_time_range(dataset, start_unix, end_unix, field, num_rows, index=index, overlap=overlap)
+    rows = dataset[start:stop]
+    if overlap > 0:
+        times = rows[field]
+        keep = times >= start_unix if end_unix is None else (times >= start_unix) & (times < end_unix)
+        rows = rows[keep]
+    return rows
+
+class BufferedHDF5Writer:
+    """
+    Buffers rows for a single HDF5 dataset and flushes them in blocks, either
+    when the block is full or when 'flush_interval' seconds have passed since
+    the last flush. If 'index_field' is set, the first value of that field in
+    every flushed block is kept as a sparse in-memory index for find_time_range().
+    All methods are thread safe.
+    """
+    def __init__(self, dataset, block_rows: int = 1024, flush_interval: float = 1.0, growth_factor: float = 2.0,
+                 index_field: str = None) -> None:
+        self.dataset = dataset
+        self.block_rows = block_rows
+        self.flush_interval = flush_interval
+        self.growth_factor = growth_factor
+        self.lock = threading.Lock()
+        self._block = np.zeros(block_rows, dtype=dataset.dtype)
+        self._pending = 0
+        self._rows = valid_rows(dataset)
+        self._last_flush = time.monotonic()
+        self.index_field = index_field
+        self._index_times = []
+        self._index_rows = []
+
+    @property
+    def time_index(self) -> tuple:
+        """The (block_start_times, block_start_rows) lists of the blocks flushed by this writer."""
+        return self._index_times, self._index_rows
+
+    @property
+    def rows_written(self) -> int:
+        """Rows already flushed to the dataset."""
+        return self._rows
+
+    @property
+    def pending_rows(self) -> int:
+        """Rows still waiting in the in-memory block."""
+        return self._pending
+
+    def append(self, row: tuple) -> None:
+        """Append a single row given as a tuple in dtype field order."""
+        with self.lock:
+            self._block[self._pending] = row
+            self._pending += 1
+
+            if self._pending >= self.block_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def append_rows(self, rows: np.ndarray) -> None:
+        """Append a structured array of rows with the dataset dtype."""
+        with self.lock:
+            start = 0
+            while start < len(rows):
+                count = min(self.block_rows - self._pending, len(rows) - start)
+                self._block[self._pending:self._pending + count] = rows[start:start + count]
+                self._pending += count
+                start += count
+
+                if self._pending >= self.block_rows:
+                    self._flush()
+
+            if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush_if_due(self) -> None:
+        """Flush the pending rows if the flush interval has elapsed."""
+        with self.lock:
+            if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self) -> None:
+        """Write all pending rows to the dataset."""
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Flush pending rows and trim the dataset to the rows actually written."""
+        with self.lock:
+            self._flush()
+            if self.dataset.shape[0] != self._rows:
+                self.dataset.resize((self._rows,))
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        count = self._pending
+        if count == 0:
+            return
+
+        end = self._rows + count
+        capacity = self.dataset.shape[0]
+        if end > capacity:
+            capacity = max(end, int(capacity * self.growth_factor), self.block_rows)
+            self.dataset.resize((capacity,))
+
+        self.dataset[self._rows:end] = self._block[:count]
+        if self.index_field is not None:
+            self._index_times.append(float(self._block[0][self.index_field]))
+            self._index_rows.append(self._rows)
+        self._rows = end
+        self._pending = 0
+        self.dataset.attrs['n_rows'] = end
+
+class LabelCodes:
+    """
+    Maps the values of a categorical string column to integer codes, so rows only
+    store a LABEL_CODE_DTYPE code instead of a variable-length string. Code i stands
+    for labels[i]. code() only touches memory and is thread safe; new labels are
+    written to the '<field>_labels' attribute of the dataset by save().
+    """
+    def __init__(self, field: str, labels: list = ()) -> None:
+        self.field = field
+        self._lock = threading.Lock()
+        self._labels = []
+        self._codes = {}
+        self._saved = 0
+        for label in labels:
+            self.code(label)
+
+    @classmethod
+    def from_dataset(cls, dataset, field: str) -> "LabelCodes":
+        """Load the labels already stored for 'field' in the dataset."""
+        codes = cls(field, read_labels(dataset, field) or [])
+        codes._saved = len(codes._labels)
+        return codes
+
+    @property
+    def labels(self) -> list:
+        with self._lock:
+            return list(self._labels)
+
+    def code(self, label) -> int:
+        """Returns the code of a label, adding the label if it is new."""
+        label = str(label)
+        code = self._codes.get(label)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(label)
+                if code is None:
+                    code = len(self._labels)
+                    self._labels.append(label)
+                    self._codes[label] = code
+        return code
+
+    def label(self, code: int) -> str:
+        return self._labels[code]
+
+    def save(self, dataset) -> None:
+        """Write the labels to the dataset if new labels were added since the last save."""
+        with self._lock:
+            if self._saved == len(self._labels):
+                return
+            labels = list(self._labels)
+
+        dataset.attrs[labels_attr(self.field)] = np.array(labels, dtype=h5py.string_dtype(encoding='utf-8'))
+        self._saved = len(labels)
@@ -0,0 +1,84 @@
+import os
+import sys
+from math import gcd
+import numpy as np
+import scipy.signal as signal
+
+# The audio modules live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from audio_ring_buffer import AudioRingBuffer
+from audio_resampler import StreamingResampler
+
+def test_ring_buffer_overruns():
+    frames = np.arange(1000, dtype='int16')
+    ring = AudioRingBuffer(100)
+    ring.add_consumer('fast')
+    ring.add_consumer('slow')
+
+    # 'fast' keeps up, 'slow' falls 150 frames more than the capacity behind
+    for start in range(0, 250, 50):
+        ring.write(frames[start:start + 50].tobytes())
+        assert np.array_equal(ring.read('fast'), frames[start:start + 50])
+
+    assert np.array_equal(ring.read('slow'), frames[150:250]), "The slow consumer should resume at the oldest frame"
+    stats = ring.stats()
+    assert stats['fast'] == {"overruns": 0, "dropped_frames": 0, "pending_frames": 0}
+    assert stats['slow'] == {"overruns": 1, "dropped_frames": 150, "pending_frames": 0}
+
+    # A single chunk larger than the buffer only keeps its last 'capacity' frames
+    ring.write(frames[250:380])
+    assert np.array_equal(ring.read('fast'), frames[280:380])
+    assert ring.stats()['fast']['dropped_frames'] == 30
+    assert ring.frames_written == 380
+
+    # Reading up to an end position leaves the rest pending
+    ring.write(frames[380:420])
+    assert np.array_equal(ring.read('fast', end=400), frames[380:400])
+    assert ring.stats()['fast']['pending_frames'] == 20
+    assert np.array_equal(ring.read('fast'), frames[400:420])
+
+    # A start position in the past is clamped to the oldest frame still in the buffer
+    assert ring.add_consumer('late', 0) == 320
+    assert np.array_equal(ring.read('late'), frames[320:420])
+    assert ring.stats()['late']['overruns'] == 0
+    assert np.array_equal(ring.latest(10), frames[410:420])
+
+    print("AudioRingBuffer overruns passed.")
+
+def test_streaming_resampler():
+    rng = np.random.default_rng(0)
+    for in_rate, out_rate in ((48000, 16000), (44100, 16000), (16000, 16000), (8000, 16000)):
+        seconds = 1.5
+        t = np.arange(int(in_rate * seconds)) / in_rate
+        audio = (0.4 * np.sin(2 * np.pi * 440 * t) + 0.1 * rng.standard_normal(len(t))).clip(-1, 1)
+        samples = np.round(audio * 32767).astype('int16')
+
+        # Capture-sized chunks of varying length, as the writer thread feeds them
+        resampler = StreamingResampler(in_rate, out_rate)
+        chunks, start = [], 0
+        while start < len(samples):
+            count = int(rng.integers(1, 2048))
+            chunks.append(resampler.process(samples[start:start + count]))
+            start += count
+        chunks.append(resampler.flush())
+        streamed = np.concatenate(chunks)
+
+        divisor = gcd(in_rate, out_rate)
+        expected = signal.resample_poly(samples / 32768.0, out_rate // divisor, in_rate // divisor)
+        assert streamed.dtype == np.float32
+        assert len(streamed) == len(expected), f"{in_rate} -> {out_rate} Hz: {len(streamed)} != {len(expected)} samples"
+        error = np.max(np.abs(streamed - expected))
+        assert error < 1e-6, f"{in_rate} -> {out_rate} Hz differs from resample_poly by {error}"
+
+    print("StreamingResampler passed.")
+
+def main():
+    print("Running audio tests...")
+    print("Testing AudioRingBuffer overruns...")
+    test_ring_buffer_overruns()
+    print("Testing StreamingResampler...")
+    test_streaming_resampler()
+
+if __name__ == "__main__":
+    main()
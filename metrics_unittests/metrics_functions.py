@@ -1,5 +1,6 @@
 import numpy as np
-from scipy.signal import butter, filtfilt
+from functools import lru_cache
+from scipy.signal import butter, sosfiltfilt
 from scipy.signal import hilbert
 
 # NOTE: All algorithms in these functions were obtained from Chat and need to be verified. 
@@ -65,13 +66,18 @@ def bandpass_filter(data, lowcut, highcut, fs, order=4): # HELP - verify the ord
         ValueError: If lowcut or highcut are not within the valid range (0 < lowcut < highcut < fs/2).
         ValueError: If the sampling frequency (fs) is not greater than 0.
     Notes:
-        - The function uses the `butter` function to design the filter and `filtfilt` 
-          for zero-phase filtering to avoid phase distortion.
+        - The function uses the `butter` function to design the filter in second-order
+          sections and `sosfiltfilt` for zero-phase filtering to avoid phase distortion.
+          The design is cached, since the band and fs rarely change between calls.
         - Ensure that the input signal `data` is properly preprocessed (e.g., detrended) 
           before applying the filter for optimal results.
     """
-    nyquist = 0.5 * fs
-    low = lowcut / nyquist
-    high = highcut / nyquist
-    b, a = butter(order, [low, high], btype="band")
-    return filtfilt(b, a, data)
\ No newline at end of file
+    return sosfiltfilt(design_filter(order, lowcut, highcut, fs, "band"), data)
+
+@lru_cache(maxsize=64)
+def design_filter(order, low, high, fs, btype="band"):
+    """
+    Design a Butterworth filter in second-order-sections form. Results are cached by
+    (order, low, high, fs, btype); the returned array is shared and must not be modified.
+    """
+    return butter(order, [low, high], btype=btype, fs=fs, output="sos")
\ No newline at end of file
@@ -72,6 +72,19 @@ def test_calculate_rr(ppg_values):
 
     print("calculate_rr passed.")
 
+def test_bandpass_filter_cache():
+    design_filter.cache_clear()
+    signal = np.sin(2 * np.pi * 0.25 * np.arange(0, 60, 1 / 25))
+
+    first = bandpass_filter(signal, 0.1, 0.5, 25)
+    second = bandpass_filter(signal, 0.1, 0.5, 25)
+
+    assert np.allclose(first, second)
+    assert design_filter.cache_info().hits >= 1, "Filter design was not reused"
+    assert design_filter(4, 0.1, 0.5, 25) is design_filter(4, 0.1, 0.5, 25)
+
+    print("bandpass_filter cache passed.")
+
 def main():
     pg_values, bi_values = read_csv_file('emotibit_data.csv')
     print("Running unit tests...")
@@ -79,6 +92,8 @@ def main():
     test_calculate_hrv(bi_values)
     print("Testing calculate_rr...")
     test_calculate_rr(pg_values)
+    print("Testing bandpass_filter cache...")
+    test_bandpass_filter_cache()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
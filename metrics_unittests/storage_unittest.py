@@ -0,0 +1,226 @@
+import os
+import random
+import sys
+import tempfile
+import h5py
+import numpy as np
+import pandas as pd
+
+# The storage modules live in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import emotibit_streamer_2
+import hdf5_export
+from hdf5_storage import (
+    BufferedHDF5Writer, LabelCodes, create_extendable_dataset, find_time_range, valid_rows,
+    LABEL_CODE_DTYPE, STREAM_DTYPE
+)
+
+class FakeClock:
+    """Stands in for the TimestampManager so the streamer sees simulated packet arrival times."""
+    def __init__(self, start: float) -> None:
+        self.now = start
+
+    def get_unix_fast(self) -> float:
+        return self.now
+
+def stream_rows(count, start=1.7e9, seed=0):
+    """Time-ordered STREAM_DTYPE rows with jittered spacing and some repeated timestamps."""
+    rng = np.random.default_rng(seed)
+    rows = np.empty(count, dtype=STREAM_DTYPE)
+    rows['timestamp_unix'] = start + np.cumsum(rng.choice([0.0, 0.01, 0.04], size=count))
+    rows['value'] = rng.random(count)
+    return rows
+
+def stream_emotibit(folder, storage_mode, packets=400, seed=1):
+    """
+    Feed jittered multi-value OSC packets (a PPG message and, in some of them, an EDA message,
+    bundles about 120 ms apart) through an EmotiBitStreamer and return it with its HDF5 file still open.
+    """
+    rng = random.Random(seed)
+    streamer = emotibit_streamer_2.EmotiBitStreamer(0, storage_mode=storage_mode)
+    streamer.server.server_close()
+    streamer.set_data_folder(folder)
+    streamer.set_filenames("S1")
+    streamer.initialize_hdf5_file()
+    streamer.timestamp_manager = FakeClock(1.7e9)
+    streamer.is_streaming = True
+
+    for _ in range(packets):
+        streamer.timestamp_manager.now += 0.12 * (1 + rng.uniform(-0.7, 0.7))
+        messages = [("/EmotiBit/0/PPG:GRN", [rng.random() for _ in range(rng.randint(1, 8))])]
+        if rng.random() < 0.5:
+            messages.append(("/EmotiBit/0/EDA", [rng.random() for _ in range(rng.randint(1, 3))]))
+        streamer.packet_handler(messages)
+        if rng.random() < 0.5:
+            streamer._drain_queue()
+
+    streamer._drain_queue()
+    streamer.is_streaming = False
+    return streamer
+
+def check_against_scan(read, times):
+    """Compare read(start, end) with a full scan for 'start <= t < end' at many start and end times."""
+    bounds = np.linspace(times.min() - 1, times.max() + 1, 50).tolist() + times[::37].tolist()
+    for start, end in zip(bounds, [None] + bounds[:0:-1]):
+        rows = read(start, end)
+        expected = times[(times >= start) & (times < end)] if end is not None else times[times >= start]
+        assert np.array_equal(rows['timestamp_unix'], expected), f"Range read [{start}, {end}) does not match a full scan"
+
+def test_emotibit_time_range():
+    for storage_mode in ("wide", "streams"):
+        with tempfile.TemporaryDirectory() as folder:
+            streamer = stream_emotibit(folder, storage_mode)
+
+            # While recording: flushed rows, searched through the writers' sparse indexes
+            with streamer.lock:
+                writers = {"data": streamer.writer} if storage_mode == "wide" else dict(streamer.stream_writers)
+                for writer in writers.values():
+                    writer.flush()
+                scans = {name: writer.dataset['timestamp_unix'][:writer.rows_written] for name, writer in writers.items()}
+
+            # The samples of each type tag are in time order; the wide table may step back between writes
+            if storage_mode == "wide":
+                data = streamer.writer.dataset[:streamer.writer.rows_written]
+                for column in ("EDA", "PG"):
+                    assert np.all(np.diff(data['timestamp_unix'][~np.isnan(data[column])]) > 0)
+                assert streamer.dataset.attrs['time_overlap'] > 0
+            else:
+                for times in scans.values():
+                    assert np.all(np.diff(times) >= 0), "Stream rows are not in time order"
+
+            for name, times in scans.items():
+                stream = None if storage_mode == "wide" else name
+                check_against_scan(lambda start, end: streamer.read_time_range(start, end, stream), times)
+
+            # After the file has been closed
+            with streamer.lock:
+                streamer.close_h5_file()
+            for name, times in scans.items():
+                stream = None if storage_mode == "wide" else name
+                check_against_scan(lambda start, end: streamer.read_time_range(start, end, stream), times)
+
+    print("EmotiBit read_time_range passed.")
+
+def test_buffered_writer():
+    rows = stream_rows(530)
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "writer.h5")
+        with h5py.File(filename, 'w') as h5_file:
+            dataset = create_extendable_dataset(h5_file, 'data', STREAM_DTYPE, chunk_rows=64)
+            writer = BufferedHDF5Writer(dataset, block_rows=100, flush_interval=1e9)
+            for start in range(0, 530, 70):
+                writer.append_rows(rows[start:start + 70])
+
+            # Five full blocks are flushed, growing the capacity 100 -> 200 -> 400 -> 800
+            assert writer.rows_written == 500 and writer.pending_rows == 30
+            assert dataset.shape[0] == 800
+            assert dataset.attrs['n_rows'] == 500
+            # Simulated crash: the file is closed without closing the writer
+
+        with h5py.File(filename, 'a') as h5_file:
+            dataset = h5_file['data']
+            assert dataset.shape[0] == 800 and valid_rows(dataset) == 500
+            assert np.array_equal(dataset[:500], rows[:500])
+
+            # A new writer appends after the valid rows, and close() trims the spare capacity
+            writer = BufferedHDF5Writer(dataset, block_rows=100)
+            writer.append_rows(rows[500:])
+            writer.close()
+            assert dataset.shape[0] == 530 and valid_rows(dataset) == 530
+            assert np.array_equal(dataset[:500], rows[:500])
+            assert np.array_equal(dataset[500:], rows[500:])
+
+    print("BufferedHDF5Writer passed.")
+
+def test_find_time_range():
+    rows = stream_rows(20000, seed=1)
+    times = rows['timestamp_unix']
+    with tempfile.TemporaryDirectory() as folder:
+        with h5py.File(os.path.join(folder, "range.h5"), 'w') as h5_file:
+            dataset = create_extendable_dataset(h5_file, 'data', STREAM_DTYPE)
+            writer = BufferedHDF5Writer(dataset, block_rows=1000, index_field='timestamp_unix')
+            writer.append_rows(rows)
+            writer.flush()
+
+            rng = np.random.default_rng(2)
+            bounds = np.concatenate((rng.uniform(times[0] - 1, times[-1] + 1, 100), rng.choice(times, 100)))
+            for start_unix, end_unix in zip(bounds, rng.permutation(bounds)):
+                expected = (int((times < start_unix).sum()), int((times < end_unix).sum()))
+                expected = (expected[0], max(expected))
+                for index in (None, writer.time_index):
+                    # A small scan_rows makes the search probe single values before reading a slice
+                    found = find_time_range(dataset, start_unix, end_unix, num_rows=writer.rows_written,
+                                            scan_rows=16, index=index)
+                    assert found == expected, f"[{start_unix}, {end_unix}): {found} != {expected}"
+
+            assert find_time_range(dataset, times[100], None) == (int((times < times[100]).sum()), 20000)
+
+    print("find_time_range passed.")
+
+def write_wide_file(filename):
+    """A 'data' table like the EmotiBit wide mode: sparse float columns and coded labels (one of them 'nan')."""
+    dtype = np.dtype([('timestamp_unix', 'f8'), ('EDA', 'f4'), ('PG', 'f4'),
+                      ('event_marker', LABEL_CODE_DTYPE), ('condition', LABEL_CODE_DTYPE)])
+    rows = np.zeros(300, dtype=dtype)
+    rows['timestamp_unix'] = 1.7e9 + np.arange(300) * 0.04
+    rows['EDA'] = np.where(np.arange(300) % 3 == 0, np.arange(300) * 0.25, np.nan)
+    rows['PG'] = np.where(np.arange(300) % 3 == 0, np.nan, np.arange(300) * 1.5)
+    markers = LabelCodes('event_marker', ['subject_idle', 'task, "A"'])
+    conditions = LabelCodes('condition', ['None', 'nan'])
+    rows['event_marker'] = np.arange(300) // 150
+    rows['condition'] = (np.arange(300) // 100) % 2
+
+    with h5py.File(filename, 'w') as h5_file:
+        dataset = create_extendable_dataset(h5_file, 'data', dtype)
+        markers.save(dataset)
+        conditions.save(dataset)
+        writer = BufferedHDF5Writer(dataset)
+        writer.append_rows(rows)
+        writer.close()
+
+    labels = {'event_marker': markers.labels, 'condition': conditions.labels}
+    return rows, labels
+
+def test_export_round_trip():
+    with tempfile.TemporaryDirectory() as folder:
+        h5_filename = os.path.join(folder, "wide.h5")
+        rows, labels = write_wide_file(h5_filename)
+
+        csv_filename = os.path.join(folder, "wide.csv")
+        assert hdf5_export.hdf5_to_csv(h5_filename, csv_filename) == len(rows)
+        # keep_default_na=False, so a 'nan' label is read back as text and only empty fields are missing
+        csv = pd.read_csv(csv_filename, keep_default_na=False, na_values=[''])
+        parquet_filename = os.path.join(folder, "wide.parquet")
+        assert hdf5_export.hdf5_to_columnar(h5_filename, parquet_filename) == len(rows)
+        parquet = hdf5_export.read_columnar(parquet_filename).to_pandas()
+
+        for frame in (csv, parquet):
+            assert len(frame) == len(rows)
+            assert np.allclose(frame['timestamp_unix'], rows['timestamp_unix'], rtol=0, atol=1e-6)
+            for name in ('EDA', 'PG'):
+                assert np.array_equal(np.isnan(frame[name].to_numpy(dtype='f8')), np.isnan(rows[name]))
+                assert np.allclose(frame[name].to_numpy(dtype='f8'), rows[name], equal_nan=True)
+            for name in ('event_marker', 'condition'):
+                assert frame[name].astype(str).tolist() == [labels[name][code] for code in rows[name]]
+
+        iso = pd.to_datetime(csv['timestamp']).dt.tz_localize(None)
+        utc = parquet['timestamp'].dt.tz_convert(None)
+        offset = (iso - utc).dt.total_seconds()
+        assert offset.nunique() == 1, "ISO and UTC timestamps disagree"
+
+    print("CSV/Parquet export round trip passed.")
+
+def main():
+    print("Running storage tests...")
+    print("Testing BufferedHDF5Writer...")
+    test_buffered_writer()
+    print("Testing find_time_range...")
+    test_find_time_range()
+    print("Testing CSV/Parquet export...")
+    test_export_round_trip()
+    print("Testing EmotiBit read_time_range...")
+    test_emotibit_time_range()
+
+if __name__ == "__main__":
+    main()
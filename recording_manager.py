@@ -1,8 +1,12 @@
 import threading
+from datetime import datetime
 import pyaudio
 import wave
+import numpy as np
 import speech_recognition as sr
 from timestamp_manager import TimestampManager
+from audio_ring_buffer import AudioRingBuffer
+from audio_resampler import StreamingResampler
 
 class RecordingManager():
     """
@@ -10,15 +14,71 @@ class RecordingManager():
     the setting of system audio device. All handling of audio files post recording
     is handled in the app.py file. Audio processing is handled in the 
     audio_processor.py file.
+
+    The input stream is opened once and stays open (see open_input_stream()), so the
+    ring buffer always holds the last RING_BUFFER_SECONDS of audio. start_recording()
+    only marks the position pre_roll_seconds back in the buffer and stop_recording()
+    marks the end, so both return within milliseconds and the first words spoken
+    right before the start are kept. The pre-roll never reaches back into the previous
+    recording, and timestamp is the time of the first frame, pre-roll included.
+
+    Recordings are streamed to disk while they are captured. By default audio is
+    captured with PyAudio's callback API ('callback' capture mode): PortAudio calls
+    _audio_callback on its own thread and the callback only copies the chunk into a
+    preallocated AudioRingBuffer. Consumers read from the ring buffer at their own
+    pace: the writer thread appends to the WAV file (whose header is patched with the
+    final length on close), get_audio_level() reads the most recent frames, and other
+    consumers (e.g. streaming transcription) register with add_consumer(). 'blocking'
+    capture mode reads the stream in a thread instead. Input overflows and consumer
+    overruns are counted (see get_capture_stats()) to tune the buffer sizes.
+
+    The state of the current recording ('idle', 'recording', 'stopping', 'saved' or
+    'failed') is guarded by state_condition, so callers block on wait_until_recording()
+    and wait_until_saved() with a timeout instead of polling stream_is_active.
+
+    The WAV file is written at the rate the stream was opened with. For recordings
+    started with keep_audio=True (the answers that are transcribed right away), the
+    writer thread also resamples the audio to resample_rate (16 kHz by default) with a
+    StreamingResampler as it is written, so get_resampled_audio() returns float32 mono
+    audio as soon as the recording stops, ready for Whisper and SER without loading
+    and resampling the file again. Other recordings keep no audio in memory, and a kept
+    recording longer than KEEP_AUDIO_SECONDS is dropped from memory (the file is used).
     """
-    def __init__(self, recording_file) -> None: 
+    CHUNK_FRAMES = 1024
+    RING_BUFFER_SECONDS = 10
+    PRE_ROLL_SECONDS = 1.0
+    CAPTURE_MODES = ('callback', 'blocking')
+    FILE_CONSUMER = 'file'
+    START_TIMEOUT = 10.0
+    SAVE_TIMEOUT = 5.0
+    RESAMPLE_RATE = 16000
+    KEEP_AUDIO_SECONDS = 300
+    def __init__(self, recording_file, capture_mode: str = 'callback', resample_rate: int = RESAMPLE_RATE) -> None: 
+        if capture_mode not in self.CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode '{capture_mode}', expected one of {self.CAPTURE_MODES}.")
+        self.capture_mode = capture_mode
+        self.resample_rate = resample_rate
         self.audio = pyaudio.PyAudio()
         self.sample_rate = int(self.audio.get_default_input_device_info()['defaultSampleRate'])
         print(f"Default Sample Rate: {self.sample_rate}")
         self.stop_event = threading.Event()
         self.recording_started_event = threading.Event()
+        self.state_condition = threading.Condition()
+        self._recording_state = 'idle'
         self.stream_ready_event = threading.Event()
+        self.close_event = threading.Event()
+        self.capture_finished_event = threading.Event()
         self.recording_thread = None
+        self.writer_thread = None
+        self.stream = None
+        self.stream_rate = None
+        self.ring_buffer = None
+        self._resampler = None
+        self._resampled = []
+        self.pre_roll_seconds = self.PRE_ROLL_SECONDS
+        self.start_unix = None
+        self._recording_end = None
+        self._input_overflows = 0
         self._stream_is_active = False
         self._recording_file = recording_file
         self.device_index = 0
@@ -28,6 +88,7 @@ class RecordingManager():
         self.timestamp_manager = TimestampManager()
         print("Recording manager initialized...")
         print(f"Recording manager's temporary recording file set to {self.recording_file}")
+        self.open_input_stream()
 
     ##################################################################
     ## GENERAL METHODS
@@ -64,19 +125,145 @@ class RecordingManager():
     def stream_is_active(self, value) -> None:
         self._stream_is_active = value
 
-    def start_recording(self) -> None:
+    @property
+    def recording_state(self) -> str:
+        return self._recording_state
+
+    def _set_recording_state(self, state: str) -> None:
+        with self.state_condition:
+            self._recording_state = state
+            self.state_condition.notify_all()
+
+    def _wait_for_state(self, states: tuple, timeout: float) -> str:
+        """Block until the recording reaches one of 'states'. Returns the state reached, or None on timeout."""
+        with self.state_condition:
+            if not self.state_condition.wait_for(lambda: self._recording_state in states, timeout):
+                return None
+            return self._recording_state
+
+    def wait_until_recording(self, timeout: float = START_TIMEOUT) -> bool:
+        """
+        Block until the recording has started.
+        Returns:
+            bool: True if recording, False if the start failed or timed out.
+        """
+        return self._wait_for_state(('recording', 'failed'), timeout) == 'recording'
+
+    def wait_until_saved(self, timeout: float = SAVE_TIMEOUT) -> bool:
+        """
+        Block until the recording file is complete (its header patched and closed).
+        Returns:
+            bool: True if the file was saved, False if writing failed or timed out.
+        """
+        return self._wait_for_state(('saved', 'failed'), timeout) == 'saved'
+
+    def start_recording(self, keep_audio: bool = False) -> bool:
+        """
+        Start writing the recording file from pre_roll_seconds before now, but not before
+        the end of the previous recording. timestamp is the time of the first frame.
+        Args:
+            keep_audio (bool): Also keep the recording in memory at resample_rate (see get_resampled_audio()).
+        Returns:
+            bool: True if the recording started.
+        """
+        if self.writer_thread is not None:
+            self.stop_recording()
+
         self.stop_event.clear()
-        self.recording_started_event.set()
 
-        self.timestamp = self.timestamp_manager.get_timestamp("iso")
+        if not self.open_input_stream():
+            print("Error starting recording: the audio input stream could not be opened.")
+            self._set_recording_state('failed')
+            return False
+
+        wf = self._open_wave_file()
+        if wf is None:
+            self._set_recording_state('failed')
+            return False
 
-        self.recording_thread = threading.Thread(target=self.record_thread)
-        self.recording_thread.start()
-        self.stream_ready_event.wait()
+        written = self.ring_buffer.frames_written
+        pre_roll_start = written - int(self.pre_roll_seconds * self.stream_rate)
+        if self._recording_end is not None:
+            # The pre-roll must not repeat the end of the previous recording
+            pre_roll_start = max(pre_roll_start, self._recording_end)
+        start = self.ring_buffer.add_consumer(self.FILE_CONSUMER, pre_roll_start)
+        self.start_unix = self.timestamp_manager.get_unix_fast() - (written - start) / self.stream_rate
+        self.timestamp = datetime.fromtimestamp(self.start_unix).isoformat()
+        self._recording_end = None
+        self._resampled = []
+        self._resampler = StreamingResampler(self.stream_rate, self.resample_rate) if keep_audio and self.resample_rate else None
+
+        self._set_recording_state('recording')
+        self.writer_thread = threading.Thread(target=self.write_thread, args=(self.ring_buffer, wf))
+        self.writer_thread.start()
         self.stream_is_active = True
-        self.recording_started_event.wait()
+        self.recording_started_event.set()
 
         print("Recording thread started")   
+        return True
+
+    def open_input_stream(self) -> bool:
+        """
+        Open the input stream of the selected device, if it is not open yet. It stays open
+        between recordings, filling the ring buffer. Returns True if the stream is open.
+        """
+        if self.stream is not None:
+            if not self.capture_finished_event.is_set():
+                return True
+            # The capture thread stopped on a stream error
+            self.close_input_stream()
+
+        try:
+            self._validate_device_index()
+            self.close_event.clear()
+            self.capture_finished_event.clear()
+            self._input_overflows = 0
+            self.ring_buffer = AudioRingBuffer(self.sample_rate * self.RING_BUFFER_SECONDS)
+            self._recording_end = None  # Frame counts of the previous buffer do not apply
+            self.stream_rate = self.sample_rate
+
+            self.stream = self.audio.open(format=pyaudio.paInt16, 
+                                channels=1, 
+                                rate=self.sample_rate, 
+                                input=True, 
+                                input_device_index=self.device_index,
+                                frames_per_buffer=self.CHUNK_FRAMES,
+                                stream_callback=self._audio_callback if self.capture_mode == 'callback' else None)
+        
+        except Exception as e:
+            print(f"Error opening audio stream: {e}")
+            self.stream = None
+            return False
+
+        if self.capture_mode == 'blocking':
+            self.recording_thread = threading.Thread(target=self.record_thread, daemon=True)
+            self.recording_thread.start()
+
+        self.stream_ready_event.set()
+        print(f"Audio input stream opened ({self.sample_rate} Hz, {self.capture_mode} mode)")
+        return True
+
+    def close_input_stream(self) -> None:
+        """Close the input stream, e.g. before switching devices. An ongoing recording ends with it."""
+        if self.stream is None:
+            return
+
+        self.close_event.set()
+        if self.recording_thread:
+            self.recording_thread.join(timeout=5.0)
+            self.recording_thread = None
+
+        try:
+            self.stream.stop_stream()
+            self.stream.close()    
+        except Exception as e:
+            print(f"Error closing stream: {e}")
+
+        self.stream = None
+        self.stream_ready_event.clear()
+        self.capture_finished_event.set()
+        self.ring_buffer.wake()
+        print("Audio input stream closed")
 
     def _validate_device_index(self) -> None:
         """Ensure device_index points to a valid input device"""
@@ -90,75 +277,183 @@ class RecordingManager():
             self.device_index = valid_indices[0] if valid_indices else 0
 
     def stop_recording(self) -> None:
+        """Mark the end of the recording; the writer only has the frames up to it left to drain."""
         self.stop_event.set()
+        if self.writer_thread is not None:
+            self._set_recording_state('stopping')
+
+        if self.ring_buffer is not None and self.writer_thread is not None:
+            self._recording_end = self.ring_buffer.frames_written
+            self.ring_buffer.wake()
 
         # Prevent hanging.
-        if self.recording_thread:
-            self.recording_thread.join(timeout=5.0)
+        if self.writer_thread:
+            self.writer_thread.join(timeout=self.SAVE_TIMEOUT)
+            self.writer_thread = None
+            self.ring_buffer.remove_consumer(self.FILE_CONSUMER)
 
         self.recording_started_event.clear()
-        self.stream_ready_event.clear()
         self.stream_is_active = False
         self.end_timestamp = self.timestamp_manager.get_timestamp("iso")
         print(f"Recording stopped at {self.end_timestamp}")
 
     def reset_audio_system(self):
         try:
+            self.close_input_stream()
             if self.audio is not None:
                 self.audio.terminate()
             self.audio = pyaudio.PyAudio()
             self.audio_devices = self.fetch_audio_devices()
+            self.open_input_stream()
             print("Audio system reset successfully.")
 
         except Exception as e:
                     print(f"Error resetting audio system: {e}")
 
     def record_thread(self) -> None:
-        # Validate device before attempting to open stream
+        """Blocking capture mode: read the open stream into the ring buffer until it is closed."""
+        ring_buffer = self.ring_buffer
         try:
-            self._validate_device_index()
-
-            stream = self.audio.open(format=pyaudio.paInt16, 
-                                channels=1, 
-                                rate=self.sample_rate, 
-                                input=True, 
-                                input_device_index=self.device_index,
-                                frames_per_buffer=1024)
-        
-        except Exception as e:
-            print(f"Error opening audio stream: {e}")
-            self.stream_ready_event.set() # TODO: CHECK THE VALIDITY OF THIS
-            return
-        
-        self.stream_ready_event.set()
+            while not self.close_event.is_set():
+                try:
+                    ring_buffer.write(self.stream.read(self.CHUNK_FRAMES))
+                except IOError as e:
+                    if getattr(e, 'errno', None) != pyaudio.paInputOverflowed:
+                        print(f"Error reading from audio stream: {e}")
+                        break
+                    # The chunk was lost, but the recording goes on
+                    self._input_overflows += 1
+                except Exception as e:
+                    print(f"Error reading from audio stream: {e}")
+                    break
+        finally:
+            self.capture_finished_event.set()
+            ring_buffer.wake()
 
-        frames = []
+    def _audio_callback(self, in_data, frame_count, time_info, status_flags):
+        """Runs on PortAudio's thread: copy the chunk and return, nothing here may block."""
+        if status_flags & pyaudio.paInputOverflow:
+            self._input_overflows += 1
+        self.ring_buffer.write(in_data)
+        return (None, pyaudio.paContinue)
 
-        self.recording_started_event.set()
-
-        while not self.stop_event.is_set():
-            try:
-                data = stream.read(1024)
-                frames.append(data)
-            except Exception as e:
-                print(f"Error reading from audio stream: {e}")
-                break
-        
+    def _open_wave_file(self):
+        """Open the recording file for writing. Returns the wave writer, or None on error."""
         try:
-            stream.stop_stream()
-            stream.close()    
+            wf = wave.open(self.recording_file, 'wb')
+            wf.setnchannels(1)
+            wf.setsampwidth(self.audio.get_sample_size(pyaudio.paInt16))
+            wf.setframerate(self.stream_rate)
+            return wf
         except Exception as e:
-            print(f"Error closing stream: {e}")
+            print(f"Error opening wave file: {e}")
+            return None
 
+    def write_thread(self, ring_buffer: AudioRingBuffer, wf) -> None:
+        """
+        Append the captured frames to the recording file until the end marked by
+        stop_recording() (or until the input stream is closed). wave patches the
+        header (RIFF and data sizes) with the number of frames written when the
+        file is closed. If the audio is kept, the frames are resampled to resample_rate
+        on the way, up to KEEP_AUDIO_SECONDS.
+        """
+        resampler = self._resampler
+        resampled = self._resampled
+        kept = 0
         try:
-            with wave.open(self.recording_file, 'wb') as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(self.audio.get_sample_size(pyaudio.paInt16))
-                wf.setframerate(44100)
-                wf.writeframes(b''.join(frames))
-                print(f"Recording stopped, saved to {self.recording_file}")
+            while True:
+                finished = self.capture_finished_event.is_set()
+                if self._recording_end is None and not finished:
+                    ring_buffer.wait(self.FILE_CONSUMER, timeout=0.1)
+                end = self._recording_end
+                frames = ring_buffer.read(self.FILE_CONSUMER, end=end)
+                if len(frames):
+                    # writeframesraw skips the per-call header patch; close() writes the final sizes
+                    wf.writeframesraw(frames.tobytes())
+                    if resampler is not None:
+                        resampled.append(resampler.process(frames))
+                        kept += len(resampled[-1])
+                        if kept > self.KEEP_AUDIO_SECONDS * self.resample_rate:
+                            print(f"Recording is longer than {self.KEEP_AUDIO_SECONDS} s; it is no longer kept in memory.")
+                            resampler = self._resampler = None
+                            resampled.clear()
+                if end is not None or finished:
+                    break
+            if resampler is not None:
+                resampled.append(resampler.flush())
         except Exception as e:
             print(f"Error writing to wave file: {e}")
+        finally:
+            try:
+                wf.close()
+                print(f"Recording stopped, saved to {self.recording_file}")
+                self._set_recording_state('saved')
+            except Exception as e:
+                print(f"Error closing wave file: {e}")
+                self._set_recording_state('failed')
+
+    ##################################################################
+    ## CONSUMERS
+    ##################################################################
+    def add_consumer(self, name: str) -> None:
+        """Register a reader of the live audio (e.g. streaming transcription); see read_audio()."""
+        if self.ring_buffer is None:
+            print("Recording has not started.")
+            return
+        self.ring_buffer.add_consumer(name)
+
+    def remove_consumer(self, name: str) -> None:
+        if self.ring_buffer is not None:
+            self.ring_buffer.remove_consumer(name)
+
+    def read_audio(self, name: str, timeout: float = None) -> np.ndarray:
+        """
+        Returns the int16 frames captured since the consumer's last read, waiting up to
+        'timeout' seconds for new frames if there are none yet.
+        """
+        if timeout is not None:
+            self.ring_buffer.wait(name, timeout)
+        return self.ring_buffer.read(name)
+
+    def get_resampled_audio(self) -> np.ndarray:
+        """
+        Returns the current (or last) recording resampled to resample_rate as float32
+        mono samples in [-1, 1), or None if it was not kept (see start_recording()).
+        The recording is complete once wait_until_saved() returns True.
+        """
+        if self._resampler is None:
+            return None
+        chunks = list(self._resampled)
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)
+
+    def get_audio_level(self, window_seconds: float = 0.1) -> dict:
+        """Returns the RMS and peak level (dBFS) of the last 'window_seconds' of audio."""
+        if self.ring_buffer is None or self.stream is None:
+            return {"rms_dbfs": None, "peak_dbfs": None}
+
+        frames = self.ring_buffer.latest(int(self.stream_rate * window_seconds)).astype(np.float32) / 32768.0
+        if len(frames) == 0:
+            return {"rms_dbfs": None, "peak_dbfs": None}
+
+        rms = float(np.sqrt(np.mean(frames ** 2)))
+        peak = float(np.max(np.abs(frames)))
+        return {
+            "rms_dbfs": 20 * np.log10(max(rms, 1e-10)),
+            "peak_dbfs": 20 * np.log10(max(peak, 1e-10))
+        }
+
+    def get_capture_stats(self) -> dict:
+        """
+        Returns the input overflows reported by PortAudio (audio lost before it reached
+        the ring buffer) and the overruns of each consumer (audio overwritten in the ring
+        buffer before the consumer read it).
+        """
+        return {
+            "capture_mode": self.capture_mode,
+            "input_overflows": self._input_overflows,
+            "ring_buffer_seconds": self.RING_BUFFER_SECONDS,
+            "consumers": self.ring_buffer.stats() if self.ring_buffer is not None else {}
+        }
 
     ##################################################################
     ## GETTERS
@@ -206,4 +501,8 @@ class RecordingManager():
                 break
         print(f"Device set to {name if name else 'Unknown (index not in audio_devices list)'}")
 
+        # Reopen the always-open input stream on the new device
+        self.close_input_stream()
+        self.open_input_stream()
+
     ##################################################################
\ No newline at end of file
@@ -28,11 +28,15 @@ class SERManager:
         """
         Predicts the emotion from a given audio chunk using a custom trained Wav2Vec2 model.
         Parameters:
-            - audio_chunk: audio file in wav format. 
+            - audio_chunk: audio file in wav format, or float32 16 kHz mono samples
+              (see RecordingManager.get_resampled_audio()), which are used as is.
         Returns:
             - str: The predicted emotion label.
         """
-        speech, sr = librosa.load(audio_chunk, sr=16000)
+        if isinstance(audio_chunk, np.ndarray):
+            speech = audio_chunk.astype(np.float32, copy=False)
+        else:
+            speech, sr = librosa.load(audio_chunk, sr=16000)
 
         if len(speech) > self.max_length:
             speech = speech[:self.max_length]
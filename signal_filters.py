@@ -0,0 +1,64 @@
+from functools import lru_cache
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt
+
+"""
+Butterworth filter helpers for the biometric streams. Filter designs are cached
+by (order, low, high, fs, btype) and returned in second-order-sections (SOS)
+form, which stays numerically stable at the low normalized cutoffs used for
+respiration. StreamingFilter keeps the filter state between calls so live
+signals can be filtered block by block.
+"""
+
+@lru_cache(maxsize=64)
+def design_filter(order: int, low: float, high: float, fs: float, btype: str = "band") -> np.ndarray:
+    """
+    Returns the cached SOS coefficients of a Butterworth filter. The array is shared
+    between callers and must not be modified.
+    Args:
+        order (int): The filter order.
+        low (float): The lower cutoff frequency in Hz (ignored for 'lowpass').
+        high (float): The upper cutoff frequency in Hz (ignored for 'highpass').
+        fs (float): The sampling frequency in Hz.
+        btype (str): 'band', 'bandstop', 'lowpass' or 'highpass'.
+    Raises:
+        ValueError: If the cutoffs are not within 0 < low < high < fs/2.
+    """
+    if btype in ("band", "bandpass", "bandstop"):
+        cutoff = [low, high]
+    elif btype in ("low", "lowpass"):
+        cutoff = high
+    else:
+        cutoff = low
+
+    return butter(order, cutoff, btype=btype, fs=fs, output="sos")
+
+def bandpass_filter(data, lowcut: float, highcut: float, fs: float, order: int = 4) -> np.ndarray:
+    """Zero-phase Butterworth band-pass filter of a complete signal, using a cached design."""
+    return sosfiltfilt(design_filter(order, lowcut, highcut, fs, "band"), data)
+
+class StreamingFilter:
+    """
+    Causal SOS filter that keeps its state between calls, so a live signal can be
+    filtered one block at a time with the same result as filtering it in one piece.
+    """
+    def __init__(self, order: int, low: float, high: float, fs: float, btype: str = "band") -> None:
+        self._sos = design_filter(order, low, high, fs, btype)
+        self._zi_unit = sosfilt_zi(self._sos)
+        self._zi = None
+
+    def process(self, block) -> np.ndarray:
+        """Filter the next block of samples."""
+        block = np.asarray(block, dtype='f8')
+        if block.size == 0:
+            return block
+
+        if self._zi is None:
+            # Start in steady state for the first sample to avoid a large step transient
+            self._zi = self._zi_unit * block[0]
+
+        filtered, self._zi = sosfilt(self._sos, block, zi=self._zi)
+        return filtered
+
+    def reset(self) -> None:
+        self._zi = None
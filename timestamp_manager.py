@@ -1,5 +1,7 @@
 from datetime import datetime
 import threading
+import time
+import numpy as np
 
 class TimestampManager:
     _instance = None  
@@ -18,8 +20,52 @@ class TimestampManager:
             self.lock = threading.Lock()
             self.condition = threading.Condition(self.lock)
             self.timestamp_event = threading.Event()
+            self.resync_clock()
             print("Timestamp manager initialized...")
 
+    def resync_clock(self) -> None:
+        """
+        Anchors the monotonic clock used by get_unix_fast() to the current wall clock time.
+        Called at the start of every streaming session, so a wall clock step during the
+        server's uptime (e.g. an NTP sync) does not separate the sensor times from the
+        datetime.now() stamps used elsewhere.
+        """
+        # One tuple, so a concurrent get_unix_fast() never mixes an old and a new anchor
+        self._anchor = (time.perf_counter_ns(), time.time())
+
+    def get_unix_fast(self) -> float:
+        """
+        Returns the current unix time in seconds without taking a lock or creating a
+        datetime. The value is derived from time.perf_counter_ns() anchored to the wall
+        clock at the last resync_clock(), so it is monotonic between resyncs and cheap
+        enough for per-sample hot paths.
+        """
+        anchor_ns, anchor_unix = self._anchor
+        return anchor_unix + (time.perf_counter_ns() - anchor_ns) * 1e-9
+
+    @staticmethod
+    def format_iso(unix_times) -> np.ndarray:
+        """
+        Formats an array of unix timestamps as local ISO 8601 strings in one pass.
+        Used at export time so the hot paths only have to store float timestamps.
+        Args:
+            unix_times (array-like): Unix timestamps in seconds.
+        Returns:
+            np.ndarray: The ISO 8601 strings (microsecond precision).
+        """
+        unix_times = np.asarray(unix_times, dtype='f8')
+        if unix_times.size == 0:
+            return np.array([], dtype=str)
+
+        first_offset = datetime.fromtimestamp(unix_times[0]).astimezone().utcoffset().total_seconds()
+        last_offset = datetime.fromtimestamp(unix_times[-1]).astimezone().utcoffset().total_seconds()
+        if first_offset != last_offset:
+            # The local UTC offset changed (DST) during the recording
+            return np.array([datetime.fromtimestamp(t).isoformat(timespec='microseconds') for t in unix_times])
+
+        local_us = np.round((unix_times + first_offset) * 1e6).astype('int64').astype('datetime64[us]')
+        return np.datetime_as_string(local_us, unit='us')
+
     def update_timestamp(self):
         with self.lock:
             self.current_timestamp = datetime.now()
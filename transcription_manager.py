@@ -2,6 +2,7 @@ import whisper
 import warnings
 import threading
 import re
+import numpy as np
 
 class TranscriptionManager:
     def __init__(self):
@@ -67,11 +68,16 @@ class TranscriptionManager:
         This method creates a new thread to handle the transcription of the provided
         audio file. It waits for the transcription to complete and then returns the result.
         Args:
-            audio_file (str): The path to the audio file to be transcribed.
+            audio_file (str or np.ndarray): The path to the audio file to be transcribed, or
+                the audio itself as float32 16 kHz mono samples (see
+                RecordingManager.get_resampled_audio()), which skips decoding the file with ffmpeg.
         Returns:
             str: The transcription result of the audio file, or None if filtered out.
         """
         try:
+            if isinstance(audio_file, np.ndarray):
+                audio_file = audio_file.astype(np.float32, copy=False)
+
             result = self.model.transcribe(
                 audio_file,
                 language="en",
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import struct
+import numpy as np
+from bleak import BleakClient, BleakScanner
+
+"""
+asyncio-native client for Go Direct devices over BLE. Instead of polling the
+device with godirect's blocking read() in a thread, the client subscribes to the
+response characteristic and decodes measurement packets in the notification
+callback, handing every packet's samples to a callback as soon as it arrives.
+Commands are written to the command characteristic and their responses awaited
+on a future, so nothing sleeps or spins while waiting.
+
+The packet layout follows the godirect package (device.py): commands start with
+0x58, measurements with 0x20, and byte 1 of every packet is its total length.
+"""
+
+GDX_COMMAND_UUID = "f4bf14a6-c7d5-4b6d-8aa8-df1a7c83adcb"
+GDX_RESPONSE_UUID = "b41e6675-a329-40e0-aa01-44d2f444babe"
+
+COMMAND_HEADER = 0x58
+RESPONSE_MEASUREMENT = 0x20
+
+CMD_ID_START_MEASUREMENTS = 0x18
+CMD_ID_STOP_MEASUREMENTS = 0x19
+CMD_ID_INIT = 0x1A
+CMD_ID_SET_MEASUREMENT_PERIOD = 0x1B
+CMD_ID_GET_SENSOR_INFO = 0x50
+CMD_ID_DISCONNECT = 0x54
+
+MEASUREMENT_TYPE_NORMAL_REAL32 = 0x06
+MEASUREMENT_TYPE_WIDE_REAL32 = 0x07
+
+INIT_PAYLOAD = bytes([
+    0xa5, 0x4a, 0x06, 0x49, 0x07, 0x48, 0x08, 0x47, 0x09, 0x46,
+    0x0a, 0x45, 0x0b, 0x44, 0x0c, 0x43, 0x0d, 0x42, 0x0e, 0x41
+])
+SENSOR_INFO_FORMAT = "<bBIBB60s32sdddIQIII"
+BLE_CHUNK_BYTES = 20
+COMMAND_TIMEOUT = 5.0
+
+def build_command(command_id: int, payload: bytes, counter: int) -> bytes:
+    """
+    Frame a command packet: header, length, rolling counter, checksum, command id, payload.
+    The checksum is the sum of all other bytes, modulo 256.
+    """
+    packet = bytearray([COMMAND_HEADER, 5 + len(payload), counter & 0xFF, 0x00, command_id])
+    packet += payload
+    packet[3] = sum(packet) & 0xFF
+    return bytes(packet)
+
+def parse_measurement(packet: bytes) -> tuple:
+    """
+    Decode a measurement packet.
+    Returns:
+        tuple: (sensor_numbers, values) with 'values' a float32 array of shape
+        (samples, len(sensor_numbers)), oldest sample first, or None if the packet
+        is not a periodic REAL32 measurement (start time, dropped, period, ...).
+    """
+    if len(packet) < 5 or packet[0] != RESPONSE_MEASUREMENT:
+        return None
+
+    measurement_type = packet[4]
+    if measurement_type == MEASUREMENT_TYPE_NORMAL_REAL32:
+        sensor_mask = struct.unpack_from("<H", packet, 5)[0]
+        value_count = packet[7]
+        offset = 9
+    elif measurement_type == MEASUREMENT_TYPE_WIDE_REAL32:
+        sensor_mask = struct.unpack_from("<I", packet, 5)[0]
+        value_count = packet[9]
+        offset = 11
+    else:
+        return None
+
+    sensor_numbers = [i for i in range(32) if sensor_mask & (1 << i)]
+    # Samples are sent one after another, each holding one value per sensor in mask order
+    values = np.frombuffer(packet, dtype='<f4', count=value_count * len(sensor_numbers), offset=offset)
+    return sensor_numbers, values.reshape(value_count, len(sensor_numbers))
+
+async def discover(name_prefix: str = "GDX", timeout: float = 5.0) -> list:
+    """
+    Scan for Go Direct devices.
+    Returns:
+        list: (name, address, rssi) tuples, strongest signal (closest device) first.
+    """
+    found = await BleakScanner.discover(timeout=timeout, return_adv=True)
+    devices = [
+        (device.name, device.address, adv.rssi)
+        for device, adv in found.values()
+        if device.name and device.name.startswith(name_prefix)
+    ]
+    return sorted(devices, key=lambda device: device[2], reverse=True)
+
+class GoDirectBLEClient:
+    """
+    Streams measurements of a Go Direct device over BLE. All coroutines must run on
+    the same event loop; on_samples(arrival, samples) is called on that loop with the
+    arrival time (from 'clock') and a {sensor_description: [values, oldest first]} dict.
+    on_disconnect() is called if the link drops while streaming.
+    """
+    def __init__(self, on_samples, clock, on_disconnect=None, name_prefix: str = "GDX",
+                 scan_timeout: float = 5.0) -> None:
+        self._logger = logging.getLogger(__name__)
+        self.on_samples = on_samples
+        self.clock = clock
+        self.on_disconnect = on_disconnect
+        self.name_prefix = name_prefix
+        self.scan_timeout = scan_timeout
+        self.client = None
+        self.name = None
+        self.sensor_descriptions = {}
+        self._counter = 0xFF
+        self._buffer = bytearray()
+        self._response = None
+        self._command_lock = None
+        self._streaming = False
+
+    @property
+    def is_connected(self) -> bool:
+        return self.client is not None and self.client.is_connected
+
+    async def connect(self, address: str = None, name: str = None) -> bool:
+        """
+        Connect to the device at 'address', else to the device called 'name' (e.g. "GDX-RB 0K1000A1"),
+        else to the first device whose name starts with name_prefix.
+        """
+        self._command_lock = asyncio.Lock()
+        if address is not None:
+            device = await BleakScanner.find_device_by_address(address, timeout=self.scan_timeout)
+        else:
+            device = await BleakScanner.find_device_by_filter(
+                lambda d, adv: bool(d.name) and (d.name == name if name else d.name.startswith(self.name_prefix)),
+                timeout=self.scan_timeout
+            )
+        if device is None:
+            return False
+
+        self.name = device.name
+        self.client = BleakClient(device, disconnected_callback=self._disconnected)
+        await self.client.connect()
+        await self.client.start_notify(GDX_RESPONSE_UUID, self._notify)
+
+        self._counter = 0xFF
+        return await self._command(CMD_ID_INIT, INIT_PAYLOAD) is not None
+
+    async def start(self, sensor_numbers: list, period_ms: int) -> bool:
+        """Look up the sensor descriptions, set the sampling period and start measurements."""
+        for number in sensor_numbers:
+            response = await self._command(CMD_ID_GET_SENSOR_INFO, bytes([number]))
+            if response is None:
+                return False
+            description = struct.unpack_from(SENSOR_INFO_FORMAT, response, 6)[5]
+            self.sensor_descriptions[number] = description.split(b"\0", 1)[0].decode("utf-8")
+
+        period_us = struct.pack("<I", int(period_ms * 1000))
+        if await self._command(CMD_ID_SET_MEASUREMENT_PERIOD, bytes([0xFF, 0x00]) + period_us + bytes(4)) is None:
+            return False
+
+        sensor_mask = sum(1 << number for number in sensor_numbers)
+        self._streaming = True
+        if await self._command(CMD_ID_START_MEASUREMENTS, bytes([0xFF, 0x01]) + struct.pack("<I", sensor_mask) + bytes(8)) is None:
+            self._streaming = False
+            return False
+        return True
+
+    async def stop(self) -> None:
+        """Stop measurements and disconnect."""
+        self._streaming = False
+        if not self.is_connected:
+            return
+
+        try:
+            await self._command(CMD_ID_STOP_MEASUREMENTS, bytes([0xFF, 0x00, 0xFF, 0xFF, 0xFF, 0xFF]))
+            await self._command(CMD_ID_DISCONNECT, b"", wait=False)
+            await self.client.stop_notify(GDX_RESPONSE_UUID)
+        finally:
+            await self.client.disconnect()
+
+    async def _command(self, command_id: int, payload: bytes, wait: bool = True) -> bytes:
+        """Write a command in BLE-sized chunks and return its response packet (None on timeout)."""
+        async with self._command_lock:
+            self._counter = (self._counter - 1) & 0xFF
+            packet = build_command(command_id, payload, self._counter)
+            loop = asyncio.get_running_loop()
+            self._response = loop.create_future() if wait else None
+
+            for offset in range(0, len(packet), BLE_CHUNK_BYTES):
+                await self.client.write_gatt_char(GDX_COMMAND_UUID, packet[offset:offset + BLE_CHUNK_BYTES], response=False)
+            if not wait:
+                return None
+
+            try:
+                return await asyncio.wait_for(self._response, COMMAND_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._logger.warning("Timeout waiting for the response to command 0x%02X", command_id)
+                return None
+            finally:
+                self._response = None
+
+    def _notify(self, _characteristic, data: bytearray) -> None:
+        """Reassemble packets split across notifications and dispatch them."""
+        self._buffer += data
+        while len(self._buffer) >= 2 and len(self._buffer) >= self._buffer[1]:
+            length = self._buffer[1]
+            if length == 0:
+                self._buffer.clear()
+                return
+            packet = bytes(self._buffer[:length])
+            del self._buffer[:length]
+
+            if packet[0] == RESPONSE_MEASUREMENT:
+                self._handle_measurement(packet)
+            elif self._response is not None and not self._response.done():
+                self._response.set_result(packet)
+
+    def _handle_measurement(self, packet: bytes) -> None:
+        arrival = self.clock()
+        try:
+            measurement = parse_measurement(packet)
+            if measurement is None:
+                return
+            sensor_numbers, values = measurement
+            samples = {
+                self.sensor_descriptions.get(number, str(number)): values[:, column].tolist()
+                for column, number in enumerate(sensor_numbers)
+            }
+            self.on_samples(arrival, samples)
+
+        except Exception as e:
+            self._logger.error("Error handling measurement packet: %s", e)
+
+    def _disconnected(self, _client) -> None:
+        if self._streaming:
+            self._streaming = False
+            if self.on_disconnect is not None:
+                self.on_disconnect()
@@ -1,12 +1,22 @@
-""" When started, the class connects to a Go Direct device via USB (if USB 
+""" When started, the class connects to a Go Direct device via USB (if USB
 is not connected, then it searches for the nearest GoDirect device via Bluetooth)
-and starts reading measurements from the default sensor at a period of 
-1000ms (1 sample/second). 
+and starts reading measurements from the force and respiration rate sensors at
+a period of 'period_ms' milliseconds (100 ms by default, 10 ms at the fastest).
+
+Several devices can be streamed at once, either by name (e.g. "GDX-RB 0K1000A1",
+as printed on the device) or as the 'num_devices' closest devices. Each device
+(VernierDevice) has its own reader and its own 'data' and 'gaps' datasets in
+the session's HDF5 file: at the file root for a single device, otherwise in
+the 'devices/<name>' group.
 
 If you want to enable specific sensors, you will need to know the sensor numbers.
 Run the example called 'gdx_getting_started_device_info.py' to get that information.
 
 Installation of the godirect package is required using 'pip3 install godirect'
+
+With backend='ble' the godirect polling threads are replaced by GoDirectBLEClient
+(vernier_ble.py), which runs on an asyncio event loop and writes the samples of
+every BLE notification as it arrives.
 """
 
 from godirect import GoDirect
@@ -14,53 +24,602 @@ from gdx import gdx
 import asyncio
 import logging
 from timestamp_manager import TimestampManager
+import threading
 from threading import Thread
 from collections import deque
 import os
-import pandas as pd
 from datetime import datetime, timezone
 import time
 import h5py
 import numpy as np
 import scipy.signal as signal
 from bleak import BleakClient, BleakError
+import hdf5_export
+import vernier_ble
+from vernier_ble import GoDirectBLEClient
+from hdf5_storage import (BufferedHDF5Writer, LabelCodes, create_extendable_dataset, read_time_range, valid_rows,
+                          LABEL_CODE_DTYPE, GAP_DTYPE)
 
-class VernierManager:
-    def __init__(self):
+class VernierDevice:
+    """
+    One Go Direct device of a VernierManager session: its connection (godirect or BLE),
+    reader, 'data' and 'gaps' datasets, reconnects and throughput/latency stats.
+    """
+    # Reads are buffered and written to the HDF5 file in blocks of WRITE_BLOCK_ROWS rows,
+    # or after FLUSH_INTERVAL seconds, whichever comes first
+    WRITE_BLOCK_ROWS = 256
+    FLUSH_INTERVAL = 1.0
+    # A lost device is reopened with exponential backoff between these delays (seconds)
+    RECONNECT_MIN_DELAY = 0.5
+    RECONNECT_MAX_DELAY = 10.0
+    # Throughput and latency are averaged over the reads of the last STATS_WINDOW seconds
+    STATS_WINDOW = 5.0
+
+    def __init__(self, manager: "VernierManager", name: str = None, handle=None, address: str = None) -> None:
+        """
+        Args:
+            manager (VernierManager): The session the device belongs to.
+            name (str): The device name, e.g. "GDX-RB 0K1000A1". None takes the device given
+                        by 'handle' or 'address' (its name is known once it is open).
+            handle (GoDirectDevice): A device found by a godirect scan, opened on the first start.
+            address (str): The BLE address of the device (BLE backend).
+        """
+        self.manager = manager
+        self.name = name
+        self._handle = handle
+        self.address = address
         self._device = None
         self._sensors = None
+        self._ble_client = None
+        self.thread = None
+        self.group = None
+        self._dataset = None
+        self.writer = None
+        self._gaps_dataset = None
+        self._gaps = []  # [start_unix, end_unix (None while disconnected)]
+        self._gap_row_offset = 0
+        self._reconnect_task = None
+        self._num_disconnects = 0
+        self._last_sample_time = None
+        self.marker_codes = LabelCodes('event_marker', [manager.event_marker])
+        self.condition_codes = LabelCodes('condition', [manager.condition])
+        self._event_marker_code = self.marker_codes.code(manager.event_marker)
+        self._condition_code = self.condition_codes.code(manager.condition)
+        self._current_row = {"timestamp_unix": None, "force": None, "RR": None, "event_marker": self._event_marker_code, "condition": self._condition_code}
+        self._stats_lock = threading.Lock()
+        self._reads = deque()  # (arrival, samples, write_seconds) of the last STATS_WINDOW seconds
+        self._total_reads = 0
+        self._total_samples = 0
+
+    @property
+    def active(self) -> bool:
+        return self.manager.running and self.manager.streaming
+
+    @property
+    def reconnecting(self) -> bool:
+        """True while the device is lost and being reopened."""
+        return bool(self._gaps) and self._gaps[-1][1] is None
+
+    @property
+    def gaps(self) -> list:
+        """The (start_unix, end_unix) intervals during which the device was disconnected; end_unix is None while it still is."""
+        return [tuple(gap) for gap in self._gaps]
+
+    def set_event(self, event_marker: str, condition: str) -> None:
+        self._event_marker_code = self.marker_codes.code(event_marker)
+        self._condition_code = self.condition_codes.code(condition)
+
+    ###########################################
+    # Datasets
+    ###########################################
+    def open_datasets(self, group) -> None:
+        """Open (or create) the device's 'data' and 'gaps' datasets in an HDF5 file or group."""
+        self.group = group
+        if 'data' not in group:
+            # The ISO 'timestamp' column is derived from timestamp_unix at export time
+            dtype = np.dtype([
+                ('timestamp_unix', 'f8'),
+                ('force', 'f4'),
+                ('RR', 'f4'),
+                ('event_marker', LABEL_CODE_DTYPE),
+                ('condition', LABEL_CODE_DTYPE)
+            ])
+            self._dataset = create_extendable_dataset(group, 'data', dtype)
+        else:
+            self._dataset = group['data']
+
+        self.writer = BufferedHDF5Writer(
+            self._dataset, block_rows=self.WRITE_BLOCK_ROWS, flush_interval=self.FLUSH_INTERVAL,
+            index_field='timestamp_unix'
+        )
+
+        if 'gaps' not in group:
+            create_extendable_dataset(group, 'gaps', GAP_DTYPE, chunk_rows=64)
+        self._gaps_dataset = group['gaps']
+        self._gap_row_offset = valid_rows(self._gaps_dataset)
+        self._gaps = []
+
+        # Continue the label codes of the file (it is opened in append mode)
+        self.marker_codes = LabelCodes.from_dataset(self._dataset, 'event_marker')
+        self.condition_codes = LabelCodes.from_dataset(self._dataset, 'condition')
+        self.set_event(self.manager.event_marker, self.manager.condition)
+
+    def close_datasets(self) -> None:
+        """Write the buffered rows and trim the datasets to the rows actually written."""
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self._gaps_dataset is not None:
+            self._gaps_dataset.resize((valid_rows(self._gaps_dataset),))
+            self._gaps_dataset = None
+        self._dataset = None
+
+    def flush(self) -> None:
+        if self.writer is not None:
+            self.writer.flush()
+
+    ###########################################
+    # godirect backend
+    ###########################################
+    def open(self) -> bool:
+        """Open and start the device with godirect. Returns True on success."""
+        if self._handle is not None:
+            self._device, self._handle = self._handle, None
+        else:
+            self._device = self.manager.find_device(self.name)
+
+        if self._device is None or not self._device.open(auto_start=False):
+            self._device = None
+            return False
+
+        sensor_list = self._device.list_sensors()
+        print("Sensors found: "+ str(sensor_list))
+        self._device.enable_sensors(self.manager.SENSOR_NUMBERS)
+        self._device.start(period=self.manager.period_ms)
+        self._sensors = self._device.get_enabled_sensors()
+        self.name = self._device.name
+        return True
+
+    def close(self) -> None:
+        """Stop and close the godirect device, ignoring errors of a lost device."""
+        try:
+            if self._device is not None:
+                self._device.stop()
+                self._device.close()
+                print("\nDisconnected from "+self._device.name)
+
+        except Exception as e:
+            print(f"Error stopping or closing device. Device is likely disconnected: {e}")
+
+        self._device = None
+        self._sensors = None
+
+    def run(self) -> None:
+        self.thread = Thread(target=self.collect_data, daemon=True)
+        self.thread.start()
+
+    def join(self) -> None:
+        if self.thread is not None and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def collect_data(self):
+        while self.active:
+            try:
+                if self._device.read():
+                    arrival = self.manager.timestamp_manager.get_unix_fast()
+                    force_values = []
+                    rr_values = []
+
+                    # sensor.values holds every sample received since the last clear(),
+                    # which is more than one at short periods
+                    for sensor in self._sensors:
+                        if sensor.sensor_description == "Force":
+                            force_values = list(sensor.values)
+                        elif sensor.sensor_description == "Respiration Rate":
+                            rr_values = list(sensor.values)
+                        sensor.clear()
+
+                    if force_values or rr_values:
+                        self.write_samples(arrival, force_values, rr_values)
+                    else:
+                        print(f"Error reading force and respiration rate sensors of {self.name}.")
+                    continue
+
+                print(f"DEVICE {self.name} HAS DISCONNECTED - RECONNECTING...")
+
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                print(f"DEVICE {self.name} HAS CRASHED - RECONNECTING...")
+
+            # The file stays open; the data is exported once the session is stopped
+            if not self._reconnect():
+                return
+
+    def _reconnect(self) -> bool:
+        """
+        Reopen a lost godirect device with exponential backoff until it is back or the
+        manager is stopped. The HDF5 file stays open and the outage is recorded as a gap.
+        Returns:
+            bool: True if the device is streaming again.
+        """
+        self._begin_gap()
+        self.close()
+        delay = self.RECONNECT_MIN_DELAY
+        attempts = 0
+
+        while self.active:
+            attempts += 1
+            try:
+                if self.open():
+                    self.end_gap()
+                    print(f"Reconnected to {self.name} after {attempts} attempt(s).")
+                    return True
+
+            except Exception as e:
+                print(f"Reconnect attempt {attempts} of {self.name} failed: {e}")
+
+            self.close()
+            if self.manager.stop_event.wait(delay):
+                break
+            delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+        return False
+
+    ###########################################
+    # BLE backend (coroutines run on the manager's event loop)
+    ###########################################
+    async def ble_connect(self) -> bool:
+        self._ble_client = GoDirectBLEClient(
+            self._on_ble_samples, self.manager.timestamp_manager.get_unix_fast, on_disconnect=self._on_ble_disconnect
+        )
+        if not await self._ble_client.connect(address=self.address, name=self.name):
+            return False
+        self.name = self._ble_client.name
+        return True
+
+    async def ble_start(self) -> bool:
+        return await self._ble_client.start(self.manager.SENSOR_NUMBERS, self.manager.period_ms)
+
+    async def ble_shutdown(self) -> None:
+        """Cancel a pending reconnect, stop measurements and disconnect."""
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._ble_client is not None:
+            await self._ble_client.stop()
+            print("\nDisconnected from " + str(self.name))
+
+    def _on_ble_samples(self, arrival: float, samples: dict) -> None:
+        """Called on the event loop for every measurement packet."""
+        if not self.active:
+            return
+        self.write_samples(arrival, samples.get("Force", []), samples.get("Respiration Rate", []))
+
+    def _on_ble_disconnect(self) -> None:
+        """Called on the event loop when the link drops while streaming."""
+        if not self.active:
+            return
+        print(f"DEVICE {self.name} HAS DISCONNECTED - RECONNECTING...")
+        self._begin_gap()
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._ble_reconnect())
+
+    async def _ble_reconnect(self) -> None:
+        """The BLE counterpart of _reconnect(), run as a task on the manager's event loop."""
+        delay = self.RECONNECT_MIN_DELAY
+        attempts = 0
+
+        while self.active:
+            attempts += 1
+            try:
+                if await self._ble_client.connect(address=self.address, name=self.name) and await self.ble_start():
+                    self.end_gap()
+                    print(f"Reconnected to {self.name} after {attempts} attempt(s).")
+                    return
+                await self._ble_client.stop()
+
+            except Exception as e:
+                print(f"Reconnect attempt {attempts} of {self.name} failed: {e}")
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+
+    ###########################################
+    # Gaps
+    ###########################################
+    def _begin_gap(self) -> None:
+        """
+        Record the start of a disconnect: flush the buffered rows, write a marker row with
+        NaN values at the current time and open an interval in the 'gaps' table.
+        """
+        now = self.manager.timestamp_manager.get_unix_fast()
+        self._num_disconnects += 1
+        self.write_samples(now, [np.nan], [np.nan], record_read=False)
+        self.flush()
+        self._gaps.append([now, None])
+        self._write_gap(len(self._gaps) - 1)
+
+    def end_gap(self) -> None:
+        """Close the open gap, if any (the session was stopped while the device was lost)."""
+        if self.reconnecting:
+            self._gaps[-1][1] = self.manager.timestamp_manager.get_unix_fast()
+            self._write_gap(len(self._gaps) - 1)
+
+    def _write_gap(self, index: int) -> None:
+        """Write (or rewrite) a gap interval in the 'gaps' table of the HDF5 file."""
+        if self._gaps_dataset is None:
+            return
+
+        try:
+            start, end = self._gaps[index]
+            row = self._gap_row_offset + index
+            if row >= self._gaps_dataset.shape[0]:
+                self._gaps_dataset.resize((max(row + 1, self._gaps_dataset.shape[0] * 2),))
+            self._gaps_dataset[row] = (start, np.nan if end is None else end)
+            self._gaps_dataset.attrs['n_rows'] = max(row + 1, int(self._gaps_dataset.attrs['n_rows']))
+            self._gaps_dataset.file.flush()
+
+        except Exception as e:
+            print(f"Error writing gap interval: {e}")
+
+    ###########################################
+    # Storage
+    ###########################################
+    def _sample_times(self, arrival: float, count: int) -> np.ndarray:
+        """
+        Reconstruct the timestamps of 'count' samples delivered by one read at 'arrival'.
+        The last sample is stamped with the arrival time and the others are spaced by the
+        sampling period. If that would overlap the previous read (late reads arrive in
+        bursts), the samples are spread evenly since the previous sample instead, so the
+        timestamps stay increasing for the binary searches in read_time_range().
+        """
+        period = self.manager.period_ms / 1000.0
+        previous = self._last_sample_time
+        if previous is not None and arrival < previous:
+            # The clock was resynced backwards by another session start
+            arrival = previous
+        times = arrival - period * np.arange(count - 1, -1, -1)
+        if previous is not None and times[0] <= previous:
+            times = previous + (arrival - previous) * np.arange(1, count + 1) / count
+        self._last_sample_time = arrival
+        return times
+
+    def write_samples(self, arrival: float, force_values: list, rr_values: list, record_read: bool = True) -> None:
+        """
+        Buffer all samples of one read. The force and respiration rate lists are aligned on
+        their last (most recent) sample; a shorter list is padded with NaN at the start.
+        Args:
+            arrival (float): Unix time at which the read returned.
+            force_values (list): The force samples of the read, oldest first.
+            rr_values (list): The respiration rate samples of the read, oldest first.
+            record_read (bool): Count the samples in the read statistics (False for gap markers).
+        """
+        try:
+            if self.writer is None:
+                print("HDF5 file or dataset is not initialized.")
+                return
+
+            count = max(len(force_values), len(rr_values))
+            if count == 0:
+                return
+
+            times = self._sample_times(arrival, count)
+            force = np.full(count, np.nan, dtype='f4')
+            rr = np.full(count, np.nan, dtype='f4')
+            if force_values:
+                force[count - len(force_values):] = [np.nan if v is None else v for v in force_values]
+            if rr_values:
+                rr[count - len(rr_values):] = [np.nan if v is None else v for v in rr_values]
+
+            if 'timestamp' in self._dataset.dtype.names or self._dataset.dtype['event_marker'].kind == 'O':
+                # Files created before the current layout are written row by row
+                for timestamp_unix, f, r in zip(times.tolist(), force.tolist(), rr.tolist()):
+                    self.write_to_hdf5({"timestamp_unix": timestamp_unix, "force": f, "RR": r,
+                                        "event_marker": self._event_marker_code, "condition": self._condition_code})
+                return
+
+            self.marker_codes.save(self._dataset)
+            self.condition_codes.save(self._dataset)
+            rows = np.empty(count, dtype=self._dataset.dtype)
+            rows['timestamp_unix'] = times
+            rows['force'] = force
+            rows['RR'] = rr
+            rows['event_marker'] = self._event_marker_code
+            rows['condition'] = self._condition_code
+            self.writer.append_rows(rows)
+
+            self._current_row.update({
+                "timestamp_unix": float(times[-1]), "force": float(force[-1]), "RR": float(rr[-1]),
+                "event_marker": self._event_marker_code, "condition": self._condition_code
+            })
+            if record_read:
+                self._record_read(arrival, count)
+
+        except Exception as e:
+            print(f"Error writing to HDF5: {e}")
+
+    def write_to_hdf5(self, row: dict) -> None:
+        """Buffer the incoming dictionary as a single row. Rows reach the file in blocks (see flush())."""
+        try:
+            if self.writer is None:
+                print("HDF5 file or dataset is not initialized.")
+                return
+
+            timestamp_unix = row.get('timestamp_unix', np.nan)
+            force = row.get('force')
+            rr = row.get('RR')
+            event_marker = row.get('event_marker', self._event_marker_code)
+            condition = row.get('condition', self._condition_code)
+            if self._dataset.dtype['event_marker'].kind == 'O':
+                # Files created before event markers and conditions were coded
+                event_marker = self.marker_codes.label(event_marker)
+                condition = self.condition_codes.label(condition)
+            else:
+                self.marker_codes.save(self._dataset)
+                self.condition_codes.save(self._dataset)
+
+            values = (
+                np.nan if force is None else force,
+                np.nan if rr is None else rr,
+                event_marker,
+                condition
+            )
+            if 'timestamp' in self._dataset.dtype.names:
+                # Files created before ISO strings were deferred to export
+                self.writer.append((timestamp_unix, datetime.fromtimestamp(timestamp_unix).isoformat()) + values)
+            else:
+                self.writer.append((timestamp_unix,) + values)
+
+        except Exception as e:
+            print(f"Error writing to HDF5: {e}")
+
+    def read_time_range(self, start_unix: float, end_unix: float = None) -> np.ndarray:
+        """Returns the rows of the open dataset with start_unix <= timestamp_unix < end_unix."""
+        self.writer.flush()
+        return read_time_range(self._dataset, start_unix, end_unix,
+                               num_rows=self.writer.rows_written, index=self.writer.time_index)
+
+    ###########################################
+    # Stats
+    ###########################################
+    def _record_read(self, arrival: float, samples: int) -> None:
+        write_seconds = self.manager.timestamp_manager.get_unix_fast() - arrival
+        with self._stats_lock:
+            self._total_reads += 1
+            self._total_samples += samples
+            self._reads.append((arrival, samples, write_seconds))
+            while self._reads and self._reads[0][0] < arrival - self.STATS_WINDOW:
+                self._reads.popleft()
+
+    def get_stats(self) -> dict:
+        """
+        Returns the throughput and latency of the device over the last STATS_WINDOW seconds:
+        reads and samples per second, the interval between reads (how late data arrives) and
+        the time from the arrival of a read until its rows are buffered for writing.
+        """
+        now = self.manager.timestamp_manager.get_unix_fast()
+        with self._stats_lock:
+            reads = list(self._reads)
+            total_reads = self._total_reads
+            total_samples = self._total_samples
+
+        stats = {
+            "name": self.name,
+            "connected": not self.reconnecting,
+            "disconnects": self._num_disconnects,
+            "total_reads": total_reads,
+            "total_samples": total_samples,
+            "reads_per_second": 0.0,
+            "samples_per_second": 0.0,
+            "read_interval_ms_mean": None,
+            "read_interval_ms_max": None,
+            "write_latency_ms_mean": None,
+            "write_latency_ms_max": None,
+            "seconds_since_last_read": now - reads[-1][0] if reads else None
+        }
+        if len(reads) >= 2:
+            arrivals = np.array([read[0] for read in reads])
+            span = arrivals[-1] - arrivals[0]
+            intervals = np.diff(arrivals) * 1000.0
+            if span > 0:
+                stats["reads_per_second"] = (len(reads) - 1) / span
+                stats["samples_per_second"] = sum(read[1] for read in reads[1:]) / span
+            stats["read_interval_ms_mean"] = float(intervals.mean())
+            stats["read_interval_ms_max"] = float(intervals.max())
+        if reads:
+            latencies = np.array([read[2] for read in reads]) * 1000.0
+            stats["write_latency_ms_mean"] = float(latencies.mean())
+            stats["write_latency_ms_max"] = float(latencies.max())
+        return stats
+
+class VernierManager:
+    DEFAULT_PERIOD_MS = 100
+    MIN_PERIOD_MS = 10
+    # 'godirect' polls the devices with godirect's blocking read() in one thread per device,
+    # 'ble' streams BLE notifications with the asyncio-native GoDirectBLEClient
+    BACKENDS = ('godirect', 'ble')
+    SENSOR_NUMBERS = [1, 2]  # Force and Respiration Rate
+    BLE_TIMEOUT = 30.0
+
+    def __init__(self, period_ms: int = DEFAULT_PERIOD_MS, backend: str = 'godirect', device_names: list = None,
+                 num_devices: int = 1):
+        """
+        Args:
+            period_ms (int): The sampling period (see period_ms).
+            backend (str): 'godirect' or 'ble' (see BACKENDS).
+            device_names (list): Names of the devices to stream, e.g. ["GDX-RB 0K1000A1", "GDX-FOR 071000U9"].
+            num_devices (int): Without device_names, the number of devices to stream, closest first
+                               (USB devices before Bluetooth devices).
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown Vernier backend '{backend}', expected one of {self.BACKENDS}.")
+        self.backend = backend
+        self.device_names = list(device_names) if device_names else None
+        self.num_devices = len(self.device_names) if self.device_names else num_devices
+        self.devices = []
         self.timestamp_manager = TimestampManager()
         self._event_marker = "start_up"
         self._condition = 'None'
-        self._subject_id = None
         self.hdf5_file = None
         self.hdf5_filename = None
         self.csv_filename = None
+        self.parquet_filename = None
         self.data_folder = None
-        self.thread = None
         self._running = False
         self._streaming = False
-        self._current_row = {"timestamp_unix": None, "timestamp": None, "force": None, "RR": None, "event_marker": self._event_marker, "condition": self._condition}
         self._device_started = False
         self._event_loop = None
-        self._crashed = False
-        self._num_crashes = 0
+        self._loop_thread = None
         self._godirect = None
-        self._dataset = None
+        self._scan_lock = threading.Lock()
+        self.stop_event = threading.Event()
         self._file_opened = False
+        self.export_job = None
+        self._period_ms = None
+        self.period_ms = period_ms
+
+    @property
+    def period_ms(self) -> int:
+        """The sampling period in milliseconds. Takes effect on the next start()."""
+        return self._period_ms
+
+    @period_ms.setter
+    def period_ms(self, value: int) -> None:
+        if value < self.MIN_PERIOD_MS:
+            raise ValueError(f"The sampling period must be at least {self.MIN_PERIOD_MS} ms.")
+        self._period_ms = int(value)
+
+    @property
+    def multi_device(self) -> bool:
+        """True if the devices are stored in 'devices/<name>' groups instead of the file root."""
+        return self.num_devices > 1
+
+    @property
+    def reconnecting(self) -> bool:
+        """True while any device is lost and being reopened."""
+        return any(device.reconnecting for device in self.devices)
+
+    @property
+    def gaps(self) -> dict:
+        """The disconnect intervals of each device (see VernierDevice.gaps)."""
+        return {device.name: device.gaps for device in self.devices}
+
+    @property
+    def streaming(self) -> bool:
+        return self._streaming
 
     @property
     def device_started(self):
         return self._device_started
-    
+
     @device_started.setter
     def device_started(self, value):
         self._device_started = value
 
-    @property 
+    @property
     def running(self):
         return self._running
-    
+
     @running.setter
     def running(self, value):
         self._running = value
@@ -68,18 +627,25 @@ class VernierManager:
     @property
     def event_marker(self):
         return self._event_marker
-    
+
     @event_marker.setter
     def event_marker(self, value):
-        self._event_marker = value
+        self.set_event(value, self._condition)
 
     @property
     def condition(self):
         return self._condition
-    
+
     @condition.setter
     def condition(self, value):
-        self._condition = value
+        self.set_event(self._event_marker, value)
+
+    def set_event(self, event_marker: str, condition: str) -> None:
+        """Set the event marker and condition together (an EventManager subscriber)."""
+        self._event_marker = event_marker
+        self._condition = condition
+        for device in self.devices:
+            device.set_event(event_marker, condition)
 
     def set_data_folder(self, subject_folder):
         self.data_folder = os.path.join(subject_folder, "respiratory_data")
@@ -87,96 +653,64 @@ class VernierManager:
             os.makedirs(self.data_folder)
 
     def set_filenames(self, subject_id):
-        self._subject_id = subject_id
+        # Lost devices are reconnected into the same file, so there is only ever segment 0.
+        # The suffix is kept so the session file names do not change.
         current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        self.hdf5_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data_{self._num_crashes}.h5")
-        self.csv_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data_{self._num_crashes}.csv")
+        self.hdf5_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data_0.h5")
+        self.csv_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data_0.csv")
+        self.parquet_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data_0.parquet")
 
     def initialize_hdf5_file(self):
-        # current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        # current_date = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
-        # self.hdf5_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data.h5")
-        # self.csv_filename = os.path.join(self.data_folder, f"{current_date}_{subject_id}_respiratory_data.csv")
-
+        """Open the session file. The datasets of each device are created once the devices are found (see start())."""
         try:
             if not self.hdf5_filename:
                 print("HDF5 filename not set.")
                 return
 
-            if self._crashed:
-                # Rename the file
-                current_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")  
-                self.hdf5_filename = os.path.join(self.data_folder, f"{current_date}_{self._subject_id}_respiratory_data_{self._num_crashes}.h5")
-                self.csv_filename = os.path.join(self.data_folder, f"{current_date}_{self._subject_id}_respiratory_data_{self._num_crashes}.csv")
-
-            self.hdf5_file = h5py.File(self.hdf5_filename, 'a')  
-
-            if 'data' not in self.hdf5_file:  
-                dtype = np.dtype([
-                    ('timestamp_unix', 'f8'),
-                    ('timestamp', h5py.string_dtype(encoding='utf-8')),
-                    ('force', 'f4'),
-                    ('RR', 'f4'),
-                    ('event_marker', h5py.string_dtype(encoding='utf-8')),
-                    ('condition', h5py.string_dtype(encoding='utf-8'))
-                ])
-                self._dataset = self.hdf5_file.create_dataset(
-                    'data', shape=(0,), maxshape=(None,), dtype=dtype
-                )
-            else:
-                self._dataset = self.hdf5_file['data']  
-
+            self.hdf5_file = h5py.File(self.hdf5_filename, 'a')
             self._file_opened = True
-            print("HDF5 file created for emotibit data: ", self.hdf5_filename)
+            print("HDF5 file created for respiratory data: ", self.hdf5_filename)
 
         except Exception as e:
             print(f"Error initializing HDF5 file: {e}")
 
-    def reset(self) -> None:
-        # Immediately close the HDF5 file and convert it to CSV
-        try:
-            print("Reset is closing HDF5 file...")
-            self.close_h5_file()
-            self._file_opened = False
+    def _device_group(self, device: VernierDevice, index: int):
+        if not self.multi_device:
+            return self.hdf5_file
+        name = (device.name or f"device_{index}").replace('/', '_')
+        return self.hdf5_file.require_group('devices').require_group(name)
 
-            try:
-                print("Reset is converting HDF5 to CSV...")
-                self.hdf5_to_csv()
-            except Exception as inner_e:
-                print(f"Error converting HDF5 to CSV: {inner_e}")
-        except Exception as e:
-            print(f"Error closing HDF5 file: {e}")
-            
-        # Quit the GoDirect instance and close the event loop
-        try:
-            if self._godirect is not None:
-                self._godirect.quit()
-                print("GoDirect has quit.")
-            else:
-                print("No GoDirect instance to quit.")
-        except Exception as e:
-            print(f"Error quitting GoDirect: {e}")
+    ###########################################
+    # Start / Stop
+    ###########################################
+    def start(self) -> str:
+        """Find and open the devices and create their datasets in the session file."""
+        self.timestamp_manager.resync_clock()
+        if self.backend == 'ble':
+            devices = self._start_ble()
+        else:
+            devices = self._start_godirect()
 
-        try:
-            if self._event_loop and not self._event_loop.is_closed():
-                self._event_loop.close()
-                print("Event loop closed.")
-        except Exception as e:
-            print(f"Error closing event loop: {e}")
+        if devices is None:
+            return "Error"
+        if not devices:
+            print("No Go Direct device found.")
+            return "Error"
 
-        # Reset all variables except for _device_started, subject_id, and data_folder
-        self._device_started = False
-        self._event_loop = None
-        self._device = None
-        self._dataset = None
-        self._sensors = None
-        self._godirect = None
-        self._current_row = {"timestamp_unix": None, "timestamp": None, "force": None, "RR": None, "event_marker": self._event_marker, "condition": self._condition}
-        self._streaming = False
-        self.running = False
-        self.hdf5_file = None
+        self.devices = devices
+        for index, device in enumerate(self.devices):
+            if self.hdf5_file:
+                device.open_datasets(self._device_group(device, index))
+            print("Connected to " + str(device.name))
 
-    def start(self) -> str:
+        if self.device_names and len(self.devices) < len(self.device_names):
+            missing = set(self.device_names) - {device.name for device in self.devices}
+            print(f"Could not open the Vernier devices: {', '.join(sorted(missing))}")
+
+        self._device_started = True
+        return "Vernier device started."
+
+    def _start_godirect(self) -> list:
         try:
             loop = asyncio.get_event_loop()
             if hasattr(loop, "is_closed") and loop.is_closed():
@@ -188,243 +722,317 @@ class VernierManager:
             try:
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
-                
+
             except Exception as inner_e:
                 print(f"Error creating new event loop: {inner_e}")
-                return "Error"
-            
+                return None
+
         self._event_loop = loop
-        
+
         try:
             self._godirect = GoDirect(use_ble=True, use_usb=True)
             print("GoDirect v"+str(self._godirect.get_version()))
             print("\nSearching...", flush=True, end ="")
-            self._device = self._godirect.get_device(threshold=-100)
-
-            if self._device != None and self._device.open(auto_start=False):
-                sensor_list = self._device.list_sensors()
-                print("Sensors found: "+ str(sensor_list))
-                self._device.enable_sensors([1,2])
-                self._device.start(period=100) 
-                print("Connecting to Vernier device...")
-                print("Connected to " + self._device.name)
-                self._sensors = self._device.get_enabled_sensors()
-                self._device_started = True
+
+            if self.device_names:
+                devices = [VernierDevice(self, name=name) for name in self.device_names]
+            elif self.num_devices == 1:
+                devices = [VernierDevice(self, handle=self._godirect.get_device(threshold=-100))]
+            else:
+                devices = [VernierDevice(self, handle=handle) for handle in self._closest_devices(self.num_devices)]
+
+            return [device for device in devices if device.open()]
 
         except Exception as e:
             print(f"Error starting GoDirect device: {e}")
-            self._device = None
-            self._sensors = None
-            self._device_started = False
-            return "Error"
+            return None
 
-        return "Vernier device started."
-    
-    def collect_data(self):
-        if not self.running:
-            print("Go Direct device stopped.")
-            return
-        
-        while self._streaming and self.running:
-            try:
-                if self._device.read():
-                    tsu = self.timestamp_manager.get_timestamp("unix")
-                    ts = datetime.fromtimestamp(tsu).isoformat()
-                    
-                    self._current_row["timestamp_unix"] = tsu
-                    self._current_row["timestamp"] = ts
-                    self._current_row["event_marker"] = self.event_marker
-                    self._current_row["condition"] = self.condition
+    def _closest_devices(self, count: int) -> list:
+        """The 'count' closest godirect devices: USB devices first, then Bluetooth devices by signal strength."""
+        with self._scan_lock:
+            found = self._godirect.list_devices()
+        found.sort(key=lambda device: (device.type != "USB", -int(getattr(device, 'rssi', 0) or 0)))
+        return found[:count]
 
-                    for sensor in self._sensors:
-                        if sensor.sensor_description == "Force":
-                            force_value = sensor.values[0] if sensor.values else None
-                            if force_value is not None:
-                                self._current_row["force"] = force_value
-                            else:
-                                print("Error reading force sensor.")
+    def find_device(self, name: str):
+        """
+        Scan for the godirect device called 'name'. The devices share one GoDirect instance
+        and scan one at a time. Without a name, the nearest device is returned.
+        """
+        if self._event_loop is not None:
+            # godirect's BLE backend runs its coroutines on the thread's current event loop
+            asyncio.set_event_loop(self._event_loop)
 
-                        elif sensor.sensor_description == "Respiration Rate":
-                            rr_value = sensor.values[0] if sensor.values else None
+        with self._scan_lock:
+            if name is None:
+                return self._godirect.get_device(threshold=-100)
 
-                            if rr_value is not None:
-                                self._current_row["RR"] = rr_value
-                            else:
-                                print("Error reading respiration rate sensor.")
+            for device in self._godirect.list_devices():
+                if device.type == "USB":
+                    # USB devices only know their name once they are open
+                    try:
+                        matches = device.open(auto_start=False) and device.name == name
+                        device.close()
+                        if matches:
+                            return device
+                    except Exception:
+                        pass
+                elif device.name == name:
+                    return device
+        return None
 
-                        sensor.clear()
+    def _start_ble(self) -> list:
+        """Connect the devices with GoDirectBLEClient on an event loop running in its own thread."""
+        try:
+            self._event_loop = asyncio.new_event_loop()
+            self._loop_thread = Thread(target=self._run_event_loop, args=(self._event_loop,), daemon=True)
+            self._loop_thread.start()
 
-                    self.write_to_hdf5(self._current_row)
+            print("\nSearching...", flush=True)
+            if self.device_names:
+                devices = [VernierDevice(self, name=name) for name in self.device_names]
+            elif self.num_devices == 1:
+                devices = [VernierDevice(self)]
+            else:
+                found = self._run_on_loop(vernier_ble.discover())
+                devices = [VernierDevice(self, name=name, address=address) for name, address, _ in found[:self.num_devices]]
 
-                else:
-                    print("DEVICE HAS DISCONNECTED - RESTART VERNIER MANAGER.")
-                    
-                    # TODO close the hdf5 file and create csv file
-                    self._crashed = True
-                    self._num_crashes += 1
-                    self.reset()
-                    return
-            
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                print("DEVICE HAS CRASHED - RESTART VERNIER MANAGER.")
-                self._crashed = True
-                self._num_crashes += 1
-                self.reset()
-                return
+            connected = [device for device in devices if self._run_on_loop(device.ble_connect())]
+            if not connected:
+                self._stop_event_loop()
+            return connected
+
+        except Exception as e:
+            print(f"Error starting Go Direct BLE client: {e}")
+            self._stop_event_loop()
+            return None
+
+    def _run_on_loop(self, coroutine, timeout: float = None):
+        """Run a coroutine on the backend's event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop).result(timeout or self.BLE_TIMEOUT)
+
+    @staticmethod
+    def _run_event_loop(loop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+        loop.close()
+
+    def _stop_event_loop(self) -> None:
+        """Stop the backend's event loop; the loop thread closes it once it returns."""
+        if self._event_loop is None:
+            return
+
+        self._event_loop.call_soon_threadsafe(self._event_loop.stop)
+        if self._loop_thread is not None and self._loop_thread is not threading.current_thread():
+            self._loop_thread.join()
+        print("Event loop closed.")
+        self._loop_thread = None
+        self._event_loop = None
 
     def run(self):
         try:
-            # Check if the thread exists and is alive
-            # If it is, stop the existing thread
-            if self.thread is not None and self.thread.is_alive():
-                print("Stopping existing thread...")
+            # Stop the readers of a previous run
+            if any(device.thread is not None and device.thread.is_alive() for device in self.devices):
+                print("Stopping existing threads...")
                 self.running = False
                 self._streaming = False
-                self.thread.join()
-                print("Thread stopped.")
-            
-            # If the device has started, start a new thread
-            if self._device_started:
-                self.running = True
-                self._streaming = True
-                self.thread = Thread(target=self.collect_data, daemon=True)
-                self.thread.start()
-                print("Vernier manager running...")
+                self.stop_event.set()
+                for device in self.devices:
+                    device.join()
+                print("Threads stopped.")
 
-            else:
+            self.stop_event.clear()
+            if not self._device_started:
                 print("Device has not started yet.")
+                return
+
+            self.running = True
+            self._streaming = True
+            for device in self.devices:
+                if self.backend == 'ble':
+                    # Samples are written from the BLE notification callback, no reader thread is needed
+                    if not self._run_on_loop(device.ble_start()):
+                        print(f"Error starting measurements on {device.name}.")
+                else:
+                    device.run()
+            print(f"Vernier manager running with {len(self.devices)} device(s)...")
 
         except Exception as e:
             print(f"An error occurred while starting the thread: {e}")
-                 
+
+    def _close_devices(self) -> None:
+        """Stop the readers, close every device and release the backend."""
+        self.stop_event.set()
+        for device in self.devices:
+            device.join()
+
+        if self.backend == 'ble':
+            for device in self.devices:
+                try:
+                    if self._event_loop is not None:
+                        self._run_on_loop(device.ble_shutdown())
+                except Exception as e:
+                    print(f"Error stopping or closing device. Device is likely disconnected: {e}")
+            self._stop_event_loop()
+            return
+
+        for device in self.devices:
+            device.close()
+
+        try:
+            if self._godirect is not None:
+                print("Quitting GoDirect...")
+                self._godirect.quit()
+                print("GoDirect has quit.")
+        except Exception as e:
+            print(f"Error quitting GoDirect. Device already disconnected: {e}")
+        self._godirect = None
+
+        try:
+            if self._event_loop and not self._event_loop.is_closed():
+                self._event_loop.close()
+                print("Event loop closed.")
+        except Exception as e:
+            print(f"Error closing event loop: {e}")
+        self._event_loop = None
+
     def stop(self) -> str:
         try:
             self.running = False
             self._streaming = False
             print("Stopping Vernier manager...")
             if self._device_started:
-                if self.thread is not None and self.thread.is_alive():
-                    self.thread.join()
-                    print("Thread stopped.")
-
-                try:
-                    self._device.stop()
-                    self._device.close()
-
-                except Exception as e:
-                    print(f"Error stopping or closing device. Device is likely disconnected: {e}")
+                self._close_devices()
 
-                try:
-                    print("\nDisconnected from "+self._device.name)
-                    print("Quitting GoDirect...")
-                    self._godirect.quit()
-                
-                except Exception as e:
-                    print(f"Error quitting GoDirect. Device already disconnected: {e}")
+                # Stopped while a device was lost
+                for device in self.devices:
+                    device.end_gap()
 
                 if self._file_opened:
+                    self.flush()
                     print("Stop is closing HDF5 file...")
                     self.close_h5_file()
                     print("Stop is converting HDF5 to CSV...")
-                    self.hdf5_to_csv()
-                
+                    self.export_files()
+
                 self._device_started = False
                 print("Vernier manager stopped.")
                 return "Vernier manager stopped."
             else:
                 print("Device has not started. If device has crashed or lost connection, please restart the manager.")
                 return "Device has not started. If device has crashed or lost connection, please restart the manager."
-                
+
         except Exception as e:
             print(f"An error occurred: {e}")
             return f"An error occurred: {e}"
-        
-    def _resize_dataset(self, new_size):
-        """Resize the HDF5 dataset while ensuring thread synchronization."""
-        try:
-            current_size = self._dataset.shape[0]
-            if new_size > current_size:
-                self._dataset.resize(new_size, axis=0)
-
-        except Exception as e:
-            print(f"Error resizing dataset: {e}")
 
-    def write_to_hdf5(self, row: dict) -> None:
-        """Write the incoming dictionary to the HDF5 dataset as a single row."""
+    ###########################################
+    # Storage
+    ###########################################
+    def flush(self) -> None:
+        """Write the buffered rows of every device to the HDF5 file. Called on stop and in the crash path."""
         try:
-            if self.hdf5_file is None or self._dataset is None:
-                print("HDF5 file or dataset is not initialized.")
-                return
-
-            new_data = np.zeros(1, dtype=self._dataset.dtype)  
-            new_data[0]['timestamp_unix'] = row.get('timestamp_unix', np.nan)
-            new_data[0]['timestamp'] = row.get('timestamp', '')  
-            new_data[0]['force'] = row.get('force', np.nan)
-            new_data[0]['RR'] = row.get('RR', np.nan)
-            new_data[0]['event_marker'] = row.get('event_marker', '')
-            new_data[0]['condition'] = row.get('condition', '')
-
-            new_size = self._dataset.shape[0] + 1
-            self._resize_dataset(new_size)  
-            self._dataset[-1] = new_data[0]
+            if self.hdf5_file:
+                for device in self.devices:
+                    device.flush()
+                self.hdf5_file.flush()
 
         except Exception as e:
-            print(f"Error writing to HDF5: {e}")
+            print(f"Error flushing HDF5 file: {e}")
 
     def close_h5_file(self):
         if self.hdf5_file:
+            for device in self.devices:
+                device.close_datasets()
             self.hdf5_file.flush()
             self.hdf5_file.close()
+            self._file_opened = False
             print(f"HDF5 file '{self.hdf5_filename}' closed.")
-            return 
+            return
         else:
             print("HDF5 file is already closed or isn't initialized.")
-            return  
-        
+            return
+
+    def _get_device(self, device) -> VernierDevice:
+        """A device by name or index (None is the first device)."""
+        if device is None or isinstance(device, int):
+            return self.devices[device or 0] if self.devices else None
+        return next((d for d in self.devices if d.name == device), None)
+
+    def read_time_range(self, start_unix: float, end_unix: float = None, device=None) -> np.ndarray:
+        """
+        Returns the recorded rows of a device with start_unix <= timestamp_unix < end_unix,
+        located by binary search on the timestamp column. Works while recording and after
+        the file is closed.
+        Args:
+            start_unix (float): Start of the range (inclusive).
+            end_unix (float): End of the range (exclusive). None reads to the end.
+            device (str or int): The device name or index. Defaults to the first device.
+        """
+        try:
+            if self._file_opened and self.hdf5_file:
+                live = self._get_device(device)
+                if live is not None and live.writer is not None:
+                    return live.read_time_range(start_unix, end_unix)
+
+            with h5py.File(self.hdf5_filename, 'r') as h5_file:
+                if 'devices' in h5_file:
+                    names = list(h5_file['devices'])
+                    group = h5_file['devices'][names[device or 0] if not isinstance(device, str) else device]
+                else:
+                    group = h5_file
+                if 'data' not in group:
+                    print(f"Dataset 'data' not found in the file {self.hdf5_filename}.")
+                    return None
+                return read_time_range(group['data'], start_unix, end_unix)
+
+        except Exception as e:
+            print(f"Error reading time range from HDF5: {e}")
+            return None
+
+    def read_recent(self, seconds: float, device=None) -> np.ndarray:
+        """Returns the rows recorded in the last 'seconds' seconds."""
+        return self.read_time_range(self.timestamp_manager.get_unix_fast() - seconds, device=device)
+
+    def get_stats(self) -> dict:
+        """Returns the throughput and latency stats of each device (see VernierDevice.get_stats())."""
+        return {str(device.name): device.get_stats() for device in self.devices}
+
     def hdf5_to_csv(self):
         """
-        Convert an HDF5 file to a CSV file.
+        Convert an HDF5 file to a CSV file in this process (see export_files() for the background version).
         Dependencies:
             h5_filename (str): The path to the HDF5 file.
             csv_filename (str): The path to the CSV file to be created.
         """
         try:
-            chunk_size = 1000
-            with h5py.File(self.hdf5_filename, 'r') as h5_file:
-                if 'data' not in h5_file:
-                    print(f"Dataset 'data' not found in the file {self.hdf5_filename}.")
-                    return
-                
-                dataset = h5_file['data']
-                field_names = dataset.dtype.names
-                first_chunk = True
-
-                for start in range(0, dataset.shape[0], chunk_size):
-                    end = min(start + chunk_size, dataset.shape[0])
-                    chunk = dataset[start:end]
-
-                    chunk_dict = {
-                        field: np.char.decode(chunk[field], 'utf-8') if chunk[field].dtype.kind == 'S' 
-                            else [x.decode('utf-8') if isinstance(x, bytes) else x for x in chunk[field]]
-                        for field in field_names
-                    }
-
-                    chunk_df = pd.DataFrame(chunk_dict)
-
-                    if first_chunk:
-                        chunk_df.to_csv(self.csv_filename, mode='w', index=False, header=True)
-                        first_chunk = False
-                    else:
-                        chunk_df.to_csv(self.csv_filename, mode='a', header=False, index=False)
-            
+            hdf5_export.hdf5_to_csv(self.hdf5_filename, self.csv_filename)
             print("CSV file created successfully.")
             print(f"HDF5 file '{self.hdf5_filename}' successfully converted to CSV file '{self.csv_filename}'.")
-            return 
-        
+            return
+
         except FileNotFoundError:
             print(f"Error: The HDF5 file '{self.hdf5_filename}' was not found.")
-            return 
+            return
         except Exception as e:
             print(f"Error converting HDF5 to CSV: {e}")
-            return 
\ No newline at end of file
+            return
+
+    def export_files(self) -> hdf5_export.ExportJob:
+        """
+        Convert the (closed) HDF5 file to CSV, and to Parquet if pyarrow is installed,
+        in a separate process.
+        Returns:
+            ExportJob: The handle of the export, also kept in 'export_job'. None if it could not be started.
+        """
+        outputs = [self.csv_filename]
+        if hdf5_export.pa is not None and self.parquet_filename:
+            outputs.append(self.parquet_filename)
+
+        try:
+            self.export_job = hdf5_export.ExportJob(self.hdf5_filename, *outputs)
+            print(f"Converting '{self.hdf5_filename}' to {', '.join(outputs)} in the background...")
+        except Exception as e:
+            print(f"Error starting the CSV export: {e}")
+            self.export_job = None
+        return self.export_job